@@ -0,0 +1,463 @@
+"""
+Benchmarks for the upload pipeline and /plot
+
+ocr-batch compares per-page ("parallel") and batched vision OCR on the same
+PDF against a running backend. Every run uses ?fresh=true so no cache is
+hit; vision calls and bytes are read from the X-Upload-Report header.
+
+    python load_test.py mock-upstream --latency 1.0     # optional, see load_test.py
+    uvicorn main:app --port 8000
+    python benchmark.py ocr-batch --file Blatt.pdf --pages-per-call 2 4 8
+
+Against the real OpenAI API this costs one full OCR of the document per run.
+
+plot-eval runs locally (no server) and compares the former eval()-based
+function evaluation of /plot with plot_engine:
+
+    python benchmark.py plot-eval --points 100 2000
+
+plot-payload (local) compares response size and serialization time of the
+legacy /plot response (Chart.js config as string) and the compact formats:
+
+    python benchmark.py plot-payload
+
+plot-classifier (local) runs the /plot pre-classifier over a labeled set of
+subtasks (label = what the model is expected to answer) and reports hit
+rate and disagreements; live numbers come from PLOT_CLASSIFIER_SHADOW_RATE
+and /cache-stats:
+
+    python benchmark.py plot-classifier
+
+plot-implicit (local) traces implicit curves F(x, y) = 0 with
+plot_engine.implicit_curve() and compares with one full-resolution grid:
+
+    python benchmark.py plot-implicit
+
+segmenter (local) runs task_segmenter.segment_tasks() over worksheet
+snippets, including formulas with letters like "(x - a)(x - b)" that must
+not become subtasks, and compares with the expected structure:
+
+    python benchmark.py segmenter
+
+session-log (local) compares one /log-session write: the former openpyxl
+load/append/save of the whole workbook vs. an insert into session_store:
+
+    python benchmark.py session-log --rows 200 2000
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import statistics
+import time
+
+import httpx
+import numpy as np
+
+
+# ------------------------------
+# OCR: per-page vs. batched
+# ------------------------------
+async def upload_once(http: httpx.AsyncClient, path: str, params: dict):
+    with open(path, "rb") as f:
+        contents = f.read()
+    started = time.perf_counter()
+    res = await http.post(
+        "/upload",
+        params={"fresh": "true", **params},
+        files={"file": (path.rsplit("/", 1)[-1], contents, "application/pdf")},
+    )
+    elapsed = time.perf_counter() - started
+    res.raise_for_status()
+    report = json.loads(res.headers.get("X-Upload-Report", "{}"))
+    return elapsed, report
+
+
+async def run_ocr_batch_benchmark(url: str, path: str, pages_per_call: list, repeat: int):
+    modes = [("parallel", {"ocr_mode": "parallel"})]
+    modes += [(f"batch/{n}", {"ocr_mode": "batch", "pages_per_call": n}) for n in pages_per_call]
+
+    rows = []
+    async with httpx.AsyncClient(base_url=url, timeout=600.0) as http:
+        for label, params in modes:
+            times = []
+            report = {}
+            for _ in range(repeat):
+                elapsed, report = await upload_once(http, path, params)
+                times.append(elapsed)
+            rows.append((label, statistics.median(times), report))
+
+    print(f"\nFile: {path} (median of {repeat} run(s) per mode)")
+    print(f"{'mode':<12} {'wall':>8} {'vision pages':>13} {'vision calls':>13} {'fallbacks':>10}")
+    for label, wall, report in rows:
+        print(f"{label:<12} {wall:>7.2f}s {report.get('visionPages', 0):>13} "
+              f"{report.get('visionCalls', 0):>13} {report.get('batchFallbacks', 0):>10}")
+
+
+# ------------------------------
+# /plot: eval() vs. plot_engine
+# ------------------------------
+PLOT_EXPRESSIONS = [
+    "x**3 - 27", "2*x + 3", "x**2 - 4*x + 3", "0.5*x**4 - 2*x**2",
+    "x^3 - 27", "2x + 3", "(x-1)(x+2)", "sin(x)", "np.sin(x)/x",
+    "exp(-x**2)", "sqrt(x)", "1/(x-1)", "e^x", "3x^2 - 2x + 1",
+]
+
+
+def legacy_plot_eval(func_str: str, x_values):
+    """Function evaluation as /plot did it before plot_engine (two eval() calls)"""
+    func_str_safe = func_str.replace("^", "**").replace("π", "np.pi").replace("e", "np.e")
+    eval(func_str_safe, {"x": np.array([1.0]), "np": np, "__builtins__": {}})
+    return eval(func_str_safe, {"x": x_values, "np": np, "__builtins__": {}})
+
+
+def time_calls(fn, repeat: int) -> float:
+    """Median seconds per call"""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def run_plot_eval_benchmark(points_list: list, repeat: int):
+    import plot_engine
+
+    print(f"\n{len(PLOT_EXPRESSIONS)} expressions, median of {repeat} run(s)")
+    failures = {"legacy": [], "engine": []}
+    for label, fn in (("legacy", legacy_plot_eval), ("engine", lambda f, x: plot_engine.compile_expression(f)(x))):
+        for func_str in PLOT_EXPRESSIONS:
+            try:
+                with np.errstate(all="ignore"):
+                    fn(func_str, np.linspace(-5, 5, 11))
+            except Exception as e:
+                failures[label].append(f"{func_str} ({type(e).__name__})")
+    for label, failed in failures.items():
+        print(f"{label:<7} failed on {len(failed)}/{len(PLOT_EXPRESSIONS)}: {', '.join(failed) or '-'}")
+
+    working = [f for f in PLOT_EXPRESSIONS if not any(entry.startswith(f + " (") for entry in failures["legacy"])]
+    print(f"\nTiming over the {len(working)} expressions both paths can evaluate (µs per expression)")
+    print(f"{'points':>7} {'legacy':>9} {'engine cold':>12} {'engine cached':>14}")
+    for points in points_list:
+        x_values = np.linspace(-5, 5, points)
+
+        def legacy():
+            with np.errstate(all="ignore"):
+                for func_str in working:
+                    legacy_plot_eval(func_str, x_values)
+
+        def cold():
+            plot_engine._compile.cache_clear()
+            for func_str in working:
+                plot_engine.compile_expression(func_str)(x_values)
+
+        def cached():
+            for func_str in working:
+                plot_engine.compile_expression(func_str)(x_values)
+
+        cached()
+        per_expr = 1e6 / len(working)
+        print(f"{points:>7} {time_calls(legacy, repeat) * per_expr:>9.1f} "
+              f"{time_calls(cold, repeat) * per_expr:>12.1f} {time_calls(cached, repeat) * per_expr:>14.1f}")
+
+
+# ------------------------------
+# /plot: legacy vs. compact payload
+# ------------------------------
+PAYLOAD_EXPRESSIONS = ["x**3 - 27", "2*x + 3", "1/x", "tan(x)", "sin(x)", "exp(-x**2)", "x*sin(1/x)"]
+
+
+def build_plot(func_str: str) -> dict:
+    """generate_plot()'s function branch without the model call"""
+    import plot_engine
+    import plot_payload
+
+    function = plot_engine.compile_expression(func_str)
+    special = plot_engine.find_special_points(function, *plot_engine.search_window(-5, 5))
+    view = plot_engine.fit_domain(function, [(p["x"], p["y"]) for p in special], -5, 5)
+    special = [p for p in special if view["xMin"] <= p["x"] <= view["xMax"]]
+    sampled = plot_engine.sample_function(function, view["xMin"], view["xMax"], view["yMin"], view["yMax"])
+    return {
+        "plot": plot_payload.function_plot(
+            f"f(x) = {func_str}", "x", "y", view, [(f"f(x) = {func_str}", sampled["segments"])], special, [],
+        ),
+        "plottable": True,
+        "graphType": "function",
+        "chartType": "chartjs",
+    }
+
+
+def response_bytes(body: dict) -> bytes:
+    """Body as FastAPI's JSONResponse renders it"""
+    return json.dumps(body, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def run_plot_payload_benchmark(repeat: int):
+    import plot_payload
+
+    modes = [("legacy", "legacy", "json"), ("compact", "compact", "json"), ("float32", "compact", "float32")]
+    print(f"\nResponse bytes (raw / gzip) and serialization µs (median of {repeat})")
+    print(f"{'function':<14}" + "".join(f"{label:>24}" for label, _, _ in modes))
+    totals = {label: [0, 0] for label, _, _ in modes}
+    for func_str in PAYLOAD_EXPRESSIONS:
+        result = build_plot(func_str)
+        cells = []
+        for label, payload_format, encoding in modes:
+            def serialize():
+                return response_bytes(plot_payload.plot_response(result, payload_format, encoding))
+
+            body = serialize()
+            seconds = time_calls(serialize, repeat)
+            packed = len(gzip.compress(body))
+            totals[label][0] += len(body)
+            totals[label][1] += packed
+            cells.append(f"{len(body):>7} / {packed:>6} {seconds * 1e6:>6.0f}")
+        print(f"{func_str:<14}" + "".join(f"{cell:>24}" for cell in cells))
+
+    legacy_raw, legacy_gzip = totals["legacy"]
+    print(f"\n{'total':<14}" + "".join(f"{raw:>15} / {packed:>6}" for raw, packed in totals.values()))
+    for label, (raw, packed) in totals.items():
+        print(f"{label:<8} {raw / legacy_raw:>6.1%} of legacy raw, {packed / legacy_gzip:>6.1%} of legacy gzip")
+
+
+# ------------------------------
+# /plot: local classifier vs. model labels
+# ------------------------------
+# (subtaskText, taskText, expected model answer: function, None = not plottable)
+CLASSIFIER_CASES = [
+    ("Löse die Gleichung x³ − 27 = 0.", "", "x**3 - 27"),
+    ("x^2 - 4x + 3 = 0", "Löse die quadratischen Gleichungen.", "x**2 - 4*x + 3"),
+    ("Bestimme die Nullstellen von f(x) = x^2 - 4x + 3 mit der pq-Formel.", "", "x**2 - 4*x + 3"),
+    ("Bestimme die Nullstellen.", "Gegeben ist die Funktion f(x) = 0,5x² - 2.", "0.5*x**2 - 2"),
+    ("Bestimme die Extrempunkte.", "Gegeben ist f(x) = x³ - 3x.", "x**3 - 3*x"),
+    ("Bestimme f'(x) für f(x) = 3x^4 - 2x + sin(x).", "", "3*x**4 - 2*x + sin(x)"),
+    ("Skizziere den Graphen von y = e^(-x^2).", "", "exp(-x**2)"),
+    ("Berechne die Fläche unter f(x) = √x zwischen 0 und 4.", "", "sqrt(x)"),
+    ("Löse 2^x = 8.", "", "2**x - 8"),
+    ("Für welche x gilt x² = 4?", "", "x**2 - 4"),
+    ("Löse (x-1)(x+2) = 0.", "", "(x-1)*(x+2)"),
+    ("Gib die Steigung der Geraden y = 2x + 3 an.", "", "2*x + 3"),
+    ("Untersuche f(x) = 1/(x-1) auf Polstellen.", "", "1/(x-1)"),
+    ("Berechne f(3) für f(x)=x²+1.", "", "x**2 + 1"),
+    ("Zeige, dass f'(x₁) = 0 und f''(x₁) ≠ 0 gilt.", "", None),
+    ("Begründe, warum an der Stelle x₀ ein Hochpunkt vorliegt, wenn f'(x₀) = 0 gilt.", "", None),
+    ("Gegeben ist f(x) = ax^2 + bx + c. Bestimme a, b und c.", "", None),
+    ("Berechne 5 + 3.", "", None),
+    ("Berechne 2x + 3 für x = 2.", "", None),
+    ("Zeichne die Gerade durch A(1|2) und B(3|6).", "", "2*x"),
+    ("f(x) = 2x + 3 und g(x) = -x + 1. Berechne den Schnittpunkt.", "", "2*x + 3"),
+    ("Löse das Gleichungssystem 2x + y = 5 und x - y = 1.", "", "5 - 2*x"),
+    ("Bestimme die Ableitung f'(x) = 3x^2.", "", "3*x**2"),
+    ("Für welchen Wert von a hat f_a(x) = x² - a genau eine Nullstelle?", "", None),
+    ("Berechne den Flächeninhalt eines Kreises mit r = 5 cm.", "", None),
+    ("Erkläre den Begriff Wendepunkt.", "", None),
+]
+
+
+def run_plot_classifier_benchmark(repeat: int):
+    import plot_classifier
+
+    rows = []
+    for subtask_text, task_text, expected in CLASSIFIER_CASES:
+        local = plot_classifier.classify_plot(subtask_text, task_text)
+        outcome = "-"
+        if local["decision"] != "ambiguous":
+            label = {"plottable": expected is not None, "graphType": "function", "function": expected or ""}
+            outcome = plot_classifier.compare_with_model(local, label)
+        rows.append((subtask_text, local, outcome))
+        print(f"{local['decision']:<10} {outcome:<17} {subtask_text[:70]}")
+
+    stats = plot_classifier.stats()
+    decided = stats["decisions"]["plot"] + stats["decisions"]["abstract"]
+    print(f"\n{len(rows)} subtasks: {stats['decisions']}")
+    print(f"hit rate (no model call): {stats['hitRate']:.1%} ({decided}/{len(rows)})")
+    print(f"disagreements with the labels: {stats['shadow']['falsePositiveRate']:.1%} of decided "
+          f"(false positive {stats['shadow']['falsePositives']}, function mismatch "
+          f"{stats['shadow']['functionMismatches']}, false abstract {stats['shadow']['falseAbstract']})")
+
+    seconds = time_calls(
+        lambda: [plot_classifier._classify(subtask, task) for subtask, task, _ in CLASSIFIER_CASES], repeat
+    )
+    print(f"classification time: {seconds * 1e6 / len(CLASSIFIER_CASES):.0f} µs per subtask")
+
+
+IMPLICIT_CASES = [
+    ("x**2 + y**2 - 9", 10),
+    ("x**2 + y**2 - 9", 1000),
+    ("x**2/16 + y**2/4 - 1", 100),
+    ("y**2 - x**3 + x", 10),
+    ("x*y - 1", 10),
+    ("sin(x) - cos(y)", 20),
+]
+
+
+def full_grid_contour(fn, half: float, cells: int) -> int:
+    """Sign-change cells of a uniform cells x cells grid (the non-adaptive baseline)"""
+    axis = np.linspace(-half, half, cells + 1)
+    values = fn(*np.meshgrid(axis, axis))
+    positive = values > 0
+    corners = positive[:-1, :-1] + positive[1:, :-1] + positive[:-1, 1:] + positive[1:, 1:]
+    return int(((corners > 0) & (corners < 4)).sum())
+
+
+def run_plot_implicit_benchmark(repeat: int, baseline_cells: int):
+    import plot_engine
+
+    print(f"{'curve':<24} {'window':>7} {'evals':>7} {'points':>7} {'resolution':>10} {'ms':>7} "
+          f"{'full grid ms':>12}")
+    for source, half in IMPLICIT_CASES:
+        fn = plot_engine.compile_expression(source, ("x", "y"))
+        result = plot_engine.implicit_curve(fn, -half, half, -half, half)
+        points = sum(len(xs) for xs, _ in result["segments"])
+        seconds = time_calls(lambda: plot_engine.implicit_curve(fn, -half, half, -half, half), repeat)
+        baseline = time_calls(lambda: full_grid_contour(fn, half, baseline_cells), max(1, repeat // 10))
+        print(f"{source:<24} {half:>7g} {result['evaluations']:>7} {points:>7} {result['resolution']:>10} "
+              f"{seconds * 1e3:>7.1f} {baseline * 1e3:>12.1f}")
+    print(f"\nfull grid = {baseline_cells}x{baseline_cells} cells, sign changes only (no contour, no output)")
+
+
+# ------------------------------
+# Segmenter: lokale Aufgaben-/Teilaufgaben-Erkennung
+# ------------------------------
+# (text, expected [(number, task text, subtask labels), ...], None = whole text to the model)
+SEGMENTER_CASES = [
+    ("1. Löse die Gleichungen.\na) x^3 - 27 = 0\nb) x^2 = 4\n2. Berechne f(2) für f(x) = x^2.",
+     [("1", "Löse die Gleichungen.", "ab"), ("2", "Berechne f(2) für f(x) = x^2.", "a")]),
+    ("Aufgabe 3: Gegeben ist f(x) = x^2 - 4.\n(a) Bestimme die Nullstellen.\n(b) Skizziere den Graphen.",
+     [("3", "Gegeben ist f(x) = x^2 - 4.", "ab")]),
+    ("1. Gegeben ist f(x) = (x - a)(x - b) mit a, b > 0. a) Bestimme die Nullstellen. b) Skizziere f.",
+     [("1", "Gegeben ist f(x) = (x - a)(x - b) mit a, b > 0.", "ab")]),
+    ("1. Gegeben ist f(x) = (x - a)(x - b) mit a, b > 0. Bestimme die Nullstellen.",
+     [("1", "Gegeben ist f(x) = (x - a)(x - b) mit a, b > 0. Bestimme die Nullstellen.", "a")]),
+    ("1. Löse (x + a)(x - b) = 0 und (2x - c) = 0.",
+     [("1", "Löse (x + a)(x - b) = 0 und (2x - c) = 0.", "a")]),
+    ("a) Zeige, dass (x + 1)^2 = x^2 + 2x + 1 gilt.\nb) Berechne g(a) für g(t) = t - a.",
+     [("1", "", "ab")]),
+    ("1. Gegeben ist f(x) = (2x -\na)(x + 1).\nb) Bestimme f(0).", None),
+    ("1. Bestimme g(t) = (t + a). b) Berechne g(1).", None),
+    ("2. Die Gerade g: y = m(x - a) + b schneidet die x-Achse.\na) Bestimme m.\nb) Bestimme a.",
+     [("2", "Die Gerade g: y = m(x - a) + b schneidet die x-Achse.", "ab")]),
+    ("1. Konstruiere das Dreieck.\n1. Schritt: Zeichne AB.\n2. Schritt: Zeichne C.\n2. Berechne den Umfang.\n"
+     "3. Berechne die Fläche.",
+     [("1", "Konstruiere das Dreieck.\n1. Schritt: Zeichne AB.\n2. Schritt: Zeichne C.", "a"),
+      ("2", "Berechne den Umfang.", "a"), ("3", "Berechne die Fläche.", "a")]),
+    ("1. Konstruiere das Dreieck.\n1. Schritt: Zeichne AB.\n2. Schritt: Zeichne C.", None),
+    ("Berechne den Flächeninhalt eines Kreises mit r = 5 cm.", None),
+]
+
+
+def segment_summary(segments):
+    if segments is None:
+        return None
+    return [
+        (task["number"], task["task"], "".join(sub["label"] for sub in task["subtasks"]))
+        for task in segments["tasks"]
+    ]
+
+
+def run_segmenter_benchmark(repeat: int):
+    from task_segmenter import segment_tasks
+
+    correct = 0
+    for text, expected in SEGMENTER_CASES:
+        got = segment_summary(segment_tasks(text))
+        correct += got == expected
+        labels = None if got is None else " ".join(number + labels for number, _, labels in got)
+        print(f"{'ok' if got == expected else 'WRONG':<6} {str(labels):<10} {text[:70]!r}")
+
+    print(f"\n{correct}/{len(SEGMENTER_CASES)} as expected")
+    seconds = time_calls(lambda: [segment_tasks(text) for text, _ in SEGMENTER_CASES], repeat)
+    print(f"segmentation time: {seconds * 1e6 / len(SEGMENTER_CASES):.0f} µs per snippet")
+
+
+SESSION_VALUES = {
+    "benutzer_name": "Max Mustermann", "klasse": "10a", "schule": "Gymnasium Beispiel",
+    "fach": "Mathematik", "thema": "Quadratische Gleichungen", "aufgabentyp": "Gleichungen lösen",
+    "schwierigkeitsgrad": "Mittel", "datei_name": "aufgabe.pdf", "datei_typ": "PDF",
+    "anzahl_aufgaben": 1, "anzahl_teilaufgaben": 3, "visualisierungen_genutzt": 2,
+    "animationen_genutzt": 1, "grafiken_genutzt": 0, "hints_genutzt": 2,
+    "ansatzpruefungen_genutzt": 1, "selbststaendigkeits_score": 4, "feedback": "Helpful",
+    "sitzungsdauer_minuten": 15.5, "notizen": "Gute Fortschritte",
+}
+
+
+def run_session_log_benchmark(rows_list: list, repeat: int):
+    import tempfile
+
+    from openpyxl import load_workbook
+    from session_store import SessionStore, export_excel
+
+    print(f"{'rows':>7} {'excel ms/write':>15} {'sqlite ms/write':>16} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in rows_list:
+            store = SessionStore(os.path.join(directory, f"log_{rows}.db"))
+            for _ in range(rows):
+                store.add_session(SESSION_VALUES)
+            excel_path = os.path.join(directory, f"log_{rows}.xlsx")
+            export_excel(store, excel_path)
+
+            def excel_write():
+                wb = load_workbook(excel_path)
+                ws = wb["Session_Log"]
+                ws.append(["id"] + list(SESSION_VALUES.values()))
+                wb.save(excel_path)
+                wb.close()
+
+            excel = time_calls(excel_write, repeat)
+            sqlite = time_calls(lambda: store.add_session(SESSION_VALUES), repeat)
+            store.close()
+            print(f"{rows:>7} {excel * 1e3:>15.1f} {sqlite * 1e3:>16.3f} {excel / sqlite:>7.0f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clarity Coach benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ocr = sub.add_parser("ocr-batch", help="Per-page vs. batched vision OCR for one PDF")
+    ocr.add_argument("--url", default="http://127.0.0.1:8000")
+    ocr.add_argument("--file", required=True)
+    ocr.add_argument("--pages-per-call", type=int, nargs="+", default=[2, 4, 8])
+    ocr.add_argument("--repeat", type=int, default=3)
+
+    plot_eval = sub.add_parser("plot-eval", help="eval() vs. plot_engine for /plot functions (local)")
+    plot_eval.add_argument("--points", type=int, nargs="+", default=[100, 2000])
+    plot_eval.add_argument("--repeat", type=int, default=200)
+
+    plot_payload = sub.add_parser("plot-payload", help="Legacy vs. compact /plot response size (local)")
+    plot_payload.add_argument("--repeat", type=int, default=200)
+
+    classifier = sub.add_parser("plot-classifier", help="Local /plot classifier vs. labeled subtasks (local)")
+    classifier.add_argument("--repeat", type=int, default=50)
+
+    implicit = sub.add_parser("plot-implicit", help="Adaptive implicit curves vs. a full grid (local)")
+    implicit.add_argument("--repeat", type=int, default=20)
+    implicit.add_argument("--baseline-cells", type=int, default=4096)
+
+    segmenter = sub.add_parser("segmenter", help="Local task/subtask segmentation vs. expected splits (local)")
+    segmenter.add_argument("--repeat", type=int, default=200)
+
+    session_log = sub.add_parser("session-log", help="Excel load/append/save vs. SQLite insert per session (local)")
+    session_log.add_argument("--rows", type=int, nargs="+", default=[200, 2000])
+    session_log.add_argument("--repeat", type=int, default=5)
+
+    args = parser.parse_args()
+    if args.command == "ocr-batch":
+        asyncio.run(run_ocr_batch_benchmark(args.url, args.file, args.pages_per_call, args.repeat))
+    elif args.command == "plot-eval":
+        run_plot_eval_benchmark(args.points, args.repeat)
+    elif args.command == "plot-payload":
+        run_plot_payload_benchmark(args.repeat)
+    elif args.command == "plot-classifier":
+        run_plot_classifier_benchmark(args.repeat)
+    elif args.command == "plot-implicit":
+        run_plot_implicit_benchmark(args.repeat, args.baseline_cells)
+    elif args.command == "segmenter":
+        run_segmenter_benchmark(args.repeat)
+    elif args.command == "session-log":
+        run_session_log_benchmark(args.rows, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
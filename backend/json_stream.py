@@ -0,0 +1,200 @@
+# Datei: json_stream.py
+"""
+Incremental readers for JSON that arrives token by token from a streamed
+completion.
+"""
+import json
+
+
+class JsonArrayItemParser:
+    """
+    Yields the elements of one array in a streamed JSON document as soon as
+    each element is complete.
+
+    The array is either the value of ``key`` in the top-level object
+    (``{"tasks": [{...}, {...}]}``) or the top-level value itself
+    (``[{...}, {...}]``). Only object elements are emitted.
+
+        parser = JsonArrayItemParser("tasks")
+        async for chunk in stream:
+            for item in parser.feed(chunk):
+                ...
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.text = ""            # gesamter bisheriger Text (für json.loads am Ende)
+        self._stack = []          # offene Container: "{" oder "["
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_key = None     # zuletzt gelesener String auf oberster Ebene
+        self._pending_key = None  # Key vor dem letzten ":"
+        self._array_depth = None  # Stack-Tiefe innerhalb des Ziel-Arrays
+        self._item_start = None   # Position des "{" des aktuellen Elements
+
+    def feed(self, chunk: str) -> list:
+        """Consume the next piece of text, return the elements completed by it"""
+        if not chunk:
+            return []
+        start = len(self.text)
+        self.text += chunk
+        items = []
+
+        for pos in range(start, len(self.text)):
+            ch = self.text[pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    # Nur Keys des äußeren Objekts sind interessant
+                    if len(self._stack) == 1 and self._stack[0] == "{":
+                        try:
+                            self._last_key = json.loads(self.text[self._string_start:pos + 1])
+                        except ValueError:
+                            self._last_key = None
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif ch == ":":
+                self._pending_key = self._last_key
+            elif ch in "{[":
+                depth = len(self._stack)
+                if ch == "[" and self._array_depth is None and (
+                    depth == 0
+                    or (depth == 1 and self._stack[0] == "{" and self._pending_key == self.key)
+                ):
+                    self._array_depth = depth + 1
+                elif ch == "{" and depth == self._array_depth:
+                    self._item_start = pos
+                self._stack.append(ch)
+                self._pending_key = None
+            elif ch in "}]":
+                if self._stack:
+                    self._stack.pop()
+                depth = len(self._stack)
+                if ch == "}" and self._item_start is not None and depth == self._array_depth:
+                    try:
+                        items.append(json.loads(self.text[self._item_start:pos + 1]))
+                    except ValueError:
+                        pass
+                    self._item_start = None
+                elif ch == "]" and self._array_depth is not None and depth == self._array_depth - 1:
+                    self._array_depth = -1  # Array abgeschlossen
+            elif ch == ",":
+                self._pending_key = None
+
+        return items
+
+
+class JsonStringFieldReader:
+    """
+    Decodes selected top-level string fields of a streamed JSON object while
+    they are still being written.
+
+        reader = JsonStringFieldReader(["hint", "encouragement"])
+        for field, delta in reader.feed(chunk):
+            ...  # e.g. ("hint", "Welche Zahl")
+    """
+
+    _SIMPLE_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self, fields):
+        self.fields = set(fields)
+        self.text = ""
+        self.values = {}           # bisher dekodierter Text je Feld
+        self._depth = 0
+        self._in_string = False
+        self._string_raw = ""      # roher Inhalt eines Key-Strings
+        self._is_value = False     # aktueller String ist ein Wert (nach ":")
+        self._expect_value = False
+        self._key = None
+        self._target = None        # Feld, dessen Wert gerade gelesen wird
+        self._escape = None        # angefangene Escape-Sequenz (ohne "\")
+        self._high_surrogate = None
+
+    def feed(self, chunk: str) -> list:
+        """Consume the next piece of text, return ``(field, delta)`` pairs"""
+        self.text += chunk or ""
+        deltas = {}
+        order = []
+
+        def emit(text):
+            if not text or self._target is None:
+                return
+            if self._target not in deltas:
+                deltas[self._target] = ""
+                order.append(self._target)
+            deltas[self._target] += text
+            self.values[self._target] = self.values.get(self._target, "") + text
+
+        for ch in chunk or "":
+            if self._in_string:
+                if self._escape is not None:
+                    self._escape += ch
+                    decoded = self._decode_escape()
+                    if decoded is not None:
+                        if self._target is not None:
+                            emit(decoded)
+                        else:
+                            self._string_raw += decoded
+                    continue
+                if ch == "\\":
+                    self._escape = ""
+                elif ch == '"':
+                    self._in_string = False
+                    if not self._is_value and self._depth == 1:
+                        self._key = self._string_raw
+                    self._target = None
+                elif self._target is not None:
+                    emit(ch)
+                else:
+                    self._string_raw += ch
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_raw = ""
+                self._is_value = self._expect_value
+                if self._is_value and self._depth == 1 and self._key in self.fields:
+                    self._target = self._key
+                    self.values.setdefault(self._key, "")
+                self._expect_value = False
+            elif ch == ":":
+                self._expect_value = True
+            elif ch in "{[":
+                self._depth += 1
+                self._expect_value = False
+            elif ch in "}]":
+                self._depth -= 1
+            elif ch == ",":
+                self._expect_value = False
+
+        return [(field, deltas[field]) for field in order]
+
+    def _decode_escape(self):
+        """Decoded text once the escape sequence is complete, else None"""
+        esc = self._escape
+        if esc[0] != "u":
+            self._escape = None
+            return self._SIMPLE_ESCAPES.get(esc, esc)
+        if len(esc) < 5:
+            return None
+        self._escape = None
+        try:
+            code = int(esc[1:], 16)
+        except ValueError:
+            return ""
+        # Surrogate-Paare (Emoji etc.) erst zusammen ausgeben
+        if 0xD800 <= code <= 0xDBFF:
+            self._high_surrogate = code
+            return ""
+        if 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+            high, self._high_surrogate = self._high_surrogate, None
+            return chr(0x10000 + ((high - 0xD800) << 10) + (code - 0xDC00))
+        return chr(code)
@@ -0,0 +1,148 @@
+"""
+Load Test: concurrent /hint throughput
+
+Fires many concurrent /hint requests at a running backend and reports
+throughput and latency percentiles.
+
+To measure the backend itself (not OpenAI), start the built-in mock upstream,
+which answers every chat completion after a fixed delay:
+
+    python load_test.py mock-upstream --latency 1.0
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=test uvicorn main:app --port 8000
+    python load_test.py hint --requests 50 --concurrency 25
+
+Each request sends a distinct subtask by default (run id + counter), so
+neither the artifact cache nor request coalescing (SingleFlight) answers it
+and every request reaches the upstream. ``--payloads identical`` sends the
+same subtask every time and measures one upstream call fanned out to all
+waiters instead.
+
+Run the same commands against an older checkout to compare before/after.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+
+
+HINT_PAYLOAD = {
+    "taskNumber": "1",
+    "topic": "Kubische Gleichungen",
+    "taskText": "Löse die Gleichung.",
+    "subLabel": "a",
+    "subtaskText": "x^3 - 27 = 0",
+    "hintLevel": 1,
+}
+
+
+# ------------------------------
+# Mock OpenAI upstream
+# ------------------------------
+def run_mock_upstream(host: str, port: int, latency: float):
+    """Minimal OpenAI-compatible /v1/chat/completions with a fixed delay"""
+    import uvicorn
+    from fastapi import FastAPI, Body
+
+    mock = FastAPI()
+
+    @mock.post("/v1/chat/completions")
+    async def chat_completions(payload: dict = Body(...)):
+        await asyncio.sleep(latency)
+        content = json.dumps({
+            "hint": "Welche Zahl hoch drei ergibt 27?",
+            "encouragement": "Du bist auf dem richtigen Weg!",
+        })
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "gpt-4o-mini"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }
+
+    print(f"Mock upstream on http://{host}:{port}/v1 (latency {latency:.2f}s)")
+    uvicorn.run(mock, host=host, port=port, log_level="warning")
+
+
+# ------------------------------
+# /hint load test
+# ------------------------------
+def hint_payload(mode: str, run_id: str, index: int) -> dict:
+    """HINT_PAYLOAD, with a unique subtask per request unless ``mode`` is "identical" """
+    if mode == "identical":
+        return HINT_PAYLOAD
+    # Eindeutig je Lauf und Anfrage -> kein Cache-Treffer, keine Zusammenfassung
+    return {**HINT_PAYLOAD, "subtaskText": f"{HINT_PAYLOAD['subtaskText']} (Lauf {run_id}, Anfrage {index})"}
+
+
+async def run_hint_load(url: str, total: int, concurrency: int, mode: str = "distinct"):
+    semaphore = asyncio.Semaphore(concurrency)
+    run_id = f"{time.time():.0f}"
+    latencies = []
+    errors = 0
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=300.0, limits=limits) as http:
+
+        async def one_request(index: int):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    res = await http.post("/hint", json=hint_payload(mode, run_id, index))
+                    res.raise_for_status()
+                    latencies.append(time.perf_counter() - started)
+                except Exception as e:
+                    errors += 1
+                    print(f"[ERROR] {e}")
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one_request(index) for index in range(total)))
+        elapsed = time.perf_counter() - started
+
+    print(f"\nRequests:     {total} (concurrency {concurrency})")
+    print(f"Payloads:     {mode}" + (" (coalesced/cached, measures fan-out)" if mode == "identical" else " (one upstream call each)"))
+    print(f"Errors:       {errors}")
+    print(f"Wall time:    {elapsed:.2f}s")
+    print(f"Throughput:   {len(latencies) / elapsed:.2f} req/s")
+    if latencies:
+        latencies.sort()
+        p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+        print(f"Latency p50:  {statistics.median(latencies):.2f}s")
+        print(f"Latency p95:  {p95:.2f}s")
+        print(f"Latency max:  {latencies[-1]:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clarity Coach load test")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    mock = sub.add_parser("mock-upstream", help="Start a mock OpenAI upstream")
+    mock.add_argument("--host", default="127.0.0.1")
+    mock.add_argument("--port", type=int, default=8100)
+    mock.add_argument("--latency", type=float, default=1.0)
+
+    hint = sub.add_parser("hint", help="Concurrent /hint requests")
+    hint.add_argument("--url", default="http://127.0.0.1:8000")
+    hint.add_argument("--requests", type=int, default=50)
+    hint.add_argument("--concurrency", type=int, default=25)
+    hint.add_argument("--payloads", choices=["distinct", "identical"], default="distinct",
+                      help="distinct: unique subtask per request; identical: same payload (coalesced)")
+
+    args = parser.parse_args()
+    if args.command == "mock-upstream":
+        run_mock_upstream(args.host, args.port, args.latency)
+    else:
+        asyncio.run(run_hint_load(args.url, args.requests, args.concurrency, args.payloads))
+
+
+if __name__ == "__main__":
+    main()
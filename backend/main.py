@@ -1,33 +1,124 @@
 # Datei: main.py
 
-from fastapi import FastAPI, UploadFile, HTTPException, File, Body
+from fastapi import FastAPI, UploadFile, HTTPException, File, Body, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+import asyncio
 import base64
+import hashlib
 import os
 import json
-import fitz  # PyMuPDF
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
-from io import BytesIO
-import numpy as np
+import random
 import re
+import tempfile
+import time
+from collections import deque
 # Note: Plotly removed in Phase 2.2 - using Chart.js in frontend (lighter weight)
 from datetime import datetime
-from openpyxl import load_workbook, Workbook
-from openpyxl.styles import Border, Side, Alignment
 from pydantic import BaseModel
 
+from contextlib import aclosing
+
+from json_stream import JsonArrayItemParser, JsonStringFieldReader
+from memory_stats import PeakRssSampler
+from pdf_pages import (
+    PageFilter, ink_mask_page, pdf_page_count, prepare_photo, render_page, scan_page,
+)
+from plot_engine import (
+    ExpressionError, compile_expression, find_intersections, find_special_points, fit_domain,
+    fit_implicit, implicit_curve, sample_function, search_window,
+)
+from plot_classifier import classify_plot, compare_with_model
+from plot_classifier import stats as plot_classifier_stats
+from plot_payload import (
+    CHART_TEMPLATES, PAYLOAD_ENCODINGS, PAYLOAD_FORMATS, TEMPLATE_VERSION, function_plot,
+    plot_response, points_plot,
+)
+from plot_engine import cache_info as plot_engine_cache_info
+from raster_pool import RasterPool
+from result_cache import ResultCache, SingleFlight, StreamFlight, content_hash, normalize_text
+from session_store import ASSESSMENT_COLUMNS, ASSESSMENT_SHEET, SessionStore, export_excel, import_excel
+from task_segmenter import segment_tasks, split_task_chunks
+
 # 🔹 Umgebung laden (.env mit OPENAI_API_KEY)
 load_dotenv()
 
 app = FastAPI()
-client = OpenAI(
+
+# 🔹 Async OpenAI-Client mit gemeinsamem Connection-Pool
+# Alle Endpoints teilen sich einen Pool, damit ein langsamer Upstream-Call
+# den Event-Loop nicht blockiert und Verbindungen wiederverwendet werden.
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+
+client = AsyncOpenAI(
     api_key=os.getenv("OPENAI_API_KEY"),
     timeout=60.0,  # 60 second timeout to prevent hanging forever
-    max_retries=2
+    max_retries=2,
+    http_client=DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+        ),
+    ),
 )
 
+
+@app.on_event("shutdown")
+async def close_openai_client():
+    """Close pooled upstream connections on shutdown"""
+    await client.close()
+
+
+# 🔹 Prozess-Pool für PDF-Rendering (CPU-lastig, blockiert sonst den Event-Loop)
+# Standard: ein Worker pro CPU-Kern
+raster_pool = RasterPool(
+    workers=int(os.getenv("RASTER_WORKERS", "0")) or None,
+    max_pending=int(os.getenv("RASTER_MAX_PENDING", "0")) or None,
+)
+
+
+@app.on_event("shutdown")
+async def stop_raster_pool():
+    raster_pool.shutdown()
+
+# 🔹 Upload-Größenlimit
+# Uploads werden in Blöcken auf Disk geschrieben (spool_upload), nie ganz in den RAM
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR") or None
+UPLOAD_FORM_OVERHEAD = 64 * 1024  # Multipart-Header um die Datei herum
+
+
+class UploadSizeLimit:
+    """
+    Rejects oversized /upload requests by Content-Length before the body is
+    read. Requests without the header are still capped in spool_upload().
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith("/upload"):
+            length = dict(scope["headers"]).get(b"content-length", b"")
+            if length.isdigit() and int(length) > UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD:
+                response = JSONResponse(status_code=413, content={"detail": upload_too_large_message()})
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+def upload_too_large_message() -> str:
+    return f"File too large (max. {UPLOAD_MAX_BYTES // (1024 * 1024)} MB)"
+
+
+# Vor CORS registrieren, damit auch die 413-Antwort CORS-Header bekommt
+app.add_middleware(UploadSizeLimit)
+
 # 🔹 CORS freischalten (Frontend darf auf Backend zugreifen)
 app.add_middleware(
     CORSMiddleware,
@@ -35,6 +126,41 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Upload-Report"],
+)
+
+# 🔹 Ergebnis-Caches (Speicher + JSON auf Disk, überlebt Neustarts)
+# CLARITY_CACHE_DIR="" deaktiviert die Disk-Stufe
+CACHE_DIR = os.getenv(
+    "CLARITY_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+)
+
+# Wie lange eine Aufgabenanalyse wiederverwendet wird (Sekunden, 0 = unbegrenzt)
+CLARITY_CACHE_TTL_SECONDS = float(os.getenv("CLARITY_CACHE_TTL_SECONDS", "86400"))
+
+# Ganzes Dokument (Hash der hochgeladenen Bytes) -> Aufgabenliste
+upload_cache = ResultCache(
+    "upload",
+    max_entries=int(os.getenv("UPLOAD_CACHE_MAX_ENTRIES", "128")),
+    disk_dir=CACHE_DIR or None,
+    max_disk_entries=int(os.getenv("UPLOAD_CACHE_MAX_DISK_ENTRIES", "1024")),
+    ttl_seconds=CLARITY_CACHE_TTL_SECONDS,
+)
+# Einzelne Seite (Hash des gerenderten Seitenbilds) -> OCR-Text
+ocr_cache = ResultCache(
+    "ocr_pages",
+    max_entries=int(os.getenv("OCR_CACHE_MAX_ENTRIES", "1024")),
+    disk_dir=CACHE_DIR or None,
+    max_disk_entries=int(os.getenv("OCR_CACHE_MAX_DISK_ENTRIES", "8192")),
+)
+# Normalisierter Aufgabentext -> Ergebnis von run_clarity_coach
+clarity_cache = ResultCache(
+    "clarity",
+    max_entries=int(os.getenv("CLARITY_CACHE_MAX_ENTRIES", "512")),
+    disk_dir=CACHE_DIR or None,
+    max_disk_entries=int(os.getenv("CLARITY_CACHE_MAX_DISK_ENTRIES", "4096")),
+    ttl_seconds=CLARITY_CACHE_TTL_SECONDS,
 )
 
 # ------------------------------
@@ -55,7 +181,7 @@ def read_root():
 # Health Check
 # ------------------------------
 @app.get("/health")
-def health_check():
+async def health_check():
     """Check if backend and OpenAI API are working"""
     api_key = os.getenv("OPENAI_API_KEY")
     
@@ -67,7 +193,7 @@ def health_check():
     
     # Test OpenAI connection
     try:
-        test_response = client.chat.completions.create(
+        test_response = await client.chat.completions.create(
             model="gpt-4o-mini",
             messages=[{"role": "user", "content": "test"}],
             max_tokens=5
@@ -85,10 +211,264 @@ def health_check():
         }
 
 
+# Gleichzeitige identische Upstream-Calls zusammenlegen (z.B. ganze Klasse
+# klickt gleichzeitig auf "Visualisieren" bei Aufgabe 1a)
+inflight = SingleFlight()
+# Dasselbe für die SSE-Varianten: ein Upstream-Stream, alle Clients lesen mit
+stream_inflight = StreamFlight()
+
+
+# ------------------------------
+# Cache-Statistik
+# ------------------------------
+@app.get("/cache-stats")
+async def cache_stats():
+    """Hit/miss counters and sizes of all result caches"""
+    return {
+        "upload": upload_cache.stats(),
+        "ocrPages": ocr_cache.stats(),
+        "clarity": clarity_cache.stats(),
+        "artifacts": {
+            **artifact_cache.stats(),
+            "byEndpoint": {
+                kind: {
+                    **counts,
+                    "hitRate": round(counts["hits"] / (counts["hits"] + counts["misses"]), 3)
+                    if counts["hits"] + counts["misses"] else 0.0,
+                }
+                for kind, counts in artifact_counters.items()
+            },
+        },
+        "inflight": inflight.stats(),
+        "streamInflight": stream_inflight.stats(),
+        "plotExpressions": plot_engine_cache_info(),
+        "plotClassifier": plot_classifier_stats(),
+        "smartVisual": dict(smart_visual_counters),
+    }
+
+
+# ------------------------------
+# Raster-Pool-Statistik
+# ------------------------------
+@app.get("/raster-stats")
+async def raster_stats():
+    """Worker count and queue depth of the PDF rendering pool"""
+    return raster_pool.stats()
+
+
 # ------------------------------
 # Hilfsfunktion: Clarity-Coach-Prompt ausführen
 # ------------------------------
-def run_clarity_coach(full_text: str):
+# Bei Prompt-Änderungen erhöhen, damit alte Cache-Einträge nicht mehr passen
+CLARITY_PROMPT_VERSION = "3"
+
+# 🔹 Aufgaben/Teilaufgaben lokal erkennen; das Modell liefert nur noch
+# Thema, Schwierigkeit und Fragen je Teilaufgabe (0 = altes Vollformat)
+CLARITY_SEGMENTER = os.getenv("CLARITY_SEGMENTER", "1") == "1"
+DIFFICULTY_LEVELS = ("leicht", "mittel", "anspruchsvoll")
+
+# 🔹 Lange Dokumente in Aufgaben-Blöcken parallel analysieren
+# Unter CLARITY_CHUNK_MIN_CHARS bleibt es bei einem einzigen Call
+CLARITY_CHUNK_MIN_CHARS = int(os.getenv("CLARITY_CHUNK_MIN_CHARS", "6000"))
+CLARITY_CHUNK_TARGET_CHARS = int(os.getenv("CLARITY_CHUNK_TARGET_CHARS", "3000"))
+CLARITY_MAX_CHUNKS = int(os.getenv("CLARITY_MAX_CHUNKS", "8"))
+
+
+async def run_clarity_coach(full_text: str, fresh: bool = False):
+    """
+    Memoized front of analyze_tasks().
+
+    Results are cached by the normalized task text (whitespace/Unicode) for
+    CLARITY_CACHE_TTL_SECONDS. ``fresh=True`` skips the lookup (teachers who
+    want new questions) and stores the new result.
+    """
+    cache_key = clarity_cache_key(full_text)
+    if not fresh:
+        cached = await clarity_cache.aget(cache_key)
+        if cached is not None:
+            print(f"[CLARITY] Cache hit {cache_key[:12]}")
+            return cached
+
+    async def analyze_and_store():
+        result = await analyze_document(full_text)
+        # Fehlerobjekte nicht cachen
+        if isinstance(result, list):
+            await clarity_cache.aset(cache_key, result)
+        return result
+
+    return await inflight.do("clarity", cache_key, analyze_and_store)
+
+
+async def run_clarity_coach_stream(full_text: str, fresh: bool = False):
+    """
+    Streaming counterpart of run_clarity_coach() with the same cache.
+
+    Yields the events of analyze_tasks_stream(); a cache hit replays the
+    stored tasks immediately.
+    """
+    cache_key = clarity_cache_key(full_text)
+    if not fresh:
+        cached = await clarity_cache.aget(cache_key)
+        if cached is not None:
+            print(f"[CLARITY] Cache hit {cache_key[:12]}")
+            for task in cached:
+                yield "task", task
+            yield "result", cached
+            return
+
+    async for event, data in analyze_document_stream(full_text):
+        if event == "result" and isinstance(data, list):
+            await clarity_cache.aset(cache_key, data)
+        yield event, data
+
+
+def clarity_cache_key(full_text: str) -> str:
+    return content_hash("clarity", CLARITY_PROMPT_VERSION, normalize_text(full_text))
+
+
+def clarity_chunks(full_text: str):
+    """Task-boundary chunks for a long document, or None for single-shot mode"""
+    if len(full_text) < CLARITY_CHUNK_MIN_CHARS:
+        return None
+    chunks = split_task_chunks(full_text, CLARITY_CHUNK_TARGET_CHARS, CLARITY_MAX_CHUNKS)
+    return chunks if len(chunks) > 1 else None
+
+
+def number_chunk_task(task: dict, position: int, expected: list, previous: str):
+    """
+    Stable numbering across chunks: each chunk restarts the model's view of
+    the document, so a chunk with tasks 4-6 may come back as "1"-"3". Keep a
+    number the segmenter found in this chunk, otherwise use the segmenter's
+    number at this position (or continue after the previous task).
+    """
+    if isinstance(task, dict):
+        number = str(task.get("number", "")).strip().rstrip(".)")
+        if number not in expected:
+            if position < len(expected):
+                number = expected[position]
+            else:
+                number = str(int(previous) + 1) if previous.isdigit() else str(position + 1)
+        task["number"] = number
+    return task
+
+
+async def analyze_document(full_text: str):
+    """
+    analyze_tasks() for short texts; long texts are split at task boundaries
+    and the chunks analyzed concurrently, then merged in document order.
+    A failed chunk (error result or exception) is retried once; if it fails
+    again the other chunks are cancelled and the whole text is analyzed in
+    one call as before.
+    """
+    chunks = clarity_chunks(full_text)
+    if chunks is None:
+        return await analyze_tasks(full_text)
+
+    print(f"[CLARITY] Chunked analysis: {len(chunks)} chunks, {len(full_text)} characters")
+
+    async def analyze_chunk(chunk_text: str):
+        """Task list of one chunk, or None if both attempts failed"""
+        for attempt in range(2):
+            if attempt:
+                print("[CLARITY] Chunk analysis failed -> retry")
+            try:
+                result = await analyze_tasks(chunk_text)
+            except Exception as e:
+                print(f"[CLARITY] Chunk analysis raised: {e}")
+                continue
+            if isinstance(result, list):
+                return result
+        return None
+
+    tasks = [asyncio.create_task(analyze_chunk(chunk_text)) for chunk_text, _ in chunks]
+    failed = False
+    try:
+        pending = set(tasks)
+        while pending and not failed:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            failed = any(task.result() is None for task in done)
+    finally:
+        # Bei einem endgültigen Fehler (oder Abbruch) laufen die übrigen Chunks nicht weiter
+        for task in tasks:
+            task.cancel()
+    if failed:
+        print("[CLARITY] Chunk analysis failed twice -> single-shot fallback")
+        return await analyze_tasks(full_text)
+    results = [task.result() for task in tasks]
+
+    merged = []
+    for (_, expected), result in zip(chunks, results):
+        for position, task in enumerate(result):
+            previous = merged[-1].get("number", "") if merged and isinstance(merged[-1], dict) else ""
+            merged.append(number_chunk_task(task, position, expected, previous))
+    return merged
+
+
+async def analyze_document_stream(full_text: str):
+    """
+    Streaming counterpart of analyze_document(). All chunk streams run
+    concurrently; tasks are emitted in document order (later chunks are
+    buffered until the earlier ones are done). A failed chunk is retried
+    once without streaming; its tasks that were not yet emitted follow.
+    """
+    chunks = clarity_chunks(full_text)
+    if chunks is None:
+        async for event, data in analyze_tasks_stream(full_text):
+            yield event, data
+        return
+
+    print(f"[CLARITY] Chunked analysis (stream): {len(chunks)} chunks, {len(full_text)} characters")
+    queues = [asyncio.Queue() for _ in chunks]
+
+    async def pump(chunk_text: str, queue: asyncio.Queue):
+        emitted = 0
+        try:
+            async for event, data in analyze_tasks_stream(chunk_text):
+                if event == "task":
+                    emitted += 1
+                elif not isinstance(data, list):
+                    break
+                queue.put_nowait((event, data))
+            else:
+                return
+        except Exception as e:
+            print(f"[CLARITY] Chunk stream failed: {e}")
+        print("[CLARITY] Chunk analysis failed -> retry")
+        try:
+            result = await analyze_tasks(chunk_text)
+        except Exception as e:
+            result = {"error": f"Chunk-Analyse fehlgeschlagen: {str(e)[:200]}"}
+        if isinstance(result, list):
+            for task in result[emitted:]:
+                queue.put_nowait(("task", task))
+        queue.put_nowait(("result", result))
+
+    pumps = [asyncio.create_task(pump(chunk_text, queue)) for (chunk_text, _), queue in zip(chunks, queues)]
+    merged = []
+    try:
+        for (_, expected), queue in zip(chunks, queues):
+            position = 0
+            while True:
+                event, data = await queue.get()
+                if event == "result":
+                    break
+                previous = merged[-1].get("number", "") if merged and isinstance(merged[-1], dict) else ""
+                task = number_chunk_task(data, position, expected, previous)
+                position += 1
+                merged.append(task)
+                yield "task", task
+            if not isinstance(data, list):
+                # Auch der zweite Versuch ist fehlgeschlagen -> Fehlerobjekt wie im Single-Shot-Modus
+                print(f"[CLARITY] Chunk analysis failed twice: {data}")
+                yield "result", data
+                return
+        yield "result", merged
+    finally:
+        for task in pumps:
+            task.cancel()
+
+
+async def analyze_tasks(full_text: str):
     """
     Nimmt reinen Aufgabentext und gibt die strukturierte Aufgabenliste zurück:
     [
@@ -107,25 +487,216 @@ def run_clarity_coach(full_text: str):
       },
       ...
     ]
+
+    Erkennt segment_tasks() die Struktur selbst, schreibt das Modell nur
+    Thema, Schwierigkeit und Fragen je Teilaufgabe (annotate_segments);
+    sonst erzeugt es die ganze Liste wie bisher.
     """
+    segments = segment_tasks(full_text) if CLARITY_SEGMENTER else None
+    if segments is not None:
+        return await annotate_segments(full_text, segments)
+    return await analyze_tasks_full(full_text)
 
-    clarity_prompt = f"""
-Du bist der KI-Entwicklungsassistent für das Projekt Clarity Coach.
 
-Deine Aufgabe:
-- Analysiere den folgenden Aufgabentext (mehrere Aufgaben mit Teilaufgaben möglich).
-- Erkenne Aufgaben (1., 2., 3., …) und Teilaufgaben (a), b), c), …).
-- Erstelle für jede Aufgabe und jede Teilaufgabe:
-  • "number": Aufgabennummer als String (z.B. "1")
-  • "topic": kurzes Thema (z.B. "Kubische Gleichungen", "Potenzfunktionen")
-  • "difficulty": "leicht", "mittel" oder "anspruchsvoll"
-  • "task": vollständiger Text der übergeordneten Aufgabe (ohne die einzelnen Teilaufgaben)
-  • "subtasks": Liste von Objekten mit:
-      - "label": Buchstabe der Teilaufgabe, z.B. "a"
-      - "task": Text der Teilaufgabe
-      - "questions": 3–5 sokratische Fragen (Strings)
+async def analyze_tasks_full(full_text: str):
+    """The model segments and annotates the text itself (pre-segmenter path)"""
+    response = await client.chat.completions.create(
+        model="gpt-4o-mini",
+        response_format={"type": "json_object"},
+        messages=build_clarity_messages(full_text),
+    )
+    log_output_tokens("full", response)
+    return parse_tasks_response(response.choices[0].message.content)
+
+
+async def analyze_tasks_stream(full_text: str):
+    """
+    Streaming variant of analyze_tasks().
+
+    Async generator of ``(event, data)`` pairs: ("task", task) for every
+    element of the "tasks" array as soon as it is closed in the token
+    stream, then ("result", task list or error object) as the last event.
+    """
+    segments = segment_tasks(full_text) if CLARITY_SEGMENTER else None
+    if segments is not None:
+        async for event, data in annotate_segments_stream(full_text, segments):
+            yield event, data
+        return
+
+    stream = await client.chat.completions.create(
+        model="gpt-4o-mini",
+        response_format={"type": "json_object"},
+        messages=build_clarity_messages(full_text),
+        stream=True,
+    )
+
+    parser = JsonArrayItemParser("tasks")
+    emitted = 0
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        for task in parser.feed(chunk.choices[0].delta.content or ""):
+            emitted += 1
+            yield "task", task
+
+    # Vollständige Antwort ist maßgeblich; fehlende Aufgaben nachreichen
+    result = parse_tasks_response(parser.text)
+    if isinstance(result, list):
+        for task in result[emitted:]:
+            yield "task", task
+    yield "result", result
 
-WICHTIG: Die Fragen müssen **sehr aufgabenspezifisch** sein und sich konkret auf Terme, Zahlen und Begriffe der jeweiligen Teilaufgabe beziehen.
+
+def log_output_tokens(mode: str, response):
+    usage = getattr(response, "usage", None)
+    if usage is not None and usage.completion_tokens is not None:
+        print(f"[CLARITY] {mode}: {usage.completion_tokens} output tokens")
+
+
+# ------------------------------
+# Vorsegmentierte Aufgaben: nur Thema, Schwierigkeit, Fragen vom Modell
+# ------------------------------
+def segment_units(segments: dict) -> list:
+    """All ``(unit_id, task, subtask)`` of a segmentation, e.g. id "2b" """
+    return [
+        (f"{task['number']}{subtask['label']}", task, subtask)
+        for task in segments["tasks"]
+        for subtask in task["subtasks"]
+    ]
+
+
+def stitch_task(task: dict, annotations: dict) -> dict:
+    """
+    Original task/subtask text plus the model's annotations (by unit id).
+    Topic comes from the first subtask, difficulty is the highest one.
+    """
+    subtasks = []
+    notes = []
+    for subtask in task["subtasks"]:
+        note = annotations[f"{task['number']}{subtask['label']}"]
+        notes.append(note)
+        subtasks.append({**subtask, "questions": note["questions"]})
+    return {
+        "number": task["number"],
+        "topic": notes[0]["topic"],
+        "difficulty": max((note["difficulty"] for note in notes), key=DIFFICULTY_LEVELS.index),
+        "task": task["task"],
+        "subtasks": subtasks,
+    }
+
+
+def valid_annotation(unit: dict):
+    """Normalized annotation of one unit, or None if it is unusable"""
+    if not isinstance(unit, dict):
+        return None
+    questions = unit.get("questions")
+    if not isinstance(questions, list):
+        return None
+    questions = [str(question).strip() for question in questions if str(question).strip()]
+    if not questions:
+        return None
+    difficulty = str(unit.get("difficulty", "")).strip().lower()
+    return {
+        "topic": str(unit.get("topic") or "").strip(),
+        "difficulty": difficulty if difficulty in DIFFICULTY_LEVELS else "mittel",
+        "questions": questions,
+    }
+
+
+def parse_units_response(raw: str, unit_ids: list) -> dict:
+    """``{unit_id: annotation}`` for all valid units of a JSON-mode answer"""
+    try:
+        units = json.loads(raw).get("units")
+    except Exception as e:
+        print(f"[ERROR] JSON-Fehler (Units): {e}")
+        return {}
+    annotations = {}
+    for unit in units if isinstance(units, list) else []:
+        note = valid_annotation(unit)
+        unit_id = str(unit.get("id", "")).strip() if isinstance(unit, dict) else ""
+        if note is not None and unit_id in unit_ids:
+            annotations[unit_id] = note
+    return annotations
+
+
+async def request_annotations(segments: dict, unit_ids: list) -> dict:
+    """One (non-streaming) annotation call for the given unit ids"""
+    response = await client.chat.completions.create(
+        model="gpt-4o-mini",
+        response_format={"type": "json_object"},
+        messages=build_unit_messages(segments, unit_ids),
+    )
+    log_output_tokens(f"{len(unit_ids)} units", response)
+    return parse_units_response(response.choices[0].message.content, unit_ids)
+
+
+async def complete_annotations(full_text: str, segments: dict, annotations: dict):
+    """
+    Fill in units the model skipped (one repair call). Returns the stitched
+    task list, or the full-format result if units are still missing.
+    """
+    unit_ids = [unit_id for unit_id, _, _ in segment_units(segments)]
+    missing = [unit_id for unit_id in unit_ids if unit_id not in annotations]
+    if missing:
+        print(f"[CLARITY] Units without annotation: {missing} -> repair call")
+        annotations.update(await request_annotations(segments, missing))
+        missing = [unit_id for unit_id in unit_ids if unit_id not in annotations]
+    if missing:
+        print(f"[CLARITY] Still missing {missing} -> full analysis")
+        return await analyze_tasks_full(full_text)
+    return [stitch_task(task, annotations) for task in segments["tasks"]]
+
+
+async def annotate_segments(full_text: str, segments: dict):
+    """analyze_tasks() for a text segment_tasks() could split"""
+    unit_ids = [unit_id for unit_id, _, _ in segment_units(segments)]
+    print(f"[CLARITY] Segmented locally: {len(segments['tasks'])} tasks, {len(unit_ids)} units")
+    annotations = await request_annotations(segments, unit_ids)
+    return await complete_annotations(full_text, segments, annotations)
+
+
+async def annotate_segments_stream(full_text: str, segments: dict):
+    """
+    Streaming variant of annotate_segments(): a task is emitted as soon as
+    all its subtasks are annotated and every earlier task has been emitted.
+    """
+    unit_ids = [unit_id for unit_id, _, _ in segment_units(segments)]
+    print(f"[CLARITY] Segmented locally (stream): {len(segments['tasks'])} tasks, {len(unit_ids)} units")
+    stream = await client.chat.completions.create(
+        model="gpt-4o-mini",
+        response_format={"type": "json_object"},
+        messages=build_unit_messages(segments, unit_ids),
+        stream=True,
+    )
+
+    tasks = segments["tasks"]
+    parser = JsonArrayItemParser("units")
+    annotations = {}
+    emitted = 0
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        for unit in parser.feed(chunk.choices[0].delta.content or ""):
+            note = valid_annotation(unit)
+            unit_id = str(unit.get("id", "")).strip()
+            if note is not None and unit_id in unit_ids:
+                annotations[unit_id] = note
+        while emitted < len(tasks) and all(
+            f"{tasks[emitted]['number']}{subtask['label']}" in annotations
+            for subtask in tasks[emitted]["subtasks"]
+        ):
+            yield "task", stitch_task(tasks[emitted], annotations)
+            emitted += 1
+
+    result = await complete_annotations(full_text, segments, annotations)
+    if isinstance(result, list):
+        for task in result[emitted:]:
+            yield "task", task
+    yield "result", result
+
+
+# Regeln für die sokratischen Fragen (Vollformat und vorsegmentierte Teilaufgaben)
+CLARITY_QUESTION_RULES = """WICHTIG: Die Fragen müssen **sehr aufgabenspezifisch** sein und sich konkret auf Terme, Zahlen und Begriffe der jeweiligen Teilaufgabe beziehen.
 
 Für jede Teilaufgabe erstelle Fragen aus diesen Kategorien (in beliebiger Reihenfolge):
 
@@ -156,7 +727,28 @@ Regeln für die Formulierung:
 - Formuliere die Fragen so, dass der Schüler *konkrete* nächste Schritte beschreiben muss
   (z.B. „Welche Zahl…“, „Welchen Term…“, „Welche Umformung…“, „Welche Eigenschaft…“).
 
-Ausgabeformat:
+"""
+
+
+def build_clarity_messages(full_text: str) -> list:
+    """Chat messages for the Clarity Coach task analysis"""
+    clarity_prompt = f"""
+Du bist der KI-Entwicklungsassistent für das Projekt Clarity Coach.
+
+Deine Aufgabe:
+- Analysiere den folgenden Aufgabentext (mehrere Aufgaben mit Teilaufgaben möglich).
+- Erkenne Aufgaben (1., 2., 3., …) und Teilaufgaben (a), b), c), …).
+- Erstelle für jede Aufgabe und jede Teilaufgabe:
+  • "number": Aufgabennummer als String (z.B. "1")
+  • "topic": kurzes Thema (z.B. "Kubische Gleichungen", "Potenzfunktionen")
+  • "difficulty": "leicht", "mittel" oder "anspruchsvoll"
+  • "task": vollständiger Text der übergeordneten Aufgabe (ohne die einzelnen Teilaufgaben)
+  • "subtasks": Liste von Objekten mit:
+      - "label": Buchstabe der Teilaufgabe, z.B. "a"
+      - "task": Text der Teilaufgabe
+      - "questions": 3–5 sokratische Fragen (Strings)
+
+{CLARITY_QUESTION_RULES}Ausgabeformat:
 - Gib ein JSON-OBJEKT mit GENAU einem Feld "tasks" zurück.
 - "tasks" ist eine LISTE von Aufgabenobjekten wie im folgenden Schema:
 
@@ -189,24 +781,83 @@ Hier ist der vollständige Aufgabentext:
 {full_text}
 """
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        response_format={"type": "json_object"},
-        messages=[
-            {
-                "role": "system",
-                "content": (
-                    "Du bist ein geduldiger, sokratischer Mathematiklehrer. "
-                    "Du erzeugst sehr aufgabenspezifische Fragen und gibst "
-                    "die Antwort ausschließlich als gültiges JSON-Objekt mit dem Feld 'tasks' zurück."
-                ),
-            },
-            {"role": "user", "content": clarity_prompt},
-        ],
-    )
+    return [
+        {
+            "role": "system",
+            "content": (
+                "Du bist ein geduldiger, sokratischer Mathematiklehrer. "
+                "Du erzeugst sehr aufgabenspezifische Fragen und gibst "
+                "die Antwort ausschließlich als gültiges JSON-Objekt mit dem Feld 'tasks' zurück."
+            ),
+        },
+        {"role": "user", "content": clarity_prompt},
+    ]
 
-    raw = response.choices[0].message.content
-    
+
+def build_unit_messages(segments: dict, unit_ids: list) -> list:
+    """
+    Chat messages for pre-segmented tasks: the model gets the units with
+    their ids and returns only topic, difficulty and questions per unit.
+    """
+    wanted = set(unit_ids)
+    tasks = []
+    for task in segments["tasks"]:
+        units = [
+            {"id": f"{task['number']}{subtask['label']}", "text": subtask["task"]}
+            for subtask in task["subtasks"]
+            if f"{task['number']}{subtask['label']}" in wanted
+        ]
+        if units:
+            tasks.append({"number": task["number"], "task": task["task"], "units": units})
+    context = f"Kontext (Text vor der ersten Aufgabe):\n{segments['preamble']}\n\n" if segments["preamble"] else ""
+
+    unit_prompt = f"""
+Du bist der KI-Entwicklungsassistent für das Projekt Clarity Coach.
+
+Deine Aufgabe:
+- Die Aufgaben und Teilaufgaben sind bereits erkannt (siehe JSON unten).
+- Erstelle für JEDE Teilaufgabe ("units", erkennbar an "id"):
+  • "id": die id der Teilaufgabe, unverändert (z.B. "1a")
+  • "topic": kurzes Thema (z.B. "Kubische Gleichungen", "Potenzfunktionen")
+  • "difficulty": "leicht", "mittel" oder "anspruchsvoll"
+  • "questions": 3–5 sokratische Fragen (Strings)
+- Den Aufgabentext NICHT wiederholen.
+
+{CLARITY_QUESTION_RULES}Ausgabeformat:
+- Gib ein JSON-OBJEKT mit GENAU einem Feld "units" zurück, ein Eintrag pro id, in der gegebenen Reihenfolge:
+
+{{
+  "units": [
+    {{
+      "id": "1a",
+      "topic": "Kubische Gleichungen",
+      "difficulty": "mittel",
+      "questions": ["Frage 1 ...", "Frage 2 ...", "Frage 3 ..."]
+    }}
+  ]
+}}
+
+Keine Erklärtexte außerhalb dieses JSON-Objekts, keine Markdown-Codeblöcke.
+
+{context}Aufgaben:
+{json.dumps(tasks, ensure_ascii=False, indent=1)}
+"""
+
+    return [
+        {
+            "role": "system",
+            "content": (
+                "Du bist ein geduldiger, sokratischer Mathematiklehrer. "
+                "Du erzeugst sehr aufgabenspezifische Fragen und gibst "
+                "die Antwort ausschließlich als gültiges JSON-Objekt mit dem Feld 'units' zurück."
+            ),
+        },
+        {"role": "user", "content": unit_prompt},
+    ]
+
+
+def parse_tasks_response(raw: str):
+    """Task list from the JSON-mode answer, or an error object with the raw output"""
     # Safe printing for Windows console (handle Unicode characters)
     try:
         print("\n--- GPT-Raw-Response (JSON-Modus) ---\n", raw, "\n------------------------\n")
@@ -232,19 +883,109 @@ Hier ist der vollständige Aufgabentext:
         }
 
 
+# ------------------------------
+# Server-Sent Events
+# ------------------------------
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_event(event: str, data) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+# ------------------------------
+# Antwortzeiten je Endpoint (Time-to-first-byte)
+# ------------------------------
+class LatencyStats:
+    """Rolling TTFB / total duration samples per endpoint"""
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self._samples = {}
+
+    def record(self, endpoint: str, ttfb: float, total: float):
+        samples = self._samples.setdefault(endpoint, deque(maxlen=self.window))
+        samples.append((ttfb if ttfb is not None else total, total))
+
+    def summary(self) -> dict:
+        def percentile(values, q):
+            values = sorted(values)
+            return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 1)
+
+        report = {}
+        for endpoint, samples in self._samples.items():
+            ttfbs = [ttfb for ttfb, _ in samples]
+            totals = [total for _, total in samples]
+            report[endpoint] = {
+                "count": len(samples),
+                "ttfbMsP50": percentile(ttfbs, 0.5),
+                "ttfbMsP95": percentile(ttfbs, 0.95),
+                "totalMsP50": percentile(totals, 0.5),
+                "totalMsP95": percentile(totals, 0.95),
+            }
+        return report
+
+
+latency_stats = LatencyStats()
+
+
+@app.get("/latency-stats")
+async def get_latency_stats():
+    """
+    Time-to-first-byte per endpoint. For the non-streaming endpoints the
+    first byte is the whole answer, so TTFB equals the total duration.
+    """
+    return latency_stats.summary()
+
+
 # ------------------------------
 # Textbasierte Eingabe (z.B. für Tests)
 # ------------------------------
 @app.post("/clarity")
-def clarity(input: dict = Body(...)):
+async def clarity(input: dict = Body(...)):
     user_input = input.get("task", "")
     if not user_input.strip():
         return {"error": "Kein Aufgabentext übergeben."}
 
-    result = run_clarity_coach(user_input)
+    # "fresh": true -> Cache umgehen und neue Fragen erzeugen
+    result = await run_clarity_coach(user_input, fresh=bool(input.get("fresh", False)))
     return result
 
 
+@app.post("/clarity/stream")
+async def clarity_stream(input: dict = Body(...)):
+    """
+    /clarity as Server-Sent Events: one ``task`` event ({"index", "task"})
+    per task as soon as the model has finished it, then ``done`` or ``error``.
+    """
+    user_input = input.get("task", "")
+    if not user_input.strip():
+        return {"error": "Kein Aufgabentext übergeben."}
+    fresh = bool(input.get("fresh", False))
+
+    async def event_stream():
+        try:
+            index = 0
+            async for event, data in run_clarity_coach_stream(user_input, fresh=fresh):
+                if event == "task":
+                    yield sse_event("task", {"index": index, "task": data})
+                    index += 1
+                elif isinstance(data, list):
+                    yield sse_event("done", {"taskCount": len(data)})
+                else:
+                    yield sse_event("error", data)
+        except Exception as e:
+            print(f"[ERROR] Clarity stream failed: {e}")
+            yield sse_event("error", {"error": f"Analysis failed: {str(e)[:200]}"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
 # ------------------------------
 # REMOVED: Lösung für eine Teilaufgabe generieren
 # This endpoint has been REMOVED because it directly contradicts
@@ -269,6 +1010,61 @@ async def get_hint(payload: dict = Body(...)):
     2. Directive: Give specific steps to take without revealing answer
     3. Specific: Provide targeted help for a specific aspect
     """
+    subtask_text = payload.get("subtaskText", "")
+    if not subtask_text or not str(subtask_text).strip():
+        raise HTTPException(status_code=400, detail="Keine Teilaufgabe übergeben.")
+
+    # Identische Hinweis-Anfragen, die gleichzeitig eintreffen, teilen sich einen Call
+    started = time.perf_counter()
+    result = await inflight.do("hint", hint_flight_key(payload), lambda: generate_hint(payload))
+    elapsed = time.perf_counter() - started
+    latency_stats.record("/hint", elapsed, elapsed)
+    return result
+
+
+def hint_flight_key(payload: dict) -> str:
+    """Key under which identical concurrent hint requests are coalesced"""
+    return content_hash(
+        normalize_text(str(payload.get("taskText") or "")),
+        normalize_text(str(payload.get("topic") or "")),
+        str(payload.get("subLabel") or ""),
+        normalize_text(str(payload.get("subtaskText") or "")),
+        str(payload.get("hintLevel", 1)),
+        normalize_text(str(payload.get("previousHints") or "")),
+    )
+
+
+async def generate_hint(payload: dict):
+    messages, hint_level = build_hint_messages(payload)
+
+    try:
+        response = await client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=messages,
+            response_format={"type": "json_object"},
+            temperature=0.7
+        )
+
+        hint_json_str = response.choices[0].message.content
+        
+        # Safe printing
+        try:
+            print(f"\n--- Hint Level {hint_level} Generated ---\n{hint_json_str[:200]}...\n")
+        except UnicodeEncodeError:
+            print(f"\n--- Hint Level {hint_level} Generated ---\n[Contains Unicode characters]\n")
+
+        return hint_response(json.loads(hint_json_str), hint_level)
+
+    except json.JSONDecodeError as e:
+        print(f"[ERROR] Hint JSON Parse Error: {e}")
+        raise HTTPException(status_code=500, detail=f"Hint generation failed: {str(e)}")
+    except Exception as e:
+        print(f"[ERROR] Error generating hint: {e}")
+        raise HTTPException(status_code=500, detail=f"Hint generation failed: {str(e)}")
+
+
+def build_hint_messages(payload: dict):
+    """Chat messages for a hint request, plus the requested hint level"""
     task_number = payload.get("taskNumber")
     task_text = payload.get("taskText", "")
     topic = payload.get("topic", "")
@@ -277,9 +1073,6 @@ async def get_hint(payload: dict = Body(...)):
     hint_level = payload.get("hintLevel", 1)
     previous_hints = payload.get("previousHints", None)
 
-    if not subtask_text or not str(subtask_text).strip():
-        raise HTTPException(status_code=400, detail="Keine Teilaufgabe übergeben.")
-
     # Define hint strategies based on level
     hint_strategies = {
         1: """
@@ -346,46 +1139,78 @@ REGELN:
 - Gib Mut und Motivation
 """
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "Du bist ein geduldiger, sokratischer Mathematiklehrer. "
-                        "Du hilfst Schülern, selbst zu verstehen, ohne die Lösung zu verraten."
-                    ),
-                },
-                {"role": "user", "content": hint_prompt},
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.7
-        )
+    messages = [
+        {
+            "role": "system",
+            "content": (
+                "Du bist ein geduldiger, sokratischer Mathematiklehrer. "
+                "Du hilfst Schülern, selbst zu verstehen, ohne die Lösung zu verraten."
+            ),
+        },
+        {"role": "user", "content": hint_prompt},
+    ]
+    return messages, hint_level
 
-        hint_json_str = response.choices[0].message.content
-        
-        # Safe printing
+
+def hint_response(hint_data: dict, hint_level) -> dict:
+    """Response shape of /hint (also the final event of /hint/stream)"""
+    return {
+        "hint": hint_data.get("hint", "Denke über die Grundlagen nach."),
+        "encouragement": hint_data.get("encouragement", "Du schaffst das!"),
+        "level": hint_level,
+        "success": True
+    }
+
+
+# ------------------------------
+# Hinweise als Token-Stream (Server-Sent Events)
+# ------------------------------
+@app.post("/hint/stream")
+async def get_hint_stream(payload: dict = Body(...)):
+    """
+    Opt-in streaming variant of /hint.
+
+    Events: ``hint`` and ``encouragement`` with {"delta": "..."} while the
+    model writes the fields, then ``done`` with the same JSON as /hint
+    (or ``error``). Identical concurrent requests share one upstream stream.
+    """
+    started = time.perf_counter()
+    subtask_text = payload.get("subtaskText", "")
+    if not subtask_text or not str(subtask_text).strip():
+        raise HTTPException(status_code=400, detail="Keine Teilaufgabe übergeben.")
+
+    messages, hint_level = build_hint_messages(payload)
+
+    async def produce():
+        reader = JsonStringFieldReader(["hint", "encouragement"])
         try:
-            print(f"\n--- Hint Level {hint_level} Generated ---\n{hint_json_str[:200]}...\n")
-        except UnicodeEncodeError:
-            print(f"\n--- Hint Level {hint_level} Generated ---\n[Contains Unicode characters]\n")
+            stream = await client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                response_format={"type": "json_object"},
+                temperature=0.7,
+                stream=True,
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                for field, delta in reader.feed(chunk.choices[0].delta.content or ""):
+                    yield sse_event(field, {"delta": delta})
 
-        hint_data = json.loads(hint_json_str)
-        
-        return {
-            "hint": hint_data.get("hint", "Denke über die Grundlagen nach."),
-            "encouragement": hint_data.get("encouragement", "Du schaffst das!"),
-            "level": hint_level,
-            "success": True
-        }
+            yield sse_event("done", hint_response(json.loads(reader.text), hint_level))
+        except Exception as e:
+            print(f"[ERROR] Error streaming hint: {e}")
+            yield sse_event("error", {"error": f"Hint generation failed: {str(e)}"})
 
-    except json.JSONDecodeError as e:
-        print(f"[ERROR] Hint JSON Parse Error: {e}")
-        raise HTTPException(status_code=500, detail=f"Hint generation failed: {str(e)}")
-    except Exception as e:
-        print(f"[ERROR] Error generating hint: {e}")
-        raise HTTPException(status_code=500, detail=f"Hint generation failed: {str(e)}")
+    async def event_stream():
+        first_token = None
+        async for event in stream_inflight.stream("hint", hint_flight_key(payload), produce):
+            if first_token is None:
+                first_token = time.perf_counter() - started
+            yield event
+        latency_stats.record("/hint/stream", first_token, time.perf_counter() - started)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 
 # ------------------------------
@@ -464,7 +1289,7 @@ REGELN:
     try:
         print(f"[CHECK] Checking approach for task {task_number}{sub_label}...")
         
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model="gpt-4o-mini",
             messages=[
                 {
@@ -511,95 +1336,524 @@ REGELN:
 
 
 # ------------------------------
-# Datei-Upload (Bild oder PDF)
+# Vision-OCR für eine Seite / ein Bild
 # ------------------------------
-@app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+# Maximale Anzahl gleichzeitiger Vision-Calls pro Upload
+OCR_MAX_CONCURRENCY = int(os.getenv("OCR_MAX_CONCURRENCY", "6"))
+
+async def spool_upload(file: UploadFile) -> dict:
+    """
+    Copy an upload in UPLOAD_CHUNK_BYTES blocks to a temp file, hashing on
+    the way. Returns ``{"path", "size", "digest"}``; the caller removes the
+    file (remove_temp_file). Raises 413 above UPLOAD_MAX_BYTES.
+    """
+    suffix = os.path.splitext(file.filename or "")[1].lower()
+    fd, path = tempfile.mkstemp(prefix="clarity-upload-", suffix=suffix, dir=UPLOAD_TMP_DIR)
+    digest = hashlib.sha256()
+    size = 0
     try:
-        print(f"[UPLOAD] Started: {file.filename}")
-        
-        filename = file.filename.lower()
-        contents = await file.read()
-        extracted_texts = []
-
-        print(f"[UPLOAD] File size: {len(contents)} bytes")
-        print(f"[UPLOAD] File type: {filename}")
-
-        # Text, PDF oder Bild unterscheiden
-        if filename.endswith(".txt"):
-            # Textdatei direkt lesen
-            print("[UPLOAD] Processing as text file...")
-            text_content = contents.decode("utf-8")
-            extracted_texts.append(text_content)
-            
-        elif filename.endswith(".pdf"):
-            print("[UPLOAD] Processing as PDF...")
-            pdf = fitz.open(stream=BytesIO(contents), filetype="pdf")
-            for page_num in range(len(pdf)):
-                print(f"[UPLOAD] Processing page {page_num + 1}/{len(pdf)}...")
-                page = pdf.load_page(page_num)
-                pix = page.get_pixmap(dpi=150)
-                img_b64 = base64.b64encode(pix.tobytes("jpeg")).decode("utf-8")
-
-                vision_response = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": (
-                                        f"Lies den Inhalt dieser Seite ({page_num + 1}) "
-                                        "mit allen Mathematikaufgaben und gib NUR den erkannten Text wieder:"
-                                    ),
-                                },
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/jpeg;base64,{img_b64}"
-                                    },
-                                },
-                            ],
-                        }
-                    ],
-                )
-                extracted_texts.append(vision_response.choices[0].message.content)
-                
-        else:
-            # Einzelbild direkt verarbeiten
-            print("[UPLOAD] Processing as image...")
-            b64 = base64.b64encode(contents).decode("utf-8")
-            vision_response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail=upload_too_large_message())
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        remove_temp_file(path)
+        raise
+    return {"path": path, "size": size, "digest": digest.hexdigest()}
+
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def remove_temp_file(path: str):
+    try:
+        os.remove(path)
+    except OSError as e:
+        print(f"[UPLOAD] Could not remove temp file {path}: {e}")
+
+
+# Zum Vergleich zusätzlich die alte 150-dpi-Farbversion messen (Report "imageBytesSaved").
+# Kostet einen zweiten Render pro Vision-Seite, daher nur zum Messen einschalten.
+UPLOAD_REPORT_BYTES_SAVED = os.getenv("UPLOAD_REPORT_BYTES_SAVED", "0") == "1"
+
+# OCR-Modus für PDFs: "parallel" = ein Vision-Call pro Seite,
+# "batch" = mehrere Seiten pro Vision-Call (spart Overhead und Prompt-Tokens)
+OCR_MODES = ("parallel", "batch")
+OCR_MODE = os.getenv("OCR_MODE", "parallel")
+OCR_PAGES_PER_CALL = int(os.getenv("OCR_PAGES_PER_CALL", "4"))
+OCR_MAX_PAGES_PER_CALL = 10
+
+# Trennzeile zwischen den Seiten einer Batch-Antwort
+PAGE_DELIMITER_RE = re.compile(r"^[ \t]*=== SEITE (\d+) ===[ \t]*$", re.MULTILINE)
+
+
+async def ocr_image(img_b64: str, instruction: str) -> str:
+    """Send one base64 JPEG to the vision model and return the recognized text"""
+    vision_response = await client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {
+                "role": "user",
+                "content": [
                     {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": "Lies den Inhalt dieser Aufgabe und gib NUR den Text wieder:",
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {"url": f"data:image/jpeg;base64,{b64}"},
-                            },
-                        ],
-                    }
+                        "type": "text",
+                        "text": instruction,
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{img_b64}"
+                        },
+                    },
                 ],
+            }
+        ],
+    )
+    return vision_response.choices[0].message.content
+
+
+async def ocr_images_batch(images_b64: list) -> str:
+    """
+    Send several page images in one vision request. The model is asked to
+    start every page with ``=== SEITE n ===`` (n = 1..len(images_b64));
+    split_batch_response() cuts the answer back into pages.
+    """
+    count = len(images_b64)
+    content = [{
+        "type": "text",
+        "text": f"""Du bekommst {count} Seiten eines Aufgabenblatts als Bilder.
+Lies den Inhalt JEDER Seite mit allen Mathematikaufgaben und gib NUR den erkannten Text wieder.
+
+FORMAT (genau einhalten):
+- Beginne jede Seite mit einer eigenen Zeile "=== SEITE n ===" (n = 1 bis {count}, in Bildreihenfolge)
+- Danach folgt der Text dieser Seite
+- Auch leere Seiten bekommen ihre Trennzeile
+- Keine weiteren Kommentare""",
+    }]
+    for index, img_b64 in enumerate(images_b64, start=1):
+        content.append({"type": "text", "text": f"Seite {index}:"})
+        content.append({
+            "type": "image_url",
+            "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"},
+        })
+
+    vision_response = await client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[{"role": "user", "content": content}],
+    )
+    return vision_response.choices[0].message.content
+
+
+def split_batch_response(raw: str, count: int):
+    """
+    Per-page texts of a batch answer, or None if the delimiters do not
+    cleanly number the pages 1..count in order.
+    """
+    matches = list(PAGE_DELIMITER_RE.finditer(raw or ""))
+    if [int(m.group(1)) for m in matches] != list(range(1, count + 1)):
+        return None
+    # Text vor der ersten Trennzeile darf nur Leerraum sein
+    if raw[:matches[0].start()].strip():
+        return None
+    texts = []
+    for index, match in enumerate(matches):
+        end = matches[index + 1].start() if index + 1 < len(matches) else len(raw)
+        texts.append(raw[match.end():end].strip())
+    return texts
+
+
+# ------------------------------
+# Upload-Pipeline (gemeinsam für /upload und /upload/stream)
+# ------------------------------
+def new_upload_report() -> dict:
+    """Per-upload counters, sent as "report" event / X-Upload-Report header"""
+    return {
+        "pages": 0,
+        "textLayerPages": 0,
+        "visionPages": 0,
+        "visionCalls": 0,
+        "batchFallbacks": 0,
+        "cachedPages": 0,
+        "skippedPages": [],
+        "filterMs": 0.0,
+        "imageBytesSent": 0,
+        "imageBytesOriginal": 0,
+        "imageBytesSaved": 0,
+    }
+
+
+def count_image_bytes(report: dict, info: dict):
+    """Add one prepared image to the report (original size only if measured)"""
+    report["imageBytesSent"] += info["bytes"]
+    if "referenceBytes" in info:
+        report["imageBytesOriginal"] += info["referenceBytes"]
+        report["imageBytesSaved"] += info["referenceBytes"] - info["bytes"]
+
+
+async def extract_pdf_pages(pdf_path: str, report: dict, fresh: bool = False,
+                            ocr_mode: str = OCR_MODE, pages_per_call: int = OCR_PAGES_PER_CALL):
+    """
+    Async generator over the pages of a PDF file in completion order.
+
+    Yields ``(page_num, page_count, text, source)`` with source "text-layer",
+    "cache" or "vision". Text-layer and cached pages arrive immediately, vision
+    pages as soon as their (concurrent) OCR call returns. Blank and duplicated
+    scans are yielded with text None and source "blank"/"duplicate" and never
+    reach the vision model. Page and image byte counters are added to ``report``.
+
+    ``ocr_mode="batch"`` packs up to ``pages_per_call`` pages into one vision
+    request; a batch whose answer cannot be split is re-read page by page.
+    """
+    semaphore = asyncio.Semaphore(max(1, OCR_MAX_CONCURRENCY))
+    page_filter = PageFilter()
+    pages_per_call = max(1, min(OCR_MAX_PAGES_PER_CALL, pages_per_call))
+    if ocr_mode != "batch":
+        pages_per_call = 1
+
+    # Alle Seiten laufen als eigene Tasks; fertige Seiten landen in "finished"
+    # (page_num, text, source) oder als Exception
+    finished = asyncio.Queue()
+    page_tasks = []
+    ocr_tasks = []
+    pending = []  # (page_num, page_key, img_b64) für den nächsten Batch
+    undecided = 0  # Seiten, die noch in einen Batch kommen könnten
+    closing = False
+    mask_wait = 0.0
+
+    async def load_mask(page_num: int):
+        # Filterzeit ohne Wartezeit auf den Pool (Checks laufen nacheinander)
+        nonlocal mask_wait
+        started = time.perf_counter()
+        mask, compute_ms = await raster_pool.run(ink_mask_page, pdf_path, page_num)
+        mask_wait += (time.perf_counter() - started) * 1000 - compute_ms
+        return mask
+
+    async def ocr_page(page_num: int, page_key: str, img_b64: str):
+        async with semaphore:
+            report["visionCalls"] += 1
+            text = await ocr_image(
+                img_b64,
+                f"Lies den Inhalt dieser Seite ({page_num + 1}) "
+                "mit allen Mathematikaufgaben und gib NUR den erkannten Text wieder:",
+            )
+        await ocr_cache.aset(page_key, text)
+        print(f"[UPLOAD] Page {page_num + 1}/{page_count} recognized")
+        return [(page_num, text)]
+
+    async def ocr_batch(batch: list):
+        try:
+            if len(batch) == 1:
+                results = await ocr_page(*batch[0])
+            else:
+                results = await read_batch(batch)
+            for page_num, text in results:
+                finished.put_nowait((page_num, text, "vision"))
+        except Exception as e:
+            finished.put_nowait(e)
+        finally:
+            batch.clear()  # Base64-Bilder sofort freigeben
+
+    async def read_batch(batch: list):
+        async with semaphore:
+            report["visionCalls"] += 1
+            raw = await ocr_images_batch([img_b64 for _, _, img_b64 in batch])
+        texts = split_batch_response(raw, len(batch))
+        if texts is None:
+            # Antwort nicht sauber trennbar -> Seiten einzeln lesen
+            labels = ", ".join(str(page_num + 1) for page_num, _, _ in batch)
+            print(f"[UPLOAD] Batch (pages {labels}) could not be split -> per-page fallback")
+            report["batchFallbacks"] += 1
+            results = await asyncio.gather(*(ocr_page(*entry) for entry in batch))
+            return [pair for result in results for pair in result]
+
+        for (page_num, page_key, _), text in zip(batch, texts):
+            await ocr_cache.aset(page_key, text)
+        print(f"[UPLOAD] Pages {batch[0][0] + 1}-{batch[-1][0] + 1}/{page_count} recognized (batch)")
+        return [(page_num, text) for (page_num, _, _), text in zip(batch, texts)]
+
+    def queue_for_ocr(entry=None):
+        """Collect pages until a batch is full (or no more pages can join)"""
+        nonlocal pending
+        if closing:
+            return
+        if entry is not None:
+            pending.append(entry)
+        if pending and (len(pending) >= pages_per_call or undecided == 0):
+            ocr_tasks.append(asyncio.create_task(ocr_batch(pending)))
+            pending = []
+
+    async def read_page(page_num: int, filtered: list):
+        """Text layer -> filter -> render -> OCR cache / vision queue"""
+        try:
+            scan = await raster_pool.run(scan_page, pdf_path, page_num)
+            if scan["text"] is not None:
+                print(f"[UPLOAD] Page {page_num + 1}/{page_count}: using text layer")
+                report["textLayerPages"] += 1
+                return page_num, scan["text"], "text-layer"
+
+            # Filter-Entscheidungen in Seitenreihenfolge (Duplikat = spätere Seite)
+            for earlier in filtered[:page_num]:
+                await earlier.wait()
+            # Leere Rückseiten / doppelt gescannte Seiten gar nicht erst lesen
+            filter_started = time.perf_counter()
+            wait_before = mask_wait
+            skip_reason, duplicate_of = await page_filter.check(
+                page_num, scan["ink"], scan["hash"], load_mask
             )
-            extracted_texts.append(vision_response.choices[0].message.content)
+            check_ms = (time.perf_counter() - filter_started) * 1000 - (mask_wait - wait_before)
+            report["filterMs"] += scan["filterMs"] + check_ms
+        finally:
+            filtered[page_num].set()
+
+        if skip_reason is not None:
+            skipped = {"page": page_num + 1, "reason": skip_reason}
+            if duplicate_of is not None:
+                skipped["duplicateOf"] = duplicate_of + 1
+            print(f"[UPLOAD] Page {page_num + 1}/{page_count}: skipped ({skip_reason})")
+            report["skippedPages"].append(skipped)
+            return page_num, None, skip_reason
+
+        print(f"[UPLOAD] Page {page_num + 1}/{page_count}: {scan['reason']} -> vision")
+        # Graustufen, Ränder beschnitten, dpi nach Schriftgröße
+        jpeg_bytes, info = await raster_pool.run(
+            render_page, pdf_path, page_num, UPLOAD_REPORT_BYTES_SAVED, scan["probe"]
+        )
+        scan = None
+
+        # Seite mit identischem Bild schon erkannt? -> kein Vision-Call
+        page_key = content_hash(jpeg_bytes)
+        cached_text = None if fresh else await ocr_cache.aget(page_key)
+        if cached_text is not None:
+            print(f"[UPLOAD] Page {page_num + 1}/{page_count}: OCR cache hit")
+            report["cachedPages"] += 1
+            return page_num, cached_text, "cache"
+
+        print(f"[UPLOAD] Page {page_num + 1}/{page_count}: {info['width']}x{info['height']} px "
+              f"@ {info['dpi']} dpi, {info['bytes']} bytes")
+        report["visionPages"] += 1
+        count_image_bytes(report, info)
+        img_b64 = base64.b64encode(jpeg_bytes).decode("utf-8")
+        del jpeg_bytes
+        queue_for_ocr((page_num, page_key, img_b64))
+        return None
+
+    async def run_page(page_num: int, filtered: list):
+        nonlocal undecided
+        try:
+            result = await read_page(page_num, filtered)
+            if result is not None:
+                finished.put_nowait(result)
+        except Exception as e:
+            finished.put_nowait(e)
+        finally:
+            # Letzte offene Seite entschieden -> angefangenen Batch abschicken
+            undecided -= 1
+            queue_for_ocr()
+
+    # Rendern/Text-Layer in Worker-Prozessen (Event-Loop bleibt frei),
+    # Vision-Calls parallel, begrenzt durch Semaphore
+    try:
+        page_count = await raster_pool.run(pdf_page_count, pdf_path)
+        report["pages"] += page_count
+        filtered = [asyncio.Event() for _ in range(page_count)]
+        undecided = page_count
+        page_tasks = [asyncio.create_task(run_page(page_num, filtered)) for page_num in range(page_count)]
+
+        for _ in range(page_count):
+            item = await finished.get()
+            if isinstance(item, Exception):
+                raise item
+            page_num, text, source = item
+            yield page_num, page_count, text, source
+
+        report["filterMs"] = round(report["filterMs"], 1)
+        print(f"[UPLOAD] {page_count - report['visionPages']}/{page_count} pages without vision call")
+    finally:
+        # Fehler oder Client weg -> offene Seiten und Vision-Calls abbrechen
+        closing = True
+        for task in page_tasks + ocr_tasks:
+            task.cancel()
+
+
+async def process_upload(filename: str, upload: dict, fresh: bool = False,
+                         stream_analysis: bool = False, ocr_mode: str = OCR_MODE,
+                         pages_per_call: int = OCR_PAGES_PER_CALL):
+    """
+    Upload pipeline as an async generator of ``(event, data)`` pairs for a
+    file spooled by spool_upload(). With ``stream_analysis`` tasks are
+    emitted while the model is still writing the rest of the analysis.
+    ``ocr_mode``/``pages_per_call`` select per-page or batched vision OCR
+    for PDFs (see extract_pdf_pages).
+
+    - "page":     text of one page is available (text layer, cache or vision)
+    - "analysis": all pages read, Clarity Coach analysis starts
+    - "task":     one analyzed task
+    - "report":   page sources, image bytes sent/saved and peak RSS (new_upload_report)
+    - "result":   final task list or error object (always the last event)
+    """
+    report = new_upload_report()
+    # Speicherspitze während des Uploads (Hauptprozess + Raster-Worker)
+    rss = PeakRssSampler(worker_pids=raster_pool.worker_pids)
+    rss.start()
+    try:
+        async with aclosing(read_upload(filename, upload, report, fresh, stream_analysis,
+                                        ocr_mode, pages_per_call)) as events:
+            async for event, data in events:
+                if event == "report":
+                    rss.sample()
+                    data.update(rss.report())
+                    print(f"[UPLOAD] Report: {data}")
+                yield event, data
+    finally:
+        rss.stop()
+
+
+async def read_upload(filename: str, upload: dict, report: dict, fresh: bool,
+                      stream_analysis: bool, ocr_mode: str, pages_per_call: int):
+    """Body of process_upload() (without memory sampling)"""
+    extracted_texts = []
+
+    print(f"[UPLOAD] File size: {upload['size']} bytes")
+    print(f"[UPLOAD] File type: {filename}")
+
+    # Gleiche Datei schon analysiert? (z.B. ganze Klasse lädt dasselbe Blatt hoch)
+    if filename.endswith(".txt"):
+        file_kind = "txt"
+    elif filename.endswith(".pdf"):
+        file_kind = "pdf"
+    else:
+        file_kind = "image"
+    # Mit Prompt-Version: nach Prompt-/Segmenter-Änderungen keine alten Analysen ausliefern
+    doc_key = content_hash(file_kind, CLARITY_PROMPT_VERSION, upload["digest"])
+    cached_result = None if fresh else await upload_cache.aget(doc_key)
+    if cached_result is not None:
+        print(f"[UPLOAD] Cache hit for document {doc_key[:12]}")
+        for index, task in enumerate(cached_result):
+            yield "task", {"index": index, "task": task}
+        yield "report", {**report, "documentCache": True}
+        yield "result", cached_result
+        return
+
+    # Text, PDF oder Bild unterscheiden
+    if file_kind == "txt":
+        # Textdatei direkt lesen
+        print("[UPLOAD] Processing as text file...")
+        text_content = (await asyncio.to_thread(read_file, upload["path"])).decode("utf-8")
+        extracted_texts.append(text_content)
+        report["pages"] += 1
+        report["textLayerPages"] += 1
+        yield "page", {"page": 1, "pageCount": 1, "source": "text", "chars": len(text_content)}
+
+    elif file_kind == "pdf":
+        print("[UPLOAD] Processing as PDF...")
+        page_texts = {}
+        async for page_num, page_count, text, source in extract_pdf_pages(
+            upload["path"], report, fresh=fresh, ocr_mode=ocr_mode, pages_per_call=pages_per_call
+        ):
+            page_texts[page_num] = text
+            yield "page", {
+                "page": page_num + 1,
+                "pageCount": page_count,
+                "source": source,
+                "chars": len(text or ""),
+            }
+        # Seiten wieder in Originalreihenfolge bringen (übersprungene ohne Text)
+        extracted_texts.extend(
+            page_texts[page_num] for page_num in sorted(page_texts) if page_texts[page_num] is not None
+        )
 
-        # Gesamttext zusammenfuehren
-        print("[UPLOAD] Merging extracted text...")
-        full_text = "\n\n".join(extracted_texts)
-        print(f"[UPLOAD] Extracted text length: {len(full_text)} characters")
+    else:
+        # Einzelbild direkt verarbeiten
+        print("[UPLOAD] Processing as image...")
+        report["pages"] += 1
+        page_key = content_hash(upload["digest"])
+        text = None if fresh else await ocr_cache.aget(page_key)
+        source = "cache"
+        if text is None:
+            # Handyfotos sind oft mehrere MB groß - vorher verkleinern
+            prepared = await raster_pool.run(prepare_photo, upload["path"], filename.rsplit(".", 1)[-1])
+            if prepared is not None:
+                image_bytes, info = prepared
+            else:
+                image_bytes = await asyncio.to_thread(read_file, upload["path"])
+                info = {"bytes": len(image_bytes)}
+            count_image_bytes(report, info)
+            b64 = base64.b64encode(image_bytes).decode("utf-8")
+            del image_bytes, prepared
+            text = await ocr_image(b64, "Lies den Inhalt dieser Aufgabe und gib NUR den Text wieder:")
+            await ocr_cache.aset(page_key, text)
+            source = "vision"
+            report["visionPages"] += 1
+            report["visionCalls"] += 1
+        else:
+            report["cachedPages"] += 1
+        extracted_texts.append(text)
+        yield "page", {"page": 1, "pageCount": 1, "source": source, "chars": len(text or "")}
+
+    # Gesamttext zusammenfuehren
+    print("[UPLOAD] Merging extracted text...")
+    full_text = "\n\n".join(extracted_texts)
+    print(f"[UPLOAD] Extracted text length: {len(full_text)} characters")
+
+    # Clarity-Coach-Logik auf den erkannten Text anwenden
+    print("[UPLOAD] Running Clarity Coach analysis...")
+    yield "analysis", {"chars": len(full_text)}
+    if stream_analysis:
+        result = None
+        index = 0
+        async for event, data in run_clarity_coach_stream(full_text, fresh=fresh):
+            if event == "task":
+                yield "task", {"index": index, "task": data}
+                index += 1
+            else:
+                result = data
+    else:
+        result = await run_clarity_coach(full_text, fresh=fresh)
+        if isinstance(result, list):
+            for index, task in enumerate(result):
+                yield "task", {"index": index, "task": task}
 
-        # Clarity-Coach-Logik auf den erkannten Text anwenden
-        print("[UPLOAD] Running Clarity Coach analysis...")
-        result = run_clarity_coach(full_text)
-        
-        print("[UPLOAD] Analysis complete!")
+    # Nur erfolgreiche Analysen cachen (keine Fehlerobjekte)
+    if isinstance(result, list):
+        await upload_cache.aset(doc_key, result)
+
+    print("[UPLOAD] Analysis complete!")
+    yield "report", report
+    yield "result", result
+
+
+# ------------------------------
+# Datei-Upload (Bild oder PDF)
+# ------------------------------
+def validate_ocr_mode(ocr_mode: str):
+    if ocr_mode not in OCR_MODES:
+        raise HTTPException(status_code=400, detail=f"ocr_mode must be one of {', '.join(OCR_MODES)}")
+
+
+@app.post("/upload")
+async def upload_file(response: Response, file: UploadFile = File(...), fresh: bool = False,
+                      ocr_mode: str = OCR_MODE, pages_per_call: int = OCR_PAGES_PER_CALL):
+    validate_ocr_mode(ocr_mode)
+    print(f"[UPLOAD] Started: {file.filename}")
+    # In Blöcken auf Disk statt file.read() (413 bei Überschreitung)
+    upload = await spool_upload(file)
+    try:
+        result = None
+        async for event, data in process_upload(file.filename.lower(), upload, fresh,
+                                                ocr_mode=ocr_mode, pages_per_call=pages_per_call):
+            if event == "report":
+                # Body bleibt die Aufgabenliste (Frontend), Report als Header
+                response.headers["X-Upload-Report"] = json.dumps(data)
+            elif event == "result":
+                result = data
         return result
     
     except Exception as e:
@@ -610,6 +1864,111 @@ async def upload_file(file: UploadFile = File(...)):
             status_code=500, 
             detail=f"Upload/Analysis failed: {error_msg[:200]}"
         )
+    finally:
+        await asyncio.to_thread(remove_temp_file, upload["path"])
+
+
+# ------------------------------
+# Datei-Upload mit Fortschritt (Server-Sent Events)
+# ------------------------------
+@app.post("/upload/stream")
+async def upload_file_stream(file: UploadFile = File(...), fresh: bool = False,
+                             ocr_mode: str = OCR_MODE, pages_per_call: int = OCR_PAGES_PER_CALL):
+    """
+    Same pipeline (and query parameters) as /upload, streamed as Server-Sent Events:
+
+    - ``page``:     {"page", "pageCount", "source", "chars"} per recognized page
+    - ``analysis``: all pages read, analysis started
+    - ``task``:     {"index", "task"} per analyzed task
+    - ``done``:     {"taskCount", "report"} after the last task
+    - ``error``:    {"error", ...} if the upload or analysis failed
+    """
+    validate_ocr_mode(ocr_mode)
+    print(f"[UPLOAD] Started (stream): {file.filename}")
+    # Datei vor dem Streamen sichern - das UploadFile wird nach dem Handler geschlossen
+    upload = await spool_upload(file)
+    filename = file.filename.lower()
+
+    async def event_stream():
+        report = None
+        try:
+            async for event, data in process_upload(filename, upload, fresh, stream_analysis=True,
+                                                    ocr_mode=ocr_mode, pages_per_call=pages_per_call):
+                if event == "report":
+                    report = data
+                elif event != "result":
+                    yield sse_event(event, data)
+                elif isinstance(data, list):
+                    yield sse_event("done", {"taskCount": len(data), "report": report})
+                else:
+                    yield sse_event("error", data)
+        except Exception as e:
+            print(f"[ERROR] Upload stream failed: {e}")
+            yield sse_event("error", {"error": f"Upload/Analysis failed: {str(e)[:200]}"})
+        finally:
+            await asyncio.to_thread(remove_temp_file, upload["path"])
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
+# ------------------------------
+# Artefakt-Cache für /visualize, /animate und /plot
+# ------------------------------
+# Die Antworten hängen nur von Teilaufgabe + Prompt ab. Bei Prompt-Änderungen
+# die passende Version erhöhen, damit alte Einträge nicht mehr getroffen werden.
+ARTIFACT_PROMPT_VERSIONS = {
+    "visualize": "1",
+    "animate": "1",
+    "plot": "5",
+}
+
+artifact_cache = ResultCache(
+    "artifacts",
+    max_entries=int(os.getenv("ARTIFACT_CACHE_MAX_ENTRIES", "2048")),
+    disk_dir=CACHE_DIR or None,
+    max_disk_entries=int(os.getenv("ARTIFACT_CACHE_MAX_DISK_ENTRIES", "16384")),
+    ttl_seconds=float(os.getenv("ARTIFACT_CACHE_TTL_SECONDS", "604800")),
+)
+artifact_counters = {kind: {"hits": 0, "misses": 0} for kind in ARTIFACT_PROMPT_VERSIONS}
+
+
+def artifact_key(kind: str, payload: dict) -> str:
+    """Fingerprint of a subtask (taskText, topic, subLabel, subtaskText) + prompt version"""
+    return content_hash(
+        kind,
+        ARTIFACT_PROMPT_VERSIONS[kind],
+        normalize_text(str(payload.get("taskText") or "")),
+        normalize_text(str(payload.get("topic") or "")),
+        str(payload.get("subLabel") or ""),
+        normalize_text(str(payload.get("subtaskText") or "")),
+    )
+
+
+async def cached_artifact(kind: str, payload: dict, generate):
+    """
+    Return the cached response payload for this subtask or build it with
+    ``generate(payload)``. ``"fresh": true`` in the payload forces a rebuild.
+    """
+    key = artifact_key(kind, payload)
+    if not payload.get("fresh"):
+        cached = await artifact_cache.aget(key)
+        if cached is not None:
+            artifact_counters[kind]["hits"] += 1
+            print(f"[CACHE] {kind} hit {key[:12]}")
+            return cached
+
+    artifact_counters[kind]["misses"] += 1
+
+    async def generate_and_store():
+        result = await generate(payload)
+        await artifact_cache.aset(key, result)
+        return result
+
+    return await inflight.do(kind, key, generate_and_store)
 
 
 # ------------------------------
@@ -617,15 +1976,48 @@ async def upload_file(file: UploadFile = File(...)):
 # ------------------------------
 @app.post("/visualize")
 async def visualize(payload: dict = Body(...)):
+    subtask_text = payload.get("subtaskText", "")
+    if not subtask_text or not str(subtask_text).strip():
+        raise HTTPException(status_code=400, detail="Keine Teilaufgabe übergeben.")
+
+    started = time.perf_counter()
+    result = await cached_artifact("visualize", payload, generate_visualization)
+    elapsed = time.perf_counter() - started
+    latency_stats.record("/visualize", elapsed, elapsed)
+    return result
+
+
+async def generate_visualization(payload: dict):
+    try:
+        response = await client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=build_visualize_messages(payload),
+            temperature=0.7
+        )
+
+        visualization_text = response.choices[0].message.content
+
+        # Safe printing for Windows console
+        try:
+            print("\n--- Visualization Generated ---\n", visualization_text[:200], "...\n")
+        except UnicodeEncodeError:
+            print("\n--- Visualization Generated ---\n[Contains Unicode characters]\n")
+
+        return {"visualization": visualization_text}
+
+    except Exception as e:
+        print(f"[ERROR] Error generating visualization: {e}")
+        raise HTTPException(status_code=500, detail=f"Visualization generation failed: {str(e)}")
+
+
+def build_visualize_messages(payload: dict) -> list:
+    """Chat messages for the key-facts visualization of a subtask"""
     task_number = payload.get("taskNumber")
     task_text = payload.get("taskText", "")
     topic = payload.get("topic", "")
     sub_label = payload.get("subLabel")
     subtask_text = payload.get("subtaskText", "")
 
-    if not subtask_text or not str(subtask_text).strip():
-        raise HTTPException(status_code=400, detail="Keine Teilaufgabe übergeben.")
-
     visualize_prompt = f"""
 Du bist ein Mathematik-Experte, der auf die Erstellung klarer, strukturierter Visualisierungen mathematischer Konzepte spezialisiert ist.
 
@@ -669,29 +2061,76 @@ Beispielformat:
 Gib NICHT die vollständige Lösung. Konzentriere dich auf die visuelle Organisation der Fakten und Konzepte.
 """
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a mathematics visualization assistant."},
-                {"role": "user", "content": visualize_prompt}
-            ],
-            temperature=0.7
-        )
+    return [
+        {"role": "system", "content": "You are a mathematics visualization assistant."},
+        {"role": "user", "content": visualize_prompt}
+    ]
 
-        visualization_text = response.choices[0].message.content
 
-        # Safe printing for Windows console
+# ------------------------------
+# Visualisierung als Token-Stream (Server-Sent Events)
+# ------------------------------
+@app.post("/visualize/stream")
+async def visualize_stream(payload: dict = Body(...)):
+    """
+    Opt-in streaming variant of /visualize.
+
+    Events: ``delta`` with {"delta": "..."} per token batch, then ``done``
+    with the same JSON as /visualize (or ``error``). Uses the same artifact
+    cache; a hit is sent as one delta. Identical concurrent misses share one
+    upstream stream.
+    """
+    started = time.perf_counter()
+    subtask_text = payload.get("subtaskText", "")
+    if not subtask_text or not str(subtask_text).strip():
+        raise HTTPException(status_code=400, detail="Keine Teilaufgabe übergeben.")
+
+    key = artifact_key("visualize", payload)
+    cached = None if payload.get("fresh") else await artifact_cache.aget(key)
+
+    async def event_stream():
+        if cached is not None:
+            artifact_counters["visualize"]["hits"] += 1
+            yield sse_event("delta", {"delta": cached.get("visualization", "")})
+            yield sse_event("done", cached)
+            elapsed = time.perf_counter() - started
+            latency_stats.record("/visualize/stream", elapsed, elapsed)
+            return
+
+        artifact_counters["visualize"]["misses"] += 1
+        first_token = None
+        async for event in stream_inflight.stream("visualize", key, produce):
+            if first_token is None:
+                first_token = time.perf_counter() - started
+            yield event
+        latency_stats.record("/visualize/stream", first_token, time.perf_counter() - started)
+
+    async def produce():
+        parts = []
         try:
-            print("\n--- Visualization Generated ---\n", visualization_text[:200], "...\n")
-        except UnicodeEncodeError:
-            print("\n--- Visualization Generated ---\n[Contains Unicode characters]\n")
+            stream = await client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=build_visualize_messages(payload),
+                temperature=0.7,
+                stream=True,
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                parts.append(delta)
+                yield sse_event("delta", {"delta": delta})
 
-        return {"visualization": visualization_text}
+            result = {"visualization": "".join(parts)}
+            await artifact_cache.aset(key, result)
+            yield sse_event("done", result)
+        except Exception as e:
+            print(f"[ERROR] Error streaming visualization: {e}")
+            yield sse_event("error", {"error": f"Visualization generation failed: {str(e)}"})
 
-    except Exception as e:
-        print(f"[ERROR] Error generating visualization: {e}")
-        raise HTTPException(status_code=500, detail=f"Visualization generation failed: {str(e)}")
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 
 # ------------------------------
@@ -699,15 +2138,20 @@ Gib NICHT die vollständige Lösung. Konzentriere dich auf die visuelle Organisa
 # ------------------------------
 @app.post("/animate")
 async def animate(payload: dict = Body(...)):
+    subtask_text = payload.get("subtaskText", "")
+    if not subtask_text or not str(subtask_text).strip():
+        raise HTTPException(status_code=400, detail="Keine Teilaufgabe übergeben.")
+
+    return await cached_artifact("animate", payload, generate_animation)
+
+
+async def generate_animation(payload: dict):
     task_number = payload.get("taskNumber")
     task_text = payload.get("taskText", "")
     topic = payload.get("topic", "")
     sub_label = payload.get("subLabel")
     subtask_text = payload.get("subtaskText", "")
 
-    if not subtask_text or not str(subtask_text).strip():
-        raise HTTPException(status_code=400, detail="Keine Teilaufgabe übergeben.")
-
     animate_prompt = f"""
 Du bist ein Experte für mathematische Animationen. Erstelle eine Schritt-für-Schritt Animation für folgende Aufgabe.
 
@@ -772,7 +2216,7 @@ Gib NUR das JSON zurück, keine Markdown-Codeblöcke, keine Erklärungen.
 """
 
     try:
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "Du bist ein Experte für mathematische Visualisierungen und Animationen."},
@@ -810,17 +2254,61 @@ Gib NUR das JSON zurück, keine Markdown-Codeblöcke, keine Erklärungen.
 # ------------------------------
 # Plotly Graph für eine Teilaufgabe generieren
 # ------------------------------
+# 🔹 Ausschnitt an Nullstellen/Extrema/Wendepunkte anpassen (0 = Ausschnitt des Modells)
+PLOT_AUTO_DOMAIN = os.getenv("PLOT_AUTO_DOMAIN", "1") == "1"
+# Lokaler Vorab-Klassifikator (plot_classifier); Anteil der lokal entschiedenen
+# Anfragen, die zum Vergleich trotzdem ans Modell gehen (Fehlerquote in /cache-stats).
+# 5 % kosten wenig und zeigen, ob die Regeln im Betrieb danebenliegen (0 = aus)
+PLOT_CLASSIFIER = os.getenv("PLOT_CLASSIFIER", "1") == "1"
+PLOT_CLASSIFIER_SHADOW_RATE = float(os.getenv("PLOT_CLASSIFIER_SHADOW_RATE", "0.05"))
+plot_shadow_tasks = set()
+
+
 @app.post("/plot")
 async def plot_task(payload: dict = Body(...)):
+    """
+    Graph for a subtask. ``"format": "compact"`` returns the plot as a JSON
+    object with columnar series (``"encoding": "float32"`` packs them as
+    base64 Float32 arrays) for the template from GET /plot-template;
+    without it the response carries the full Chart.js config as the
+    ``plotData`` string (legacy clients).
+    """
+    subtask_text = payload.get("subtaskText", "")
+    if not subtask_text or not str(subtask_text).strip():
+        raise HTTPException(status_code=400, detail="Keine Teilaufgabe übergeben.")
+    payload_format, encoding = plot_payload_options(payload)
+
+    result = await cached_artifact("plot", payload, generate_plot)
+    return plot_response(result, payload_format, encoding)
+
+
+def plot_payload_options(payload: dict) -> tuple:
+    """Validated ``(format, encoding)`` of a plot request"""
+    payload_format = payload.get("format") or "legacy"
+    encoding = payload.get("encoding") or "json"
+    if payload_format not in PAYLOAD_FORMATS or encoding not in PAYLOAD_ENCODINGS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"format muss {PAYLOAD_FORMATS}, encoding {PAYLOAD_ENCODINGS} sein.",
+        )
+    return payload_format, encoding
+
+
+@app.get("/plot-template")
+async def plot_template(response: Response):
+    """Chart.js templates for compact /plot responses (changes only with the version)"""
+    response.headers["Cache-Control"] = "public, max-age=86400"
+    return {"version": TEMPLATE_VERSION, "templates": CHART_TEMPLATES}
+
+
+async def request_plot_data(payload: dict) -> dict:
+    """Plottability, graph type, function and rough view from the model"""
     task_number = payload.get("taskNumber")
     task_text = payload.get("taskText", "")
     topic = payload.get("topic", "")
     sub_label = payload.get("subLabel")
     subtask_text = payload.get("subtaskText", "")
 
-    if not subtask_text or not str(subtask_text).strip():
-        raise HTTPException(status_code=400, detail="Keine Teilaufgabe übergeben.")
-
     plot_prompt = f"""
 Du bist ein Experte für mathematische Visualisierungen. Analysiere die folgende Aufgabe und bestimme, ob eine grafische Darstellung sinnvoll ist.
 
@@ -845,8 +2333,15 @@ ANTWORTFORMAT (reines JSON):
 {{
   "plottable": true/false,
   "reason": "Kurze Begründung warum ja/nein",
-  "graphType": "function" / "polynomial" / "line" / "circle" / "points" / "none",
+  "graphType": "function" / "polynomial" / "line" / "functions" / "implicit" / "circle" / "points" / "none",
   "function": "mathematischer Ausdruck in Python-Syntax, z.B. x**3 - 27",
+  "functions": [  // Nur wenn graphType = "functions" (mehrere Funktionen in einem Diagramm, max. 4)
+    {{"name": "f", "function": "x**2"}},
+    {{"name": "g", "function": "2*x + 3"}}
+  ],
+  "equations": [  // Nur wenn graphType = "implicit" oder "circle": Kurven F(x, y) = 0, rechte Seite 0
+    {{"name": "K", "equation": "x**2 + y**2 - 9"}}
+  ],
   "domain": {{"xMin": -10, "xMax": 10, "yMin": -50, "yMax": 50}},
   "title": "Titel für die Grafik",
   "xLabel": "x",
@@ -854,12 +2349,12 @@ ANTWORTFORMAT (reines JSON):
   "points": [  // Nur wenn graphType = "points"
     {{"x": 1, "y": 2, "label": "Punkt A"}},
     {{"x": 3, "y": 4, "label": "Punkt B"}}
-  ],
-  "specialPoints": [  // Wichtige Punkte wie Nullstellen, Extrema
-    {{"x": 3, "y": 0, "label": "Nullstelle", "color": "red"}}
   ]
 }}
 
+Nullstellen, Extrema, Wendepunkte und Schnittpunkte berechnet der Server selbst und passt den
+Ausschnitt an - gib sie NICHT an. "domain" ist nur ein grober Ausschnitt.
+
 BEISPIELE:
 
 Aufgabe: "Löse x^3 - 27 = 0"
@@ -871,8 +2366,7 @@ Aufgabe: "Löse x^3 - 27 = 0"
   "domain": {{"xMin": -5, "xMax": 5, "yMin": -50, "yMax": 50}},
   "title": "f(x) = x³ - 27",
   "xLabel": "x",
-  "yLabel": "f(x)",
-  "specialPoints": [{{"x": 3, "y": 0, "label": "Nullstelle x=3", "color": "red"}}]
+  "yLabel": "f(x)"
 }}
 
 Aufgabe: "Berechne 5 + 3"
@@ -905,27 +2399,164 @@ Aufgabe: "Zeichne die Gerade durch A(1,2) und B(3,6)"
   ]
 }}
 
+Aufgabe: "Zeichne den Kreis x² + y² = 9"
+{{
+  "plottable": true,
+  "reason": "Kreis als implizite Kurve",
+  "graphType": "circle",
+  "equations": [{{"name": "K", "equation": "x**2 + y**2 - 9"}}],
+  "domain": {{"xMin": -5, "xMax": 5, "yMin": -5, "yMax": 5}},
+  "title": "Kreis x² + y² = 9",
+  "xLabel": "x",
+  "yLabel": "y"
+}}
+
 Gib NUR das JSON zurück, keine Erklärungen, keine Markdown-Codeblöcke.
 """
 
+    print("[PLOT] Analyzing task for plottability...")
+    
+    response = await client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": "Du bist ein Experte für mathematische Visualisierungen. Antworte nur mit gültigem JSON."},
+            {"role": "user", "content": plot_prompt}
+        ],
+        temperature=0.7,
+        response_format={"type": "json_object"}
+    )
+
+    plot_json_str = response.choices[0].message.content
+    print(f"[PLOT] GPT Response: {plot_json_str[:200]}...")
+    
+    return json.loads(plot_json_str)
+
+
+async def shadow_plot_check(payload: dict, local: dict):
+    """Ask the model anyway and record whether it agrees with the local decision"""
     try:
-        print("[PLOT] Analyzing task for plottability...")
-        
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "Du bist ein Experte für mathematische Visualisierungen. Antworte nur mit gültigem JSON."},
-                {"role": "user", "content": plot_prompt}
-            ],
-            temperature=0.7,
-            response_format={"type": "json_object"}
-        )
+        outcome = compare_with_model(local, await request_plot_data(payload))
+        print(f"[PLOT] Classifier shadow check: {outcome}")
+    except Exception as e:
+        print(f"[WARN] Classifier shadow check failed: {e}")
 
-        plot_json_str = response.choices[0].message.content
-        print(f"[PLOT] GPT Response: {plot_json_str[:200]}...")
-        
-        # Parse JSON
-        plot_data = json.loads(plot_json_str)
+
+PLOT_CURVE_TYPES = ("function", "polynomial", "line", "functions", "implicit", "circle")
+PLOT_DEFAULT_DOMAIN = {"xMin": -10, "xMax": 10, "yMin": -50, "yMax": 50}
+PLOT_MAX_CURVES = 4
+
+
+def plot_curves(plot_data: dict) -> tuple:
+    """
+    ``(explicit, implicit)`` curves of a model/classifier answer as
+    ``[(name, label, expression), ...]``: "function" or "functions" (y = f(x)),
+    "equation" or "equations" (F(x, y) = 0), at most PLOT_MAX_CURVES in total.
+    Entries without an expression (unexpected keys in the model answer) are
+    skipped.
+    """
+    def entries(single: str, several: str, field: str) -> list:
+        items = plot_data.get(several) or ([{field: plot_data[single]}] if plot_data.get(single) else [])
+        return [item if isinstance(item, dict) else {field: item} for item in items if item]
+
+    explicit, implicit = [], []
+    for entry in entries("function", "functions", "function"):
+        expression = str(entry.get("function") or "")
+        if not expression.strip():
+            continue
+        name = str(entry.get("name") or "fgh"[len(explicit) % 3])
+        default_label = plot_data.get("title", "f(x)") if "function" in plot_data else f"{name}(x) = {expression}"
+        explicit.append((name, entry.get("label") or default_label, expression))
+    for entry in entries("equation", "equations", "equation"):
+        expression = str(entry.get("equation") or "")
+        if not expression.strip():
+            continue
+        name = str(entry.get("name") or f"K{len(implicit) + 1}")
+        implicit.append((name, entry.get("label") or f"{expression} = 0", expression))
+    return explicit[:PLOT_MAX_CURVES], implicit[:max(0, PLOT_MAX_CURVES - len(explicit))]
+
+
+def trace_curves(explicit: list, implicit: list, domain: dict, given_points: list) -> tuple:
+    """
+    Sample the explicit functions and trace the implicit curves for one chart.
+
+    Special points are found per function (prefixed with its name when
+    there are several) plus the intersections of the functions. With
+    PLOT_AUTO_DOMAIN the view is fitted to the functions (anchored on the
+    intersections if there are any) and to the extent of the implicit
+    curves. Returns ``(curves, special_points, view, evaluations)`` with
+    ``curves = [(label, segments), ...]``.
+    """
+    functions = [compile_expression(source) for _, _, source in explicit]
+    equations = [compile_expression(source, ("x", "y")) for _, _, source in implicit]
+    names = [name for name, _, _ in explicit]
+    x_min, x_max = float(domain["xMin"]), float(domain["xMax"])
+    y_min, y_max = float(domain["yMin"]), float(domain["yMax"])
+
+    special_points = []
+    for name, function in zip(names, functions):
+        for point in find_special_points(function, *search_window(x_min, x_max)):
+            if len(functions) > 1:
+                point["label"] = f"{name}: {point['label']}"
+            special_points.append(point)
+    intersections = find_intersections(functions, names, *search_window(x_min, x_max)) if len(functions) > 1 else []
+    special_points += intersections
+
+    evaluations = 0
+    if PLOT_AUTO_DOMAIN:
+        views = []
+        if functions:
+            anchors = [(p["x"], p["y"]) for p in intersections or special_points]
+            anchors += [
+                (float(p["x"]), float(p["y"])) for p in given_points
+                if isinstance(p["x"], (int, float)) and isinstance(p["y"], (int, float))
+            ]
+            views.append(fit_domain(functions, anchors, x_min, x_max))
+        for equation in equations:
+            view, traced = fit_implicit(
+                equation, *search_window(x_min, x_max), *search_window(y_min, y_max),
+                bounds={"xMin": x_min, "xMax": x_max, "yMin": y_min, "yMax": y_max},
+            )
+            evaluations += traced["evaluations"]
+            if traced["segments"]:
+                views.append(view)
+        if views:
+            domain = {
+                "xMin": min(view["xMin"] for view in views), "xMax": max(view["xMax"] for view in views),
+                "yMin": min(view["yMin"] for view in views), "yMax": max(view["yMax"] for view in views),
+            }
+    domain = {key: float(value) for key, value in domain.items()}
+
+    special_points = [p for p in special_points if domain["xMin"] <= p["x"] <= domain["xMax"]]
+    curves = []
+    for (_, label, _), function in zip(explicit, functions):
+        sampled = sample_function(function, domain["xMin"], domain["xMax"], domain["yMin"], domain["yMax"])
+        evaluations += sampled["evaluations"]
+        curves.append((label, sampled["segments"]))
+    for (_, label, _), equation in zip(implicit, equations):
+        traced = implicit_curve(equation, domain["xMin"], domain["xMax"], domain["yMin"], domain["yMax"])
+        evaluations += traced["evaluations"]
+        curves.append((label, traced["segments"]))
+    return curves, special_points, domain, evaluations
+
+
+async def generate_plot(payload: dict):
+    # Konkrete Funktion / klar abstrakt im Text -> ohne Modellaufruf
+    local = None
+    if PLOT_CLASSIFIER:
+        local = classify_plot(payload.get("subtaskText", ""), payload.get("taskText", ""))
+        print(f"[PLOT] Classifier: {local['decision']} ({local.get('reason') or local['plotData']['title']})")
+        if local["decision"] != "ambiguous" and random.random() < PLOT_CLASSIFIER_SHADOW_RATE:
+            task = asyncio.create_task(shadow_plot_check(payload, local))
+            plot_shadow_tasks.add(task)
+            task.add_done_callback(plot_shadow_tasks.discard)
+        if local["decision"] == "abstract":
+            return {"plottable": False, "message": local["reason"]}
+
+    try:
+        if local and local["decision"] == "plot":
+            plot_data = local["plotData"]
+        else:
+            plot_data = await request_plot_data(payload)
         
         # Check if plottable
         if not plot_data.get("plottable", False):
@@ -939,26 +2570,33 @@ Gib NUR das JSON zurück, keine Erklärungen, keine Markdown-Codeblöcke.
         
         print(f"[PLOT] Generating {graph_type} plot for Chart.js...")
         
-        if graph_type in ["function", "polynomial", "line"]:
-            # Function plot - generate data points for Chart.js
-            func_str = plot_data.get("function", "x")
-            domain = plot_data.get("domain", {"xMin": -10, "xMax": 10, "yMin": -50, "yMax": 50})
+        if graph_type in PLOT_CURVE_TYPES:
+            # Function plot(s) and implicit curves - generate data points for Chart.js
+            explicit, implicit = plot_curves(plot_data)
+            if not explicit and not implicit:
+                explicit = [("f", plot_data.get("title", "f(x)"), "x")]
+            domain = plot_data.get("domain") or {}
+            domain = {key: domain.get(key, default) for key, default in PLOT_DEFAULT_DOMAIN.items()}
             
-            # Generate x values (100 points for smooth curve, less than Plotly's 500)
-            x_values = np.linspace(domain.get("xMin", -10), domain.get("xMax", 10), 100)
+            # Prepare given points
+            points_data = []
+            for point in plot_data.get("points", []):
+                points_data.append({
+                    "x": point.get("x"),
+                    "y": point.get("y"),
+                    "label": point.get("label", ""),
+                    "color": "#10b981"  # Green
+                })
             
-            # Evaluate function safely
+            # Evaluate functions safely (whitelisted AST, compiled once and cached),
+            # compute roots/extrema/inflection points (and intersections) numerically,
+            # fit the view to them and sample adaptively (gaps at poles/jumps);
+            # implicit curves are traced on an adaptive grid
             try:
-                # Replace common math notation
-                func_str_safe = func_str.replace("^", "**").replace("π", "np.pi").replace("e", "np.e")
-                
-                # Check if function has undefined variables
-                test_x = np.array([1.0])
-                test_eval = eval(func_str_safe, {"x": test_x, "np": np, "__builtins__": {}})
-                
-                # Evaluate for full domain
-                y_values = eval(func_str_safe, {"x": x_values, "np": np, "__builtins__": {}})
-            except (NameError, SyntaxError) as e:
+                curves, special_points_data, domain, evaluations = trace_curves(
+                    explicit, implicit, domain, points_data
+                )
+            except ExpressionError as e:
                 print(f"[ERROR] Function contains undefined variables or syntax error: {e}")
                 return {
                     "plottable": False,
@@ -971,132 +2609,28 @@ Gib NUR das JSON zurück, keine Erklärungen, keine Markdown-Codeblöcke.
                     "message": f"Konnte Funktion nicht auswerten: {str(e)}"
                 }
             
-            # Convert numpy arrays to lists and create Chart.js data format
-            # Create xy pairs for scatter chart (line type)
-            data_points = [{"x": float(x), "y": float(y)} for x, y in zip(x_values, y_values) if np.isfinite(y)]
-            
-            # Prepare special points (nullstellen, extrema, etc.)
-            special_points_data = []
-            for point in plot_data.get("specialPoints", []):
-                special_points_data.append({
-                    "x": point.get("x"),
-                    "y": point.get("y"),
-                    "label": point.get("label", ""),
-                    "color": point.get("color", "#ef4444")  # Default red
-                })
-            
-            # Prepare given points
-            points_data = []
-            for point in plot_data.get("points", []):
-                points_data.append({
-                    "x": point.get("x"),
-                    "y": point.get("y"),
-                    "label": point.get("label", ""),
-                    "color": "#10b981"  # Green
-                })
-            
-            # Chart.js configuration
-            chart_config = {
-                "type": "scatter",
-                "data": {
-                    "datasets": [
-                        {
-                            "label": plot_data.get("title", "f(x)"),
-                            "data": data_points,
-                            "borderColor": "#2c5f8d",
-                            "backgroundColor": "rgba(44, 95, 141, 0.1)",
-                            "borderWidth": 2,
-                            "pointRadius": 0,
-                            "showLine": True,
-                            "tension": 0.1,
-                            "fill": False
-                        }
-                    ]
-                },
-                "options": {
-                    "responsive": True,
-                    "maintainAspectRatio": False,
-                    "plugins": {
-                        "title": {
-                            "display": True,
-                            "text": plot_data.get("title", "Grafik"),
-                            "font": {"size": 16, "weight": "bold"}
-                        },
-                        "legend": {
-                            "display": True,
-                            "position": "top"
-                        },
-                        "tooltip": {
-                            "enabled": True,
-                            "mode": "nearest",
-                            "intersect": False
-                        }
-                    },
-                    "scales": {
-                        "x": {
-                            "type": "linear",
-                            "position": "center",
-                            "title": {
-                                "display": True,
-                                "text": plot_data.get("xLabel", "x")
-                            },
-                            "min": domain.get("xMin", -10),
-                            "max": domain.get("xMax", 10),
-                            "grid": {
-                                "color": "rgba(0, 0, 0, 0.1)"
-                            }
-                        },
-                        "y": {
-                            "type": "linear",
-                            "position": "center",
-                            "title": {
-                                "display": True,
-                                "text": plot_data.get("yLabel", "y")
-                            },
-                            "min": domain.get("yMin", -50),
-                            "max": domain.get("yMax", 50),
-                            "grid": {
-                                "color": "rgba(0, 0, 0, 0.1)"
-                            }
-                        }
-                    },
-                    "interaction": {
-                        "mode": "nearest",
-                        "axis": "x",
-                        "intersect": False
-                    }
-                },
-                "specialPoints": special_points_data,
-                "givenPoints": points_data
-            }
+            if not explicit and not any(segments for _, segments in curves):
+                return {"plottable": False, "message": "Die Kurve liegt nicht im darstellbaren Bereich"}
             
-            # Add special points as separate datasets
-            if special_points_data:
-                chart_config["data"]["datasets"].append({
-                    "label": "Besondere Punkte",
-                    "data": [{"x": p["x"], "y": p["y"]} for p in special_points_data],
-                    "borderColor": "#ef4444",
-                    "backgroundColor": "#ef4444",
-                    "pointRadius": 8,
-                    "pointHoverRadius": 10,
-                    "showLine": False
-                })
+            n_points = sum(len(xs) for _, segments in curves for xs, _ in segments)
+            print(f"[PLOT] {len(curves)} curve(s), {n_points} points from {evaluations} evaluations, "
+                  f"{len(special_points_data)} special point(s), view {domain}")
             
-            if points_data:
-                chart_config["data"]["datasets"].append({
-                    "label": "Gegebene Punkte",
-                    "data": [{"x": p["x"], "y": p["y"]} for p in points_data],
-                    "borderColor": "#10b981",
-                    "backgroundColor": "#10b981",
-                    "pointRadius": 8,
-                    "pointHoverRadius": 10,
-                    "showLine": False
-                })
+            # Format-neutral plot (cached); /plot turns it into legacy or compact JSON
+            plot = function_plot(
+                plot_data.get("title", "f(x)"),
+                plot_data.get("xLabel", "x"),
+                plot_data.get("yLabel", "y"),
+                domain,
+                curves,
+                special_points_data,
+                points_data,
+            )
             
             print("[PLOT] Chart.js data generated successfully!")
             
             return {
-                "plotData": json.dumps(chart_config),
+                "plot": plot,
                 "plottable": True,
                 "graphType": graph_type,
                 "chartType": "chartjs"  # Indicator for frontend
@@ -1114,67 +2648,17 @@ Gib NUR das JSON zurück, keine Erklärungen, keine Markdown-Codeblöcke.
             
             domain = plot_data.get("domain", {"xMin": -10, "xMax": 10, "yMin": -10, "yMax": 10})
             
-            # Prepare points data
-            points_data = [{"x": p.get("x"), "y": p.get("y")} for p in points]
-            point_labels = [p.get("label", f"P{i+1}") for i, p in enumerate(points)]
-            
-            chart_config = {
-                "type": "scatter",
-                "data": {
-                    "datasets": [{
-                        "label": plot_data.get("title", "Punkte"),
-                        "data": points_data,
-                        "borderColor": "#2c5f8d",
-                        "backgroundColor": "#2c5f8d",
-                        "pointRadius": 8,
-                        "pointHoverRadius": 10,
-                        "showLine": False
-                    }]
-                },
-                "options": {
-                    "responsive": True,
-                    "maintainAspectRatio": False,
-                    "plugins": {
-                        "title": {
-                            "display": True,
-                            "text": plot_data.get("title", "Punkte"),
-                            "font": {"size": 16, "weight": "bold"}
-                        },
-                        "tooltip": {
-                            "enabled": True,
-                            "callbacks": {}  # Will use default
-                        }
-                    },
-                    "scales": {
-                        "x": {
-                            "type": "linear",
-                            "position": "center",
-                            "title": {
-                                "display": True,
-                                "text": plot_data.get("xLabel", "x")
-                            },
-                            "min": domain.get("xMin", -10),
-                            "max": domain.get("xMax", 10),
-                            "grid": {"color": "rgba(0, 0, 0, 0.1)"}
-                        },
-                        "y": {
-                            "type": "linear", 
-                            "position": "center",
-                            "title": {
-                                "display": True,
-                                "text": plot_data.get("yLabel", "y")
-                            },
-                            "min": domain.get("yMin", -10),
-                            "max": domain.get("yMax", 10),
-                            "grid": {"color": "rgba(0, 0, 0, 0.1)"}
-                        }
-                    }
-                },
-                "pointLabels": point_labels
-            }
+            plot = points_plot(
+                plot_data.get("title", "Punkte"),
+                plot_data.get("xLabel", "x"),
+                plot_data.get("yLabel", "y"),
+                {key: domain.get(key, default) for key, default in
+                 (("xMin", -10), ("xMax", 10), ("yMin", -10), ("yMax", 10))},
+                points,
+            )
             
             return {
-                "plotData": json.dumps(chart_config),
+                "plot": plot,
                 "plottable": True,
                 "graphType": graph_type,
                 "chartType": "chartjs"
@@ -1195,7 +2679,83 @@ Gib NUR das JSON zurück, keine Erklärungen, keine Markdown-Codeblöcke.
 
 
 # ------------------------------
-# Session Logging - Excel Integration
+# Smart Visual: Grafik mit Schlüsselfakten-Fallback in einer Anfrage
+# ------------------------------
+# Bei unklarer Plotbarkeit /visualize parallel zu /plot starten, damit nicht
+# plottbare Teilaufgaben nicht zwei Modell-Latenzen nacheinander zahlen
+SMART_VISUAL_SPECULATE = os.getenv("SMART_VISUAL_SPECULATE", "1") == "1"
+SMART_VISUAL_TYPES = ("graph", "animation", "key_facts", "formula", "diagram")
+smart_visual_counters = {"graphs": 0, "fallbacks": 0, "speculative": 0, "speculativeUsed": 0}
+
+
+@app.post("/smart-visual")
+async def smart_visual(payload: dict = Body(...)):
+    """
+    Visual for the type chosen by the client (``visualType``, default
+    "graph"). A graph that is not possible comes back as key facts in the
+    same response, so the client needs no second request:
+
+        {"type": "graph", "plottable": true, ...}         # like /plot
+        {"type": "key_facts", "visualization": "...", "reason": "..."}
+        {"type": "animation", "animationData": ...}       # like /animate
+    """
+    subtask_text = payload.get("subtaskText", "")
+    if not subtask_text or not str(subtask_text).strip():
+        raise HTTPException(status_code=400, detail="Keine Teilaufgabe übergeben.")
+    visual_type = payload.get("visualType") or "graph"
+    if visual_type not in SMART_VISUAL_TYPES:
+        raise HTTPException(status_code=400, detail=f"visualType muss einer von {SMART_VISUAL_TYPES} sein.")
+    payload_format, encoding = plot_payload_options(payload)
+
+    started = time.perf_counter()
+    if visual_type == "graph":
+        result = await smart_graph(payload, payload_format, encoding)
+    elif visual_type == "animation":
+        result = {"type": "animation", **await cached_artifact("animate", payload, generate_animation)}
+    else:
+        result = {"type": "key_facts", **await cached_artifact("visualize", payload, generate_visualization)}
+    elapsed = time.perf_counter() - started
+    latency_stats.record("/smart-visual", elapsed, elapsed)
+    return result
+
+
+async def smart_graph(payload: dict, payload_format: str, encoding: str) -> dict:
+    speculative = None
+    if (
+        SMART_VISUAL_SPECULATE
+        and not await artifact_cache.acontains(artifact_key("plot", payload))
+        and classify_plot(payload.get("subtaskText", ""), payload.get("taskText", ""), record=False)["decision"]
+        == "ambiguous"
+    ):
+        # Läuft bei einer Grafik weiter und füllt den Cache für einen späteren Klick
+        speculative = asyncio.ensure_future(cached_artifact("visualize", payload, generate_visualization))
+        speculative.add_done_callback(lambda task: task.cancelled() or task.exception())
+        smart_visual_counters["speculative"] += 1
+
+    try:
+        plot = await cached_artifact("plot", payload, generate_plot)
+    except HTTPException as e:
+        plot = {"plottable": False, "message": e.detail}
+
+    if plot.get("plottable"):
+        smart_visual_counters["graphs"] += 1
+        return {"type": "graph", **plot_response(plot, payload_format, encoding)}
+
+    smart_visual_counters["fallbacks"] += 1
+    if speculative is not None:
+        smart_visual_counters["speculativeUsed"] += 1
+        facts = await speculative
+    else:
+        facts = await cached_artifact("visualize", payload, generate_visualization)
+    return {
+        "type": "key_facts",
+        "reason": plot.get("message") or "Grafik nicht verfügbar - Schlüsselfakten anzeigen",
+        **facts,
+    }
+
+
+# ------------------------------
+# Session Logging - SQLite session store, Excel export
 # ------------------------------
 class SessionLogEntry(BaseModel):
     benutzer_name: str
@@ -1220,13 +2780,49 @@ class SessionLogEntry(BaseModel):
     notizen: str
 
 
-EXCEL_PATH = r"C:\Users\admin\Desktop\Sonstiges\HMS_PROJEKT\clarity-coach\Clarity_Coach_Session_Log.xlsx"
+EXCEL_PATH = os.getenv(
+    "SESSION_EXCEL_PATH",
+    r"C:\Users\admin\Desktop\Sonstiges\HMS_PROJEKT\clarity-coach\Clarity_Coach_Session_Log.xlsx"
+)
+
+# 🔹 Sitzungs-/Bewertungslog in SQLite (WAL); Excel-Dateien werden daraus exportiert
+# Ein vorhandenes Excel-Log (EXCEL_PATH) wird beim ersten Start übernommen
+SESSION_DB_PATH = os.getenv(
+    "SESSION_DB_PATH",
+    os.path.join(os.path.dirname(EXCEL_PATH), "Clarity_Coach_Sessions.db")
+)
+EXPORT_DIR = os.getenv("SESSION_EXPORT_DIR", os.path.dirname(EXCEL_PATH))
+session_store = SessionStore(SESSION_DB_PATH)
+
+
+@app.on_event("startup")
+async def migrate_excel_log():
+    """Import the former Excel log once (the database is the system of record afterwards)"""
+    counts = await asyncio.to_thread(session_store.counts)
+    if counts["sessions"] or counts["assessments"] or not os.path.exists(EXCEL_PATH):
+        return
+    try:
+        report = await asyncio.to_thread(import_excel, session_store, EXCEL_PATH)
+        print(f"[LOG] Imported Excel log into {SESSION_DB_PATH}: {report}")
+    except Exception as e:
+        print(f"[WARN] Excel log import failed (run session_store.py migrate): {e}")
+
+
+@app.on_event("shutdown")
+async def close_session_store():
+    session_store.close()
+
+
+def export_path(prefix: str) -> tuple:
+    """(filename, path) of a dated Excel export"""
+    filename = f"{prefix}_{datetime.now().strftime('%Y%m%d')}.xlsx"
+    return filename, os.path.join(EXPORT_DIR, filename)
 
 
 @app.post("/log-session")
 async def log_session(entry: SessionLogEntry):
     """
-    Log a Clarity Coach session to Excel file
+    Log a Clarity Coach session (SQLite session store; Excel via /export-session-log)
     """
     try:
         print(f"[LOG] Starting session log...")
@@ -1265,124 +2861,8 @@ async def log_session(entry: SessionLogEntry):
         if entry.sitzungsdauer_minuten < 0:
             raise HTTPException(status_code=400, detail="sitzungsdauer_minuten must be non-negative")
         
-        # Check if Excel file exists
-        if not os.path.exists(EXCEL_PATH):
-            print(f"[ERROR] Excel file not found at: {EXCEL_PATH}")
-            raise HTTPException(
-                status_code=500, 
-                detail=f"Excel file not found. Please create it first using create_excel_template.py"
-            )
-        
-        # Load workbook
-        wb = load_workbook(EXCEL_PATH)
-        
-        # Get or create Session_Log sheet
-        if "Session_Log" not in wb.sheetnames:
-            print(f"[ERROR] Session_Log sheet not found")
-            raise HTTPException(
-                status_code=500,
-                detail="Session_Log sheet not found in Excel file"
-            )
-        
-        ws = wb["Session_Log"]
-        
-        # Update headers if they're old format (with underscores)
-        # This ensures existing files get updated headers without losing data
-        if ws.max_row > 0:
-            header_row = 1
-            old_headers = [
-                "Session_ID", "Benutzer_Name", "Datei_Name", "Datei_Typ",
-                "Anzahl_Aufgaben", "Anzahl_Teilaufgaben", "Visualisierungen_Genutzt",
-                "Animationen_Genutzt", "Grafiken_Genutzt", "Hints_Genutzt",
-                "Ansatzpruefungen_Genutzt", "Selbststaendigkeits_Score",
-                "Sitzungsdauer_Minuten"
-            ]
-            new_headers = [
-                "Session-ID", "Benutzer Name", "Datei Name", "Datei Typ",
-                "Anzahl Aufgaben", "Anzahl Teilaufgaben", "Visualisierungen Genutzt",
-                "Animationen Genutzt", "Grafiken Genutzt", "Hilfestellungen Genutzt",
-                "Ansatzprüfungen Genutzt", "Selbstständigkeits Score",
-                "Sitzungsdauer (Minuten)"
-            ]
-            
-            # Check if headers need updating
-            needs_update = False
-            for col in range(1, min(ws.max_column + 1, 24)):
-                cell_value = ws.cell(row=header_row, column=col).value
-                if cell_value and any(old in str(cell_value) for old in old_headers):
-                    needs_update = True
-                    break
-            
-            if needs_update:
-                # Update headers to proper German names
-                proper_headers = [
-                    "Session-ID", "Datum", "Uhrzeit", "Benutzer Name", "Klasse", "Schule",
-                    "Fach", "Thema", "Aufgabentyp", "Schwierigkeitsgrad", "Datei Name",
-                    "Datei Typ", "Anzahl Aufgaben", "Anzahl Teilaufgaben",
-                    "Visualisierungen Genutzt", "Animationen Genutzt", "Grafiken Genutzt",
-                    "Hilfestellungen Genutzt", "Ansatzprüfungen Genutzt",
-                    "Selbstständigkeits Score", "Feedback", "Sitzungsdauer (Minuten)", "Notizen"
-                ]
-                for col, header in enumerate(proper_headers, 1):
-                    ws.cell(row=header_row, column=col).value = header
-                print("[LOG] Updated Session_Log headers to proper German names")
-        
-        # Find next row
-        next_row = ws.max_row + 1
-        
-        # Generate Session ID (format: YYYYMMDD-###)
-        today = datetime.now().strftime("%Y%m%d")
-        session_count = next_row - 1  # -1 for header
-        session_id = f"{today}-{session_count:03d}"
-        
-        # Get current date and time (DD.MM.YYYY format)
-        current_date = datetime.now().strftime("%d.%m.%Y")
-        current_time = datetime.now().strftime("%H:%M:%S")
-        
-        # Prepare data row
-        data_row = [
-            session_id,
-            current_date,
-            current_time,
-            entry.benutzer_name,
-            entry.klasse,
-            entry.schule,
-            entry.fach,
-            entry.thema,
-            entry.aufgabentyp,
-            entry.schwierigkeitsgrad,
-            entry.datei_name,
-            entry.datei_typ,
-            entry.anzahl_aufgaben,
-            entry.anzahl_teilaufgaben,
-            entry.visualisierungen_genutzt,
-            entry.animationen_genutzt,
-            entry.grafiken_genutzt,
-            entry.hints_genutzt,  # Replaced loesungen_angezeigt
-            entry.ansatzpruefungen_genutzt,  # Phase 3.3: Approach checks
-            entry.selbststaendigkeits_score,  # Phase 3.3: Self-sufficiency score (1-5)
-            entry.feedback,
-            entry.sitzungsdauer_minuten,
-            entry.notizen
-        ]
-        
-        # Write data to row
-        border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-        
-        for col_num, value in enumerate(data_row, 1):
-            cell = ws.cell(row=next_row, column=col_num)
-            cell.value = value
-            cell.border = border
-            cell.alignment = Alignment(horizontal='left', vertical='center')
-        
-        # Save workbook
-        wb.save(EXCEL_PATH)
-        wb.close()
+        # Append to the session store (one short SQLite transaction)
+        session_id, row = await asyncio.to_thread(session_store.add_session, entry.model_dump())
         
         print(f"[LOG] Session logged successfully: {session_id}")
         
@@ -1390,7 +2870,7 @@ async def log_session(entry: SessionLogEntry):
             "success": True,
             "session_id": session_id,
             "message": "Session erfolgreich protokolliert",
-            "row": next_row
+            "row": row
         }
     
     except HTTPException as he:
@@ -1409,37 +2889,17 @@ async def log_session(entry: SessionLogEntry):
 async def get_assessments():
     """
     Get all assessment data for dashboard analytics.
-    Returns assessment data from Assessment_Log sheet.
+    Returns assessment data from the session store (Assessment_Log).
     """
     try:
-        if not os.path.exists(EXCEL_PATH):
-            return {"assessments": []}
-        
-        wb = load_workbook(EXCEL_PATH)
+        rows = await asyncio.to_thread(session_store.assessments)
         
-        if "Assessment_Log" not in wb.sheetnames:
-            wb.close()
-            return {"assessments": []}
-        
-        ws = wb["Assessment_Log"]
-        assessments = []
-        
-        # Read headers
-        headers = []
-        for col in range(1, ws.max_column + 1):
-            headers.append(ws.cell(row=1, column=col).value or "")
-        
-        # Read data rows
-        for row in range(2, ws.max_row + 1):
-            assessment = {}
-            for col, header in enumerate(headers, 1):
-                value = ws.cell(row=row, column=col).value
-                # Convert header to camelCase for frontend
-                key = header.lower().replace(" ", "_").replace("(", "").replace(")", "").replace("-", "_")
-                assessment[key] = value
-            assessments.append(assessment)
-        
-        wb.close()
+        # Keys as before: Excel header in snake_case ("Topic Area" -> "topic_area")
+        keys = [
+            (name, header.lower().replace(" ", "_").replace("(", "").replace(")", "").replace("-", "_"))
+            for name, header, _, _ in ASSESSMENT_COLUMNS
+        ]
+        assessments = [{key: row[name] for name, key in keys} for row in rows]
         
         return {"assessments": assessments}
     
@@ -1453,7 +2913,7 @@ async def get_assessments():
 @app.post("/log-assessment")
 async def log_assessment(assessment_data: dict = Body(...)):
     """
-    Log post-session assessment to separate Excel sheet (Assessment_Log).
+    Log post-session assessment (Assessment_Log table of the session store).
     This endpoint receives tutor/evaluator ratings and observations.
     """
     try:
@@ -1490,126 +2950,29 @@ async def log_assessment(assessment_data: dict = Body(...)):
         except (ValueError, TypeError):
             raise HTTPException(status_code=400, detail="tutorInterventions must be a non-negative integer")
         
-        # Check for duplicate session assessment
-        if os.path.exists(EXCEL_PATH):
-            wb_check = load_workbook(EXCEL_PATH)
-            if "Assessment_Log" in wb_check.sheetnames:
-                ws_check = wb_check["Assessment_Log"]
-                session_id = assessment_data.get("sessionId", "")
-                # Check if this session already has an assessment
-                for row in range(2, ws_check.max_row + 1):
-                    if ws_check.cell(row=row, column=1).value == session_id:
-                        wb_check.close()
-                        raise HTTPException(status_code=409, detail=f"Assessment for session {session_id} already exists")
-            wb_check.close()
-        
-        # Check if Excel file exists
-        if not os.path.exists(EXCEL_PATH):
-            raise HTTPException(
-                status_code=404,
-                detail="Session log file not found. Please complete a session first."
-            )
-        
-        # Load workbook
-        wb = load_workbook(EXCEL_PATH)
-        
-        # Import styling classes OUTSIDE conditional block (needed for data rows too)
-        from openpyxl.styles import Font, PatternFill, Alignment
-        from openpyxl.utils import get_column_letter
-        
-        # Create Assessment_Log sheet if it doesn't exist
-        if "Assessment_Log" not in wb.sheetnames:
-            ws = wb.create_sheet("Assessment_Log")
-            
-            # Define headers (21 columns as per requirements)
-            headers = [
-                "Session-ID",
-                "Date (DD.MM.YYYY)",
-                "Student-ID",
-                "Grade",
-                "Topic Area",
-                "Topic Detail",
-                "Topic Complexity (1-5)",
-                "AI Question Quality (1-5)",
-                "Prompt Strategy",
-                "Tutor Interventions",
-                "Student Override (Yes/No)",
-                "Learner Type Indicator",
-                "Understanding Progress (1-5)",
-                "Linguistic Neutrality Check (Yes/No)",
-                "Engagement Level (1-5)",
-                "Evaluative Language Check (Yes/No)",
-                "Student Feedback Safety (Yes/No/Unclear)",
-                "Question Loops",
-                "Efficiency Score (1-5)",
-                "Remarks",
-                "Further Considerations"
-            ]
-            
-            # Write headers
-            ws.append(headers)
-            
-            # Style headers (matching Session_Log style)
-            header_font = Font(bold=True, color="FFFFFF", size=11)
-            header_fill = PatternFill(
-                start_color="2C5F8D",
-                end_color="2C5F8D",
-                fill_type="solid"
-            )
-            header_alignment = Alignment(horizontal="center", vertical="center")
-            
-            for col_num, header in enumerate(headers, 1):
-                col_letter = get_column_letter(col_num)
-                cell = ws[f"{col_letter}1"]
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.alignment = header_alignment
-                
-                # Set column widths
-                if header in ["Remarks", "Further Considerations", "Prompt Strategy"]:
-                    ws.column_dimensions[col_letter].width = 40
-                elif header == "Session-ID":
-                    ws.column_dimensions[col_letter].width = 15
-                elif header in ["Learner Type Indicator", "Topic Area", "Topic Detail"]:
-                    ws.column_dimensions[col_letter].width = 25
-                elif header == "Date (DD.MM.YYYY)":
-                    ws.column_dimensions[col_letter].width = 16
-                else:
-                    ws.column_dimensions[col_letter].width = 18
-            
-            print("[ASSESSMENT] Created new Assessment_Log sheet")
-        else:
-            ws = wb["Assessment_Log"]
-        
-        # Get topic data from Session_Log by joining on Session-ID
+        # Get topic data from Session_Log by joining on Session-ID (indexed lookup)
         topic_area = ""
         topic_detail = ""
         topic_complexity = ""
         session_id = assessment_data.get("sessionId", "")
         
-        if "Session_Log" in wb.sheetnames:
-            session_ws = wb["Session_Log"]
-            # Find session in Session_Log (Session_ID is column A, Thema is column H, Schwierigkeitsgrad is column J)
-            for row in range(2, session_ws.max_row + 1):
-                if session_ws.cell(row=row, column=1).value == session_id:
-                    topic_area = session_ws.cell(row=row, column=7).value or ""  # Fach
-                    topic_detail = session_ws.cell(row=row, column=8).value or ""  # Thema
-                    difficulty = session_ws.cell(row=row, column=10).value or ""  # Schwierigkeitsgrad
-                    # Convert difficulty to 1-5 scale
-                    if difficulty == "Leicht":
-                        topic_complexity = 1
-                    elif difficulty == "Mittel":
-                        topic_complexity = 3
-                    elif difficulty == "Anspruchsvoll":
-                        topic_complexity = 5
-                    else:
-                        topic_complexity = ""
-                    break
+        session = await asyncio.to_thread(session_store.session, session_id)
+        if session:
+            topic_area = session["fach"] or ""
+            topic_detail = session["thema"] or ""
+            difficulty = session["schwierigkeitsgrad"] or ""
+            # Convert difficulty to 1-5 scale
+            if difficulty == "Leicht":
+                topic_complexity = 1
+            elif difficulty == "Mittel":
+                topic_complexity = 3
+            elif difficulty == "Anspruchsvoll":
+                topic_complexity = 5
+            else:
+                topic_complexity = ""
         
-        # Prepare assessment data row (21 columns)
-        now = datetime.now()
         # Format date as DD.MM.YYYY
-        date_str = now.strftime("%d.%m.%Y")
+        date_str = datetime.now().strftime("%d.%m.%Y")
         
         # Convert boolean to Yes/No
         student_override_str = "Yes" if assessment_data.get("studentOverride", False) else "No"
@@ -1619,50 +2982,35 @@ async def log_assessment(assessment_data: dict = Body(...)):
         if student_feedback_safety:
             student_feedback_safety = student_feedback_safety.capitalize()
         
-        assessment_row = [
-            session_id,
-            date_str,  # DD.MM.YYYY format
-            assessment_data.get("studentId", ""),
-            assessment_data.get("grade", ""),
-            topic_area,  # From Session_Log
-            topic_detail,  # From Session_Log
-            topic_complexity,  # From Session_Log (1-5)
-            assessment_data.get("aiQuestionQuality", 0),
-            assessment_data.get("promptStrategy", ""),
-            assessment_data.get("tutorInterventions", 0),
-            student_override_str,
-            assessment_data.get("learnerTypeIndicator", "Nicht angegeben"),
-            assessment_data.get("understandingProgress", 0),
-            linguistic_neutrality_str,
-            assessment_data.get("engagementLevel", 0),
-            evaluative_language_str,
-            student_feedback_safety,
-            assessment_data.get("questionLoops", 0),
-            assessment_data.get("efficiencyScore", 0),
-            assessment_data.get("remarks", ""),
-            assessment_data.get("furtherConsiderations", "")
-        ]
-        
-        # Find next row
-        next_row = ws.max_row + 1
-        
-        # Write data with formatting
-        border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-        
-        for col_num, value in enumerate(assessment_row, 1):
-            cell = ws.cell(row=next_row, column=col_num)
-            cell.value = value
-            cell.border = border
-            cell.alignment = Alignment(horizontal='left', vertical='center', wrap_text=True)
+        # Assessment row (21 columns, see session_store.ASSESSMENT_COLUMNS)
+        values = {
+            "session_id": session_id,
+            "datum": date_str,
+            "student_id": assessment_data.get("studentId", ""),
+            "grade": assessment_data.get("grade", ""),
+            "topic_area": topic_area,  # From Session_Log
+            "topic_detail": topic_detail,  # From Session_Log
+            "topic_complexity": topic_complexity,  # From Session_Log (1-5)
+            "ai_question_quality": assessment_data.get("aiQuestionQuality", 0),
+            "prompt_strategy": assessment_data.get("promptStrategy", ""),
+            "tutor_interventions": assessment_data.get("tutorInterventions", 0),
+            "student_override": student_override_str,
+            "learner_type_indicator": assessment_data.get("learnerTypeIndicator", "Nicht angegeben"),
+            "understanding_progress": assessment_data.get("understandingProgress", 0),
+            "linguistic_neutrality_check": linguistic_neutrality_str,
+            "engagement_level": assessment_data.get("engagementLevel", 0),
+            "evaluative_language_check": evaluative_language_str,
+            "student_feedback_safety": student_feedback_safety,
+            "question_loops": assessment_data.get("questionLoops", 0),
+            "efficiency_score": assessment_data.get("efficiencyScore", 0),
+            "remarks": assessment_data.get("remarks", ""),
+            "further_considerations": assessment_data.get("furtherConsiderations", "")
+        }
         
-        # Save workbook
-        wb.save(EXCEL_PATH)
-        wb.close()
+        # Insert; None = this session already has an assessment
+        row = await asyncio.to_thread(session_store.add_assessment, values)
+        if row is None:
+            raise HTTPException(status_code=409, detail=f"Assessment for session {session_id} already exists")
         
         session_id = assessment_data.get("sessionId", "Unknown")
         print(f"[ASSESSMENT] Assessment logged successfully for session: {session_id}")
@@ -1671,7 +3019,7 @@ async def log_assessment(assessment_data: dict = Body(...)):
             "success": True,
             "sessionId": session_id,
             "message": "Assessment erfolgreich protokolliert",
-            "row": next_row
+            "row": row
         }
     
     except HTTPException as he:
@@ -1691,149 +3039,32 @@ async def log_assessment(assessment_data: dict = Body(...)):
 @app.get("/export-assessment-log")
 async def export_assessment_log():
     """
-    Export all assessment data to a separate Excel file.
+    Export all assessment data to a separate Excel file (generated from the session store).
     File name: Clarity_Coach_Assessment_Log_[DATE].xlsx
     Contains exactly 21 columns as per Assessment template.
     """
     try:
         print("[EXPORT] Starting assessment log export...")
         
-        # Check if main Excel file exists
-        if not os.path.exists(EXCEL_PATH):
-            raise HTTPException(
-                status_code=404,
-                detail="Session log file not found. No assessments to export."
-            )
-        
-        # Load workbook
-        wb = load_workbook(EXCEL_PATH)
-        
-        # Check if Assessment_Log sheet exists
-        if "Assessment_Log" not in wb.sheetnames:
-            wb.close()
+        counts = await asyncio.to_thread(session_store.counts)
+        if not counts["assessments"]:
             raise HTTPException(
                 status_code=404,
                 detail="No assessment data found. Please complete at least one assessment first."
             )
         
-        # Import styling classes
-        from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-        from openpyxl.utils import get_column_letter
-        
-        # Create new workbook for export
-        export_wb = Workbook()
-        export_ws = export_wb.active
-        export_ws.title = "Assessment_Log"
-        
-        # Get data from existing Assessment_Log
-        source_ws = wb["Assessment_Log"]
-        
-        # Copy headers (21 columns)
-        headers = [
-            "Session-ID",
-            "Date (DD.MM.YYYY)",
-            "Student-ID",
-            "Grade",
-            "Topic Area",
-            "Topic Detail",
-            "Topic Complexity (1-5)",
-            "AI Question Quality (1-5)",
-            "Prompt Strategy",
-            "Tutor Interventions",
-            "Student Override (Yes/No)",
-            "Learner Type Indicator",
-            "Understanding Progress (1-5)",
-            "Linguistic Neutrality Check (Yes/No)",
-            "Engagement Level (1-5)",
-            "Evaluative Language Check (Yes/No)",
-            "Student Feedback Safety (Yes/No/Unclear)",
-            "Question Loops",
-            "Efficiency Score (1-5)",
-            "Remarks",
-            "Further Considerations"
-        ]
-        
-        # Write headers
-        export_ws.append(headers)
-        
-        # Style headers
-        header_font = Font(bold=True, color="FFFFFF", size=11)
-        header_fill = PatternFill(
-            start_color="2C5F8D",
-            end_color="2C5F8D",
-            fill_type="solid"
-        )
-        header_alignment = Alignment(horizontal="center", vertical="center")
-        border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-        
-        for col_num, header in enumerate(headers, 1):
-            col_letter = get_column_letter(col_num)
-            cell = export_ws[f"{col_letter}1"]
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = header_alignment
-            cell.border = border
-            
-            # Set column widths
-            if header in ["Remarks", "Further Considerations", "Prompt Strategy"]:
-                export_ws.column_dimensions[col_letter].width = 40
-            elif header == "Session-ID":
-                export_ws.column_dimensions[col_letter].width = 15
-            elif header in ["Learner Type Indicator", "Topic Area", "Topic Detail"]:
-                export_ws.column_dimensions[col_letter].width = 25
-            elif header == "Date (DD.MM.YYYY)":
-                export_ws.column_dimensions[col_letter].width = 16
-            else:
-                export_ws.column_dimensions[col_letter].width = 18
-        
-        # Copy all data rows (skip header row)
-        for row in range(2, source_ws.max_row + 1):
-            data_row = []
-            for col in range(1, 22):  # Exactly 21 columns
-                cell_value = source_ws.cell(row=row, column=col).value
-                data_row.append(cell_value)
-            
-            # Write data row
-            export_ws.append(data_row)
-            
-            # Apply formatting
-            for col in range(1, 22):
-                cell = export_ws.cell(row=export_ws.max_row, column=col)
-                cell.border = border
-                cell.alignment = Alignment(horizontal='left', vertical='center', wrap_text=True)
-        
-        # Set row height for header
-        export_ws.row_dimensions[1].height = 30
-        
-        # Freeze first row
-        export_ws.freeze_panes = 'A2'
-        
-        # Generate filename with date
-        today = datetime.now().strftime("%Y%m%d")
-        export_filename = f"Clarity_Coach_Assessment_Log_{today}.xlsx"
-        export_path = os.path.join(
-            os.path.dirname(EXCEL_PATH),
-            export_filename
-        )
-        
-        # Save export file
-        export_wb.save(export_path)
-        export_wb.close()
-        wb.close()
+        export_filename, path = export_path("Clarity_Coach_Assessment_Log")
+        counts = await asyncio.to_thread(export_excel, session_store, path, [ASSESSMENT_SHEET])
+        row_count = counts[ASSESSMENT_SHEET]
         
         print(f"[EXPORT] Assessment log exported successfully: {export_filename}")
         
         return {
             "success": True,
             "filename": export_filename,
-            "path": export_path,
-            "row_count": source_ws.max_row - 1,  # Exclude header
-            "message": f"Assessment log exported successfully. {source_ws.max_row - 1} assessments exported."
+            "path": path,
+            "row_count": row_count,
+            "message": f"Assessment log exported successfully. {row_count} assessments exported."
         }
     
     except HTTPException as he:
@@ -1846,3 +3077,53 @@ async def export_assessment_log():
             status_code=500,
             detail=f"Failed to export assessment log: {str(e)}"
         )
+
+# ------------------------------
+# Export Session Log (Session_Log + Assessment_Log) to Excel
+# ------------------------------
+@app.get("/export-session-log")
+async def export_session_log():
+    """
+    Generate the complete log as an Excel file from the session store.
+    File name: Clarity_Coach_Session_Log_[DATE].xlsx with the sheets
+    Session_Log (23 columns) and Assessment_Log (21 columns), laid out as
+    the former Excel log.
+    """
+    try:
+        export_filename, path = export_path("Clarity_Coach_Session_Log")
+        counts = await asyncio.to_thread(export_excel, session_store, path)
+        
+        print(f"[EXPORT] Session log exported successfully: {export_filename} {counts}")
+        
+        return {
+            "success": True,
+            "filename": export_filename,
+            "path": path,
+            "row_counts": counts,
+            "message": f"Session log exported successfully. {counts['Session_Log']} sessions, "
+                       f"{counts['Assessment_Log']} assessments exported."
+        }
+    
+    except Exception as e:
+        print(f"[ERROR] Failed to export session log: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to export session log: {str(e)}"
+        )
+
+# ------------------------------
+# Get Sessions (indexed lookups)
+# ------------------------------
+@app.get("/get-sessions")
+async def get_sessions(benutzer_name: str = None, klasse: str = None, since: str = None, limit: int = None):
+    """
+    Logged sessions in log order, optionally filtered by user, class and
+    start date (ISO, e.g. 2026-09-01) - all filters use an index.
+    """
+    try:
+        sessions = await asyncio.to_thread(session_store.sessions, benutzer_name, klasse, since, limit)
+        return {"sessions": sessions}
+    
+    except Exception as e:
+        print(f"[ERROR] Failed to get sessions: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to get sessions: {str(e)}")
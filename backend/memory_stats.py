@@ -0,0 +1,80 @@
+# Datei: memory_stats.py
+"""
+Resident memory (RSS) sampling for the upload pipeline.
+
+Reads /proc, so values are only available on Linux; elsewhere the sampler
+reports None instead of failing.
+"""
+import asyncio
+import os
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss(pid="self"):
+    """Resident set size of a process in bytes, or None if unavailable"""
+    try:
+        with open(f"/proc/{pid}/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class PeakRssSampler:
+    """
+    Samples the RSS of this process (and optional helper processes) while a
+    block runs and keeps the maximum.
+
+        async with PeakRssSampler(worker_pids=raster_pool.worker_pids) as rss:
+            ...
+        rss.report()  # {"peakRssMb": ..., "workerPeakRssMb": ...}
+
+    With concurrent uploads the numbers include the other uploads' memory;
+    they describe the process, not one request in isolation.
+    """
+
+    def __init__(self, interval: float = 0.05, worker_pids=None):
+        self.interval = interval
+        self.worker_pids = worker_pids
+        self.peak = None
+        self.worker_peak = None
+        self._task = None
+
+    def sample(self):
+        rss = current_rss()
+        if rss is not None:
+            self.peak = max(self.peak or 0, rss)
+        if self.worker_pids is not None:
+            sizes = [current_rss(pid) for pid in self.worker_pids()]
+            sizes = [size for size in sizes if size is not None]
+            if sizes:
+                self.worker_peak = max(self.worker_peak or 0, sum(sizes))
+
+    async def _run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.sample()
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.sample()
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.stop()
+        return False
+
+    def report(self) -> dict:
+        def mb(value):
+            return round(value / (1024 * 1024), 1) if value is not None else None
+
+        return {"peakRssMb": mb(self.peak), "workerPeakRssMb": mb(self.worker_peak)}
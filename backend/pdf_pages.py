@@ -0,0 +1,453 @@
+# Datei: pdf_pages.py
+"""
+Page-level PDF helpers for /upload (PyMuPDF).
+
+Born-digital worksheets (Word, LaTeX) already carry a text layer, so the
+vision model is only needed for scanned or formula-heavy pages. Those pages
+are rendered as small as the vision model allows (prepare_page_image), and
+blank or duplicated scans are dropped before OCR (PageFilter).
+
+The module-level ``*_page`` functions at the end take a file path instead of
+a page object so they can run in a RasterPool worker process.
+"""
+import asyncio
+import os
+import time
+import unicodedata
+
+import fitz  # PyMuPDF
+import numpy as np
+
+# 🔹 Schwellwerte für die Text-Layer-Erkennung
+TEXT_LAYER_MIN_CHARS = 20          # weniger Text -> vermutlich Scan
+TEXT_LAYER_MAX_BAD_RATIO = 0.02    # Anteil unlesbarer Zeichen (�, Private Use Area)
+TEXT_LAYER_MAX_MATH_RATIO = 0.15   # Anteil Zeichen in Formel-Fonts
+IMAGE_COVERAGE_SCAN = 0.5          # Seite größtenteils von einem Bild bedeckt
+
+# Typische Formel-Fonts (TeX Computer Modern / AMS, Word, STIX)
+MATH_FONT_HINTS = (
+    "CMMI", "CMSY", "CMEX", "CMBSY", "MSAM", "MSBM", "EUFM", "RSFS",
+    "CAMBRIAMATH", "CAMBRIA MATH", "SYMBOL", "MTEXTRA", "MT EXTRA",
+    "STIX", "XITSMATH", "LATINMODERNMATH", "EUCLID",
+)
+
+# Span-Flag "superscript" laut PyMuPDF
+SPAN_FLAG_SUPERSCRIPT = 1
+
+
+def _is_bad_char(ch: str) -> bool:
+    """Replacement chars and private-use glyphs mean the font has no usable ToUnicode map"""
+    return ch == "�" or 0xE000 <= ord(ch) <= 0xF8FF
+
+
+def _is_math_font(font_name: str) -> bool:
+    name = font_name.upper()
+    # Subset-Präfix "ABCDEF+" entfernen
+    if "+" in name:
+        name = name.split("+", 1)[1]
+    return any(hint in name for hint in MATH_FONT_HINTS)
+
+
+def _image_coverage(page) -> float:
+    """Fraction of the page area covered by raster images (scans)"""
+    page_area = abs(page.rect) or 1.0
+    covered = 0.0
+    for info in page.get_image_info():
+        bbox = fitz.Rect(info["bbox"]) & page.rect
+        covered += abs(bbox)
+    return min(covered / page_area, 1.0)
+
+
+def extract_text_layer(page):
+    """
+    Try to read a page from its native text layer.
+
+    Superscript spans are written as ``^`` exponents so that "x³" typeset by
+    LaTeX (a raised "3" in a smaller font) survives as ``x^3``.
+
+    Returns ``(text, reason)``; ``text`` is None when the page should go
+    through rasterize + vision instead.
+    """
+    page_dict = page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT, sort=True)
+
+    lines_out = []
+    total_chars = 0
+    bad_chars = 0
+    math_chars = 0
+
+    for block in page_dict.get("blocks", []):
+        if block.get("type") != 0:
+            continue
+        for line in block.get("lines", []):
+            parts = []
+            for span in line.get("spans", []):
+                text = unicodedata.normalize("NFC", span.get("text", ""))
+                if not text:
+                    continue
+                visible = [ch for ch in text if not ch.isspace()]
+                total_chars += len(visible)
+                bad_chars += sum(1 for ch in visible if _is_bad_char(ch))
+                if _is_math_font(span.get("font", "")):
+                    math_chars += len(visible)
+
+                if span.get("flags", 0) & SPAN_FLAG_SUPERSCRIPT and text.strip():
+                    exponent = text.strip()
+                    parts.append(f"^{exponent}" if len(exponent) == 1 else f"^({exponent})")
+                else:
+                    parts.append(text)
+            line_text = "".join(parts).rstrip()
+            if line_text:
+                lines_out.append(line_text)
+        lines_out.append("")
+
+    text = "\n".join(lines_out).strip()
+
+    if total_chars < TEXT_LAYER_MIN_CHARS:
+        return None, "no text layer"
+    if bad_chars / total_chars > TEXT_LAYER_MAX_BAD_RATIO:
+        return None, "unmapped glyphs"
+    if math_chars / total_chars > TEXT_LAYER_MAX_MATH_RATIO:
+        return None, "formula-heavy"
+    if _image_coverage(page) > IMAGE_COVERAGE_SCAN and total_chars < 200:
+        return None, "scanned page"
+
+    return text, "text layer"
+
+
+# ------------------------------
+# Bildvorbereitung für Vision-OCR
+# ------------------------------
+# gpt-4o-mini skaliert Bilder auf max. 2048 px (lange Seite) und dann auf
+# 768 px (kurze Seite) herunter - mehr Pixel zu senden kostet nur Upload-Zeit.
+VISION_MAX_LONG_EDGE = int(os.getenv("VISION_MAX_LONG_EDGE", "2048"))
+VISION_MAX_SHORT_EDGE = int(os.getenv("VISION_MAX_SHORT_EDGE", "768"))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "70"))
+
+RASTER_MIN_DPI = 96
+RASTER_MAX_DPI = 200
+RASTER_DEFAULT_DPI = 150
+TARGET_GLYPH_PX = 20      # kleinste Schrift soll ca. so hoch gerendert werden
+PROBE_DPI = 36            # Vorschau für Rand-Erkennung und Seitenfilter
+CROP_INK_THRESHOLD = 235  # Grauwert < Schwelle zählt als Tinte
+CROP_PADDING_PT = 12
+
+# Alte Einstellung (dpi=150, Farbe) - nur als Referenz für die Ersparnis
+LEGACY_DPI = 150
+
+
+def gray_samples(pix) -> np.ndarray:
+    """Samples of a single-channel pixmap as a 2-D uint8 array"""
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+
+
+def _content_dpi(page) -> float:
+    """
+    Resolution from the page's content density: small fonts need more dpi,
+    scans are never rendered above their native resolution.
+    """
+    sizes = [
+        span["size"]
+        for block in page.get_text("dict").get("blocks", []) if block.get("type") == 0
+        for line in block.get("lines", [])
+        for span in line.get("spans", [])
+        if span.get("text", "").strip() and span.get("size", 0) >= 5
+    ]
+    dpi = TARGET_GLYPH_PX * 72 / min(sizes) if sizes else None
+
+    native = []
+    for info in page.get_image_info():
+        bbox = fitz.Rect(info["bbox"])
+        if bbox.width > 0 and info.get("width"):
+            native.append(info["width"] / (bbox.width / 72))
+    if native:
+        dpi = min(dpi, max(native)) if dpi else max(native)
+
+    return max(RASTER_MIN_DPI, min(RASTER_MAX_DPI, dpi or RASTER_DEFAULT_DPI))
+
+
+def probe_page(page) -> np.ndarray:
+    """Low-resolution grayscale render of the whole page (cheap, ~ms)"""
+    pix = page.get_pixmap(dpi=PROBE_DPI, colorspace=fitz.csGRAY, alpha=False)
+    return gray_samples(pix).copy()
+
+
+def _content_rect(page, probe: np.ndarray) -> fitz.Rect:
+    """Bounding box of everything that is not (nearly) white, plus padding"""
+    ink = probe < CROP_INK_THRESHOLD
+    rows = np.flatnonzero(ink.any(axis=1))
+    cols = np.flatnonzero(ink.any(axis=0))
+    if rows.size == 0 or cols.size == 0:
+        return page.rect
+
+    scale_x = page.rect.width / probe.shape[1]
+    scale_y = page.rect.height / probe.shape[0]
+    rect = fitz.Rect(
+        page.rect.x0 + cols[0] * scale_x - CROP_PADDING_PT,
+        page.rect.y0 + rows[0] * scale_y - CROP_PADDING_PT,
+        page.rect.x0 + (cols[-1] + 1) * scale_x + CROP_PADDING_PT,
+        page.rect.y0 + (rows[-1] + 1) * scale_y + CROP_PADDING_PT,
+    )
+    return rect & page.rect
+
+
+def prepare_page_image(page, measure_reference: bool = False, probe: np.ndarray = None):
+    """
+    Render a page (PDF page or a photo opened with PyMuPDF) for the vision
+    model: resolution from content density, grayscale, empty margins cropped,
+    edges capped at what the model actually uses, tuned JPEG quality.
+
+    Returns ``(jpeg_bytes, info)``; with ``measure_reference`` the info also
+    holds the size the old fixed 150-dpi colour rendering would have had.
+    ``probe`` is an already rendered probe_page() of this page.
+    """
+    dpi = _content_dpi(page)
+    clip = _content_rect(page, probe if probe is not None else probe_page(page))
+
+    zoom = dpi / 72
+    long_edge = max(clip.width, clip.height) * zoom
+    short_edge = min(clip.width, clip.height) * zoom
+    zoom *= min(1.0, VISION_MAX_LONG_EDGE / long_edge, VISION_MAX_SHORT_EDGE / short_edge)
+
+    pix = page.get_pixmap(
+        matrix=fitz.Matrix(zoom, zoom), clip=clip, colorspace=fitz.csGRAY, alpha=False
+    )
+    jpeg_bytes = pix.tobytes("jpeg", jpg_quality=VISION_JPEG_QUALITY)
+
+    info = {
+        "dpi": round(zoom * 72),
+        "width": pix.width,
+        "height": pix.height,
+        "bytes": len(jpeg_bytes),
+    }
+    if measure_reference:
+        info["referenceBytes"] = len(page.get_pixmap(dpi=LEGACY_DPI).tobytes("jpeg"))
+    return jpeg_bytes, info
+
+
+def prepare_photo(path: str, filetype: str):
+    """
+    Single uploaded image file (phone photo) -> ``(jpeg_bytes, info)`` like
+    prepare_page_image(); ``referenceBytes`` is the original file size.
+
+    Returns None if PyMuPDF cannot read the format or the result would not
+    be smaller; callers then send the original bytes.
+    """
+    try:
+        doc = fitz.open(path, filetype=filetype)
+    except Exception as e:
+        print(f"[UPLOAD] Image preparation skipped ({filetype}): {e}")
+        return None
+    try:
+        jpeg_bytes, info = prepare_page_image(doc.load_page(0))
+    finally:
+        doc.close()
+    info["referenceBytes"] = os.path.getsize(path)
+    if len(jpeg_bytes) >= info["referenceBytes"]:
+        return None
+    return jpeg_bytes, info
+
+
+# ------------------------------
+# Leere und doppelte Seiten
+# ------------------------------
+# Rückseiten, Deckblätter und doppelt gescannte Seiten kosten sonst je einen
+# Vision-Call. Beide Tests laufen auf der PROBE_DPI-Vorschau (wenige ms);
+# das Herunterrechnen glättet Scanner-Rauschen und durchscheinende Rückseiten.
+PAGE_FILTER_ENABLED = os.getenv("PAGE_FILTER_ENABLED", "1") == "1"
+
+BLANK_INK_THRESHOLD = 160      # Grauwert < Schwelle zählt als Tinte
+BLANK_MAX_INK_RATIO = 0.0002   # weniger Tinte -> leere Seite (eine kurze Zeile ~0.05%)
+BLANK_EDGE_MARGIN = 0.04       # Scanner-Schatten am Rand ignorieren
+
+# Duplikate: dHash als schnelle Vorauswahl, dann Pixelvergleich bei 100 dpi.
+# Arbeitsblätter mit gleichem Layout haben fast gleiche Hashes - erst der
+# ausgerichtete, lokale Tintenvergleich unterscheidet "x - 7" von "x - 14":
+# Scanner-Rauschen verteilt sich, eine andere Ziffer ist ein dichter Fleck.
+HASH_SIZE = 16                 # dHash 16x16 = 256 Bit
+HASH_MIN_STEP = 3              # kleinere Helligkeitsstufen zählen als "gleich"
+DUPLICATE_CANDIDATE_DISTANCE = 24
+DUPLICATE_MAX_INK_DIFF = 0.15  # relative Tinten-Abweichung
+DUPLICATE_CONFIRM_DPI = 100
+DUPLICATE_MAX_SHIFT = 5        # Versatz beim erneuten Scannen (px bei 100 dpi)
+DUPLICATE_WINDOW = 8           # Fenster (px) für lokale Abweichungen, ca. eine Ziffer
+DUPLICATE_MAX_LOCAL_DIFF = 6   # max. abweichende Tintenpixel in einem Fenster
+# Pixelvergleiche pro Seite begrenzen (neueste Seiten zuerst - doppelt
+# eingezogene Blätter liegen nebeneinander); sonst wird ein Stapel gleich
+# aufgebauter Blätter quadratisch teuer
+DUPLICATE_MAX_COMPARISONS = 8
+
+
+def ink_ratio(probe: np.ndarray) -> float:
+    """Share of dark pixels, ignoring a thin border (scanner shadows)"""
+    h, w = probe.shape
+    dy, dx = int(h * BLANK_EDGE_MARGIN), int(w * BLANK_EDGE_MARGIN)
+    inner = probe[dy:h - dy, dx:w - dx]
+    if inner.size == 0:
+        return 0.0
+    return float(np.count_nonzero(inner < BLANK_INK_THRESHOLD)) / inner.size
+
+
+def _area_mean(image: np.ndarray, rows: int, cols: int) -> np.ndarray:
+    """Downscale by averaging (rows x cols blocks)"""
+    y_edges = np.linspace(0, image.shape[0], rows + 1).astype(int)
+    x_edges = np.linspace(0, image.shape[1], cols + 1).astype(int)
+    sums = np.add.reduceat(np.add.reduceat(image.astype(np.float32), y_edges[:-1], axis=0), x_edges[:-1], axis=1)
+    counts = np.outer(np.diff(y_edges), np.diff(x_edges))
+    return sums / np.maximum(counts, 1)
+
+
+def difference_hash(probe: np.ndarray) -> int:
+    """Perceptual dHash: does brightness rise from each cell to its right neighbour?"""
+    grid = _area_mean(probe, HASH_SIZE, HASH_SIZE + 1)
+    bits = (grid[:, 1:] - grid[:, :-1]) > HASH_MIN_STEP
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def ink_mask(page) -> np.ndarray:
+    """Boolean ink mask at DUPLICATE_CONFIRM_DPI"""
+    pix = page.get_pixmap(dpi=DUPLICATE_CONFIRM_DPI, colorspace=fitz.csGRAY, alpha=False)
+    return gray_samples(pix) < BLANK_INK_THRESHOLD
+
+
+def _best_shift(profile_a: np.ndarray, profile_b: np.ndarray, max_shift: int) -> int:
+    """Offset that best aligns two ink profiles (row or column sums)"""
+    a = profile_a - profile_a.mean()
+    b = profile_b - profile_b.mean()
+    n = min(len(a), len(b))
+    best, best_score = 0, None
+    for shift in range(-max_shift, max_shift + 1):
+        lo, hi = max(0, shift), n + min(0, shift)
+        score = float(np.dot(a[lo:hi], b[lo - shift:hi - shift]))
+        if best_score is None or score > best_score:
+            best, best_score = shift, score
+    return best
+
+
+def _dilate(mask: np.ndarray) -> np.ndarray:
+    """3x3 dilation (1 px tolerance for anti-aliasing and resampling)"""
+    grown = mask.copy()
+    grown[1:] |= mask[:-1]
+    grown[:-1] |= mask[1:]
+    wide = grown.copy()
+    wide[:, 1:] |= grown[:, :-1]
+    wide[:, :-1] |= grown[:, 1:]
+    return wide
+
+
+def local_ink_difference(mask_a: np.ndarray, mask_b: np.ndarray) -> int:
+    """
+    Most ink pixels without a counterpart inside one DUPLICATE_WINDOW square
+    (windows at half-window steps) after aligning the two pages. 0 = identical.
+    """
+    if mask_a.shape != mask_b.shape:
+        return mask_a.size
+    dy = _best_shift(mask_a.sum(axis=1).astype(float), mask_b.sum(axis=1).astype(float), DUPLICATE_MAX_SHIFT)
+    dx = _best_shift(mask_a.sum(axis=0).astype(float), mask_b.sum(axis=0).astype(float), DUPLICATE_MAX_SHIFT)
+    mask_b = np.roll(mask_b, (dy, dx), axis=(0, 1))
+    unmatched = (mask_a & ~_dilate(mask_b)) | (mask_b & ~_dilate(mask_a))
+
+    # Halbe Fenster summieren, je zwei benachbarte ergeben ein Fenster
+    step = max(1, DUPLICATE_WINDOW // 2)
+    pixels = unmatched.view(np.uint8)
+    rows = np.add.reduceat(pixels, np.arange(0, pixels.shape[0], step), axis=0, dtype=np.uint16)
+    if rows.shape[0] > 1:
+        rows = rows[:-1] + rows[1:]
+    cells = np.add.reduceat(rows, np.arange(0, rows.shape[1], step), axis=1, dtype=np.uint16)
+    if cells.shape[1] > 1:
+        cells = cells[:, :-1] + cells[:, 1:]
+    return int(cells.max())
+
+
+class PageFilter:
+    """
+    Decides per scanned page whether it needs OCR at all. Pages must be
+    checked in page order; ``load_mask(page_num)`` is an async callable
+    returning ink_mask() of a page and is only awaited for likely duplicates.
+
+        page_filter = PageFilter()
+        probe = probe_page(page)
+        reason, duplicate_of = await page_filter.check(
+            page_num, ink_ratio(probe), difference_hash(probe), load_mask
+        )
+        # reason: None, "blank" or "duplicate"
+    """
+
+    def __init__(self, enabled: bool = PAGE_FILTER_ENABLED):
+        self.enabled = enabled
+        self._seen = []  # [page_num, hash, ink, mask|None] der behaltenen Seiten
+
+    async def check(self, page_num: int, ink: float, page_hash: int, load_mask):
+        if not self.enabled:
+            return None, None
+        if ink < BLANK_MAX_INK_RATIO:
+            return "blank", None
+
+        mask = None
+        comparisons = 0
+        for seen in reversed(self._seen):
+            if comparisons >= DUPLICATE_MAX_COMPARISONS:
+                break
+            seen_num, seen_hash, seen_ink, seen_mask = seen
+            if bin(page_hash ^ seen_hash).count("1") > DUPLICATE_CANDIDATE_DISTANCE:
+                continue
+            if abs(ink - seen_ink) > DUPLICATE_MAX_INK_DIFF * max(ink, seen_ink):
+                continue
+            # Kandidat -> genauer vergleichen (Masken nur bei Bedarf rendern)
+            if mask is None:
+                mask = await load_mask(page_num)
+            if seen_mask is None:
+                seen_mask = seen[3] = await load_mask(seen_num)
+            comparisons += 1
+            # numpy gibt den GIL frei -> Vergleich im Thread, Event-Loop bleibt frei
+            difference = await asyncio.to_thread(local_ink_difference, mask, seen_mask)
+            if difference <= DUPLICATE_MAX_LOCAL_DIFF:
+                return "duplicate", seen_num
+
+        self._seen.append([page_num, page_hash, ink, mask])
+        return None, None
+
+
+# ------------------------------
+# Worker-Funktionen (RasterPool)
+# ------------------------------
+# Jeder Aufruf öffnet die Datei selbst: Dokumente lassen sich nicht zwischen
+# Prozessen teilen, und offene Handles würden das Löschen unter Windows blockieren.
+def pdf_page_count(path: str) -> int:
+    with fitz.open(path) as doc:
+        return len(doc)
+
+
+def scan_page(path: str, page_num: int) -> dict:
+    """
+    First pass over one page: text layer if usable, otherwise the probe and
+    its PageFilter fingerprint (``ink``, ``hash``).
+    """
+    with fitz.open(path) as doc:
+        page = doc.load_page(page_num)
+        text, reason = extract_text_layer(page)
+        if text is not None:
+            return {"text": text, "reason": reason}
+        started = time.perf_counter()
+        probe = probe_page(page)
+        return {
+            "text": None,
+            "reason": reason,
+            "probe": probe,
+            "ink": ink_ratio(probe),
+            "hash": difference_hash(probe),
+            "filterMs": (time.perf_counter() - started) * 1000,
+        }
+
+
+def ink_mask_page(path: str, page_num: int):
+    """ink_mask() of one page plus the time it took in ms"""
+    started = time.perf_counter()
+    with fitz.open(path) as doc:
+        mask = ink_mask(doc.load_page(page_num))
+    return mask, (time.perf_counter() - started) * 1000
+
+
+def render_page(path: str, page_num: int, measure_reference: bool = False, probe: np.ndarray = None):
+    """prepare_page_image() for one page of a PDF file"""
+    with fitz.open(path) as doc:
+        return prepare_page_image(doc.load_page(page_num), measure_reference, probe)
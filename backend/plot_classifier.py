@@ -0,0 +1,400 @@
+# Datei: plot_classifier.py
+"""
+Local pre-classifier for /plot.
+
+Most subtasks either contain a concrete function ("Löse x³ - 27 = 0",
+"f(x) = 2x + 3") or are clearly abstract ("Zeige, dass f'(x₁) = 0").
+classify_plot() decides these cases without a model call:
+
+- "plot": a concrete expression in x was found and compiles with
+  plot_engine; ``plotData`` has the same shape as the model's answer
+- "abstract": no concrete function, but indexed variables (x₁, x_0) or free
+  parameters (a, b, c without values) -> plottable: false
+- "ambiguous": everything else (points, geometry, several equations,
+  parameters with values, ...) -> the model decides
+
+Several concrete definitions ("f(x) = x², g(x) = 2x + 3") become one
+"functions" plot with all of them.
+
+Only the subtask text is searched for equations; the main task text is
+used for an ``f(x) = ...`` definition when the subtask has none
+("Bestimme die Nullstellen." under "Gegeben ist f(x) = x² - 4").
+
+Counters for /cache-stats: decisions (hit rate = plot + abstract of all
+requests) and, for requests also sent to the model in shadow mode
+(compare_with_model), how often the model disagreed.
+"""
+import ast
+import re
+import threading
+
+import numpy as np
+
+from plot_engine import CONSTANTS, FUNCTIONS, ExpressionError, compile_expression, to_python_syntax
+
+DEFAULT_DOMAIN = {"xMin": -10, "xMax": 10, "yMin": -50, "yMax": 50}
+CHECK_POINTS = 201
+MIN_FINITE_SHARE = 0.05      # Anteil endlicher Werte in -10..10, sonst "ambiguous"
+MATCH_TOLERANCE = 1e-6       # relative Abweichung, ab der zwei Funktionen verschieden sind
+MAX_FUNCTIONS = 4            # mehrere Definitionen (f, g, ...) in einem Diagramm
+
+_LETTER = "A-Za-zÄÖÜäöüß"
+_NAMES = "|".join(sorted(set(FUNCTIONS) | {"pi", "e", "x"}, key=len, reverse=True))
+# Ein Stück Mathematik im Fließtext: Zahlen, x, Funktionsnamen, Operatoren
+_ATOM = rf"(?:\d+(?:\.\d+)?|(?<![{_LETTER}])(?:{_NAMES})(?![{_LETTER}])|[-+*/^()²³√π·×−–]|[ \t])"
+_MATH_RUN = rf"{_ATOM}+"
+
+# "f(x) = ...", "g(x)=...", "y = ..." (rechte Seite: _definition_rhs)
+DEFINITION_RE = re.compile(rf"(?<![{_LETTER}'′])(?P<name>[fghpkuv](?:_?\d)?\s*\(\s*x\s*\)|y)\s*=")
+_RHS_TOKEN_RE = re.compile(rf"\s+|\d+(?:\.\d+)?|[{_LETTER}]+|.")
+_OPERATORS = set("-+*/^()²³√π·×−–")
+# Gleichungen im Text: "x³ - 27 = 0", "2x + 3 = 7"
+EQUATION_RE = re.compile(rf"{_MATH_RUN}={_MATH_RUN}")
+# Funktionsaufrufe wie f'(x₁), f(x), g''(x) - nicht Teil einer Gleichung
+FUNCTION_CALL_RE = re.compile(rf"(?<![{_LETTER}])[{_LETTER}](?:_?\d)?\s*['′]*\s*\([^()]*\)")
+# x₁, x_0, x0: Stellen ohne Wert
+INDEXED_VARIABLE_RE = re.compile(r"(?<![A-Za-z])x\s*(?:[₀-₉]|_\s*\d)")
+# Parameter mit Wert: "a = 2", "für k=0,5"
+ASSIGNMENT_RE = re.compile(r"(?<![A-Za-z])([a-wyz])\s*=\s*-?\d")
+_DECIMAL_COMMA_RE = re.compile(r"(?<=\d),(?=\d)")
+# Buchstaben, die in Aufgaben als Parameter stehen (y, z usw. sind Variablen)
+PARAMETER_NAMES = frozenset("abcdkmnpqrst")
+
+ABSTRACT_MESSAGE = (
+    "Diese Aufgabe ist zu abstrakt für eine konkrete Grafik. "
+    "Sie enthält allgemeine Parameter ohne spezifische Werte."
+)
+
+_lock = threading.Lock()
+_counters = {
+    "plot": 0, "abstract": 0, "ambiguous": 0,
+    "shadowCompared": 0, "shadowAgreed": 0,
+    "falsePositives": 0,        # lokal "plot", Modell: nicht plottbar
+    "functionMismatches": 0,    # lokal "plot", Modell: andere Funktion
+    "falseAbstract": 0,         # lokal "abstract", Modell: plottbar
+}
+
+
+def _count(key: str):
+    with _lock:
+        _counters[key] += 1
+
+
+def _is_term_word(word: str) -> bool:
+    """"x", "sin", "ax", "bx" - a letter run made of known names and parameters"""
+    known = sorted(set(FUNCTIONS) | set(CONSTANTS) | {"x"}, key=len, reverse=True)
+    pos = 0
+    parameters_only = True
+    while pos < len(word):
+        name = next((name for name in known if word.startswith(name, pos)), None)
+        if name is None and word[pos] not in PARAMETER_NAMES:
+            return False
+        parameters_only = parameters_only and name is None
+        pos += len(name) if name else 1
+    # "an", "da": Wörter, keine Produkte von Parametern
+    return not (parameters_only and len(word) > 1)
+
+
+def _definition_rhs(text: str) -> str:
+    """Leading term of ``text`` (up to the first word, "." or other non-math character)"""
+    end = 0
+    for match in _RHS_TOKEN_RE.finditer(text):
+        token = match.group(0)
+        if token.isspace() or token in _OPERATORS or token[0] in "0123456789":
+            end = match.end()
+        elif re.match(rf"[{_LETTER}]", token) and _is_term_word(token):
+            end = match.end()
+        elif token in "₀₁₂₃₄₅₆₇₈₉":
+            return ""    # x₁ usw.: keine konkrete Funktion
+        else:
+            break
+    return text[:end]
+
+
+def _strip_run(run: str) -> str:
+    """Trim spaces, dangling operators and unmatched outer parentheses"""
+    run = run.strip(" \t+*/^=·×")
+    while run.count("(") > run.count(")") and run.startswith("("):
+        run = run[1:].strip()
+    while run.count(")") > run.count("(") and run.endswith(")"):
+        run = run[:-1].strip()
+    return run.rstrip(" \t-+*/^−–·×")
+
+
+def _free_names(source: str) -> set:
+    """Names in ``source`` that are neither x nor a known function/constant"""
+    try:
+        tree = ast.parse(to_python_syntax(source), mode="eval")
+    except (ExpressionError, SyntaxError):
+        return set()
+    return {
+        node.id for node in ast.walk(tree)
+        if isinstance(node, ast.Name) and node.id != "x" and node.id not in FUNCTIONS and node.id not in CONSTANTS
+    }
+
+
+def _polynomial_degree(node):
+    """Degree of a polynomial AST in x, or None if it is not a polynomial"""
+    if isinstance(node, ast.Expression):
+        return _polynomial_degree(node.body)
+    if isinstance(node, ast.Constant):
+        return 0
+    if isinstance(node, ast.Name):
+        return 1 if node.id == "x" else (0 if node.id in CONSTANTS else None)
+    if isinstance(node, ast.UnaryOp):
+        return _polynomial_degree(node.operand)
+    if isinstance(node, ast.BinOp):
+        left, right = _polynomial_degree(node.left), _polynomial_degree(node.right)
+        if left is None or right is None:
+            return None
+        if isinstance(node.op, (ast.Add, ast.Sub)):
+            return max(left, right)
+        if isinstance(node.op, ast.Mult):
+            return left + right
+        if isinstance(node.op, ast.Div):
+            return left if right == 0 else None
+        if isinstance(node.op, ast.Pow) and right == 0 and isinstance(node.right, ast.Constant):
+            exponent = node.right.value
+            if float(exponent).is_integer() and 0 <= exponent <= 20:
+                return left * int(exponent)
+    return None
+
+
+def graph_type(python_source: str) -> str:
+    degree = _polynomial_degree(ast.parse(python_source, mode="eval"))
+    if degree is None:
+        return "function"
+    return "line" if degree <= 1 else "polynomial"
+
+
+def _concrete(source: str):
+    """CompiledExpression if ``source`` is a usable function of x, else None"""
+    if "x" not in to_python_syntax(source).split():
+        return None
+    function = compile_expression(source)
+    values = function(np.linspace(DEFAULT_DOMAIN["xMin"], DEFAULT_DOMAIN["xMax"], CHECK_POINTS))
+    if np.isfinite(values).mean() < MIN_FINITE_SHARE:
+        return None
+    return function
+
+
+def _candidates(text: str) -> tuple:
+    """
+    ``(definitions, equations)`` as ``[(title, expression), ...]`` found in
+    ``text``; an equation ``lhs = rhs`` becomes ``lhs - (rhs)``.
+    """
+    definitions = []
+    rest, previous_end = "", 0
+    for match in DEFINITION_RE.finditer(text):
+        if match.start() < previous_end:
+            continue
+        raw_rhs = _definition_rhs(text[match.end():])
+        rhs = _strip_run(raw_rhs)
+        if rhs:
+            name = re.sub(r"\s+", "", match.group("name"))
+            definitions.append((f"{name} = {rhs}", rhs))
+        # Definitionen nicht noch einmal als Gleichung lesen
+        rest += text[previous_end:match.start()] + " ; "
+        previous_end = match.end() + len(raw_rhs)
+    rest += text[previous_end:]
+
+    rest = FUNCTION_CALL_RE.sub(" ; ", rest)
+    equations = []
+    for match in EQUATION_RE.finditer(rest):
+        sides = [_strip_run(side) for side in match.group(0).split("=")]
+        if len(sides) != 2 or not all(sides):
+            continue
+        lhs, rhs = sides
+        # "x = 3" (Lösung/Einsetzen) ist keine Funktion
+        if lhs == "x" or rhs == "x":
+            continue
+        if rhs == "0":
+            equations.append((f"f(x) = {lhs}", lhs))
+        elif re.fullmatch(r"\d+(?:\.\d+)?", rhs):
+            equations.append((f"f(x) = {lhs} - {rhs}", f"({lhs}) - ({rhs})"))
+        else:
+            equations.append((f"f(x) = {lhs} - ({rhs})", f"({lhs}) - ({rhs})"))
+    return definitions, equations
+
+
+def _unique(candidates: list) -> list:
+    seen = {}
+    for title, expression in candidates:
+        seen.setdefault(expression.replace(" ", ""), (title, expression))
+    return list(seen.values())
+
+
+def _plot_result(title: str, expression: str, source: str) -> dict:
+    function = compile_expression(expression)
+    return {
+        "decision": "plot",
+        "source": source,
+        "plotData": {
+            "plottable": True,
+            "reason": "Konkrete Funktion im Aufgabentext",
+            "graphType": graph_type(function.python_source),
+            "function": function.python_source,
+            "domain": dict(DEFAULT_DOMAIN),
+            "title": title,
+            "xLabel": "x",
+            "yLabel": "f(x)",
+        },
+    }
+
+
+def _decide(candidates: list, text: str, source: str):
+    """plot/abstract result for the candidates of one text, or None"""
+    candidates = _unique(candidates)
+    if len(candidates) != 1:
+        return None
+    title, expression = candidates[0]
+    names = _free_names(expression)
+    if names:
+        # Nur Parameter ohne Werte -> abstrakt; sonst (y, eingesetzte Werte) das Modell
+        if names <= PARAMETER_NAMES and not names & set(ASSIGNMENT_RE.findall(text)):
+            return {"decision": "abstract", "reason": ABSTRACT_MESSAGE}
+        return None
+    try:
+        if _concrete(expression) is None:
+            return None
+    except (ExpressionError, ArithmeticError):
+        # z.B. 10^400: lieber das Modell fragen als die Anfrage scheitern lassen
+        return None
+    return _plot_result(title, expression, source)
+
+
+def _decide_several(definitions: list) -> dict:
+    """"functions" plot for several concrete definitions with distinct names, or None"""
+    definitions = _unique(definitions)
+    names = [title.split("=")[0].strip() for title, _ in definitions]
+    if len(definitions) > MAX_FUNCTIONS or len(set(names)) != len(names):
+        return None
+    functions = []
+    for name, (title, expression) in zip(names, definitions):
+        try:
+            if _free_names(expression) or _concrete(expression) is None:
+                return None
+        except (ExpressionError, ArithmeticError):
+            return None
+        functions.append({
+            "name": name.split("(")[0],
+            "function": compile_expression(expression).python_source,
+            "label": title,
+        })
+    return {
+        "decision": "plot",
+        "source": "subtask",
+        "plotData": {
+            "plottable": True,
+            "reason": "Mehrere konkrete Funktionen im Aufgabentext",
+            "graphType": "functions",
+            "functions": functions,
+            "domain": dict(DEFAULT_DOMAIN),
+            "title": ", ".join(title for title, _ in definitions),
+            "xLabel": "x",
+            "yLabel": "y",
+        },
+    }
+
+
+def classify_plot(subtask_text: str, task_text: str = "", record: bool = True) -> dict:
+    """
+    ``{"decision": "plot" | "abstract" | "ambiguous", ...}`` for one
+    subtask; "plot" carries ``plotData`` (model response shape), "abstract"
+    a ``reason``. ``record=False`` leaves the counters alone (look-ahead
+    checks that do not answer a /plot request).
+    """
+    result = _classify(subtask_text or "", task_text or "")
+    if record:
+        _count(result["decision"])
+    return result
+
+
+def _classify(subtask_text: str, task_text: str) -> dict:
+    subtask = _DECIMAL_COMMA_RE.sub(".", subtask_text)
+    task = _DECIMAL_COMMA_RE.sub(".", task_text)
+
+    definitions, equations = _candidates(subtask)
+    if len(_unique(definitions)) > 1:
+        return _decide_several(definitions) or {"decision": "ambiguous", "reason": "Mehrere Funktionen"}
+    if not definitions and len(_unique(equations)) > 1:
+        return {"decision": "ambiguous", "reason": "Mehrere Gleichungen"}
+    # Eine Definition hat Vorrang vor Gleichungen mit ihr ("f(x) = x² - 4 = 0")
+    result = _decide(definitions or equations, subtask, "subtask")
+    if result:
+        return result
+    if definitions or equations:
+        return {"decision": "ambiguous", "reason": "Ausdruck nicht eindeutig auswertbar"}
+
+    task_definitions, _ = _candidates(task)
+    result = _decide(task_definitions, task + " " + subtask, "task")
+    if result:
+        return result
+    if task_definitions:
+        return {"decision": "ambiguous", "reason": "Funktion der Hauptaufgabe nicht eindeutig"}
+
+    if INDEXED_VARIABLE_RE.search(subtask):
+        return {"decision": "abstract", "reason": ABSTRACT_MESSAGE}
+    return {"decision": "ambiguous", "reason": "Keine konkrete Funktion gefunden"}
+
+
+def _same_function(local_source: str, model_source: str) -> bool:
+    xs = np.linspace(DEFAULT_DOMAIN["xMin"], DEFAULT_DOMAIN["xMax"], CHECK_POINTS)
+    try:
+        a = compile_expression(local_source)(xs)
+        b = compile_expression(model_source)(xs)
+    except (ExpressionError, ArithmeticError):
+        return False
+    both = np.isfinite(a) & np.isfinite(b)
+    if not both.any() or (np.isfinite(a) != np.isfinite(b)).mean() > 0.05:
+        return False
+    scale = max(1.0, float(np.abs(a[both]).max()))
+    return bool(np.abs(a[both] - b[both]).max() <= MATCH_TOLERANCE * scale)
+
+
+def compare_with_model(local: dict, model_plot_data: dict) -> str:
+    """
+    Record how the model decided a request the classifier already answered
+    (shadow mode). Returns "agreed", "falsePositive", "functionMismatch" or
+    "falseAbstract".
+    """
+    model_plottable = bool(model_plot_data.get("plottable"))
+    if local["decision"] == "abstract":
+        outcome = "falseAbstract" if model_plottable else "agreed"
+    elif not model_plottable:
+        outcome = "falsePositive"
+    elif "function" in local["plotData"] and model_plot_data.get("graphType") in (
+        "function", "polynomial", "line"
+    ) and not _same_function(
+        local["plotData"]["function"], str(model_plot_data.get("function", ""))
+    ):
+        outcome = "functionMismatch"
+    else:
+        outcome = "agreed"
+
+    _count("shadowCompared")
+    _count({
+        "agreed": "shadowAgreed", "falsePositive": "falsePositives",
+        "functionMismatch": "functionMismatches", "falseAbstract": "falseAbstract",
+    }[outcome])
+    return outcome
+
+
+def stats() -> dict:
+    with _lock:
+        counts = dict(_counters)
+    total = counts["plot"] + counts["abstract"] + counts["ambiguous"]
+    compared = counts["shadowCompared"]
+    return {
+        "decisions": {key: counts[key] for key in ("plot", "abstract", "ambiguous")},
+        "hitRate": round((counts["plot"] + counts["abstract"]) / total, 3) if total else 0.0,
+        "shadow": {
+            "compared": compared,
+            "agreed": counts["shadowAgreed"],
+            "falsePositives": counts["falsePositives"],
+            "functionMismatches": counts["functionMismatches"],
+            "falseAbstract": counts["falseAbstract"],
+            # lokal entschieden, Modell hätte anders entschieden
+            "falsePositiveRate": round((compared - counts["shadowAgreed"]) / compared, 3) if compared else 0.0,
+        },
+    }
@@ -0,0 +1,982 @@
+# Datei: plot_engine.py
+"""
+Safe expression engine for /plot.
+
+The model returns the function to plot as a string ("x^3 - 27", "2x + 3",
+"np.sin(x)/x"). compile_expression() normalizes the notation, parses it
+once into a Python AST, rejects everything outside a small whitelist
+(numbers, the plot variables, + - * / ** and known math functions) and
+compiles it into a code object that evaluates vectorized with NumPy.
+Compiled expressions are cached by source string.
+
+    f = compile_expression("2x^2 - 3sin(x)")
+    y = f(np.linspace(-5, 5, 200))
+"""
+import ast
+import re
+from functools import lru_cache
+
+import numpy as np
+
+EXPRESSION_MAX_CHARS = 300
+COMPILE_CACHE_SIZE = 512
+
+FUNCTIONS = {
+    "sin": np.sin, "cos": np.cos, "tan": np.tan,
+    "asin": np.arcsin, "acos": np.arccos, "atan": np.arctan,
+    "arcsin": np.arcsin, "arccos": np.arccos, "arctan": np.arctan,
+    "sinh": np.sinh, "cosh": np.cosh, "tanh": np.tanh,
+    "exp": np.exp, "sqrt": np.sqrt, "cbrt": np.cbrt, "abs": np.abs,
+    "ln": np.log, "log": np.log, "log10": np.log10, "lg": np.log10, "log2": np.log2,
+    "floor": np.floor, "ceil": np.ceil, "sign": np.sign,
+}
+CONSTANTS = {"pi": np.pi, "e": np.e}
+
+_ALLOWED_BINOPS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow)
+_ALLOWED_UNARYOPS = (ast.UAdd, ast.USub)
+
+# Schreibweisen aus Aufgabentexten / Modellantworten -> Python-Syntax
+_REPLACEMENTS = (
+    ("²", "^2"), ("³", "^3"), ("π", "pi"), ("√", "sqrt"),
+    ("·", "*"), ("×", "*"), ("÷", "/"), ("−", "-"), ("–", "-"),
+)
+# "√x", "√2" -> "sqrt(x)" ("√(x+1)" wird über _REPLACEMENTS zu "sqrt(x+1)")
+_SQRT_OPERAND_RE = re.compile(r"√\s*(\d+(?:\.\d+)?|[A-Za-z])")
+_MODULE_PREFIX_RE = re.compile(r"\b(?:np|numpy|math)\s*\.\s*")
+# "y = ...", "f(x) = ..." vor dem eigentlichen Term
+_LHS_RE = re.compile(r"^\s*(?:y|[a-z]\s*\(\s*x\s*\))\s*=(?!=)", re.IGNORECASE)
+_TOKEN_RE = re.compile(r"\s*(?:(\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+)|([A-Za-z_]+\d*)|(\*\*|[-+*/^(),]))")
+
+
+class ExpressionError(ValueError):
+    """Expression cannot be parsed or uses something outside the whitelist"""
+
+
+class UnknownNameError(ExpressionError):
+    """Expression contains a name that is neither a plot variable nor known (e.g. a, b)"""
+
+
+def _split_name(name: str, variables: tuple) -> list:
+    """
+    Split an identifier run like "xsin" or "pix" into known names (longest
+    match first); unknown letters become single-letter names.
+    """
+    known = sorted(set(FUNCTIONS) | set(CONSTANTS) | set(variables), key=len, reverse=True)
+    parts = []
+    pos = 0
+    while pos < len(name):
+        for candidate in known:
+            if name.startswith(candidate, pos):
+                parts.append(candidate)
+                pos += len(candidate)
+                break
+        else:
+            parts.append(name[pos])
+            pos += 1
+    return parts
+
+
+def _tokenize(source: str, variables: tuple) -> list:
+    tokens = []
+    pos = 0
+    source = source.rstrip()
+    while pos < len(source):
+        match = _TOKEN_RE.match(source, pos)
+        if not match or match.end() == pos:
+            raise ExpressionError(f"Unerwartetes Zeichen {source[pos:].strip()[:1]!r}")
+        number, name, op = match.groups()
+        if number is not None:
+            tokens.append(("num", number))
+        elif name is not None:
+            if name in FUNCTIONS or name in CONSTANTS or name in variables:
+                tokens.append(("name", name))
+            else:
+                tokens.extend(("name", part) for part in _split_name(name, variables))
+        else:
+            tokens.append(("op", "**" if op == "^" else op))
+        pos = match.end()
+    return tokens
+
+
+def to_python_syntax(source: str, variables: tuple = ("x",)) -> str:
+    """
+    Normalize math notation: ``^`` -> ``**``, implicit multiplication
+    ("2x", "3(x+1)", "(x-1)(x+1)", "x sin(x)"), Unicode operators and
+    module prefixes ("np.sin" -> "sin").
+    """
+    source = _SQRT_OPERAND_RE.sub(r"sqrt(\1)", source)
+    for old, new in _REPLACEMENTS:
+        source = source.replace(old, new)
+    source = _MODULE_PREFIX_RE.sub("", source)
+    source = _LHS_RE.sub("", source)
+
+    out = []
+    previous = None
+    for kind, value in _tokenize(source, variables):
+        # Operand endet, neuer Operand beginnt -> "*" einfügen
+        ends_operand = previous is not None and (
+            previous[0] == "num"
+            or (previous[0] == "name" and previous[1] not in FUNCTIONS)
+            or previous == ("op", ")")
+        )
+        starts_operand = kind in ("num", "name") or (kind, value) == ("op", "(")
+        if ends_operand and starts_operand:
+            out.append("*")
+        out.append(value)
+        previous = (kind, value)
+    return " ".join(out)
+
+
+class _Validator(ast.NodeTransformer):
+    """
+    Whitelist check. Number literals become NumPy float64 values looked up by
+    name (no huge int powers, and 10^400 overflows to inf like any array).
+    """
+
+    def __init__(self, variables: tuple):
+        self.variables = variables
+        self.constants = {}
+
+    def generic_visit(self, node):
+        raise ExpressionError(f"Nicht erlaubt: {type(node).__name__}")
+
+    def visit_Expression(self, node):
+        node.body = self.visit(node.body)
+        return node
+
+    def visit_Constant(self, node):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise ExpressionError("Nur Zahlen sind als Konstanten erlaubt")
+        try:
+            value = float(node.value)
+        except OverflowError:
+            value = np.inf
+        # compile() nimmt keine NumPy-Zahlen als ast.Constant -> über den Namespace
+        name = f"_c{len(self.constants)}"
+        self.constants[name] = np.float64(value)
+        return ast.copy_location(ast.Name(id=name, ctx=ast.Load()), node)
+
+    def visit_Name(self, node):
+        if node.id in self.variables or node.id in CONSTANTS:
+            return node
+        if node.id in FUNCTIONS:
+            raise ExpressionError(f"Funktion {node.id} ohne Argument")
+        raise UnknownNameError(f"Unbekannte Größe {node.id!r}")
+
+    def visit_BinOp(self, node):
+        if not isinstance(node.op, _ALLOWED_BINOPS):
+            raise ExpressionError(f"Operator nicht erlaubt: {type(node.op).__name__}")
+        node.left = self.visit(node.left)
+        node.right = self.visit(node.right)
+        return node
+
+    def visit_UnaryOp(self, node):
+        if not isinstance(node.op, _ALLOWED_UNARYOPS):
+            raise ExpressionError(f"Operator nicht erlaubt: {type(node.op).__name__}")
+        node.operand = self.visit(node.operand)
+        return node
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+            raise ExpressionError("Nur bekannte Funktionen dürfen aufgerufen werden")
+        if node.keywords or len(node.args) != 1:
+            raise ExpressionError(f"{node.func.id} erwartet genau ein Argument")
+        node.args = [self.visit(node.args[0])]
+        return node
+
+
+class CompiledExpression:
+    """
+    Vectorized evaluator of one validated expression. Calling it returns an
+    array with the broadcast shape of the arguments; invalid points (log of
+    negative numbers, division by zero) come back as nan/inf, not as errors.
+    """
+
+    def __init__(self, source: str, python_source: str, code, variables: tuple, constants: dict = None):
+        self.source = source
+        self.python_source = python_source
+        self.variables = variables
+        self._code = code
+        self._constants = constants or {}
+
+    def __call__(self, *values):
+        if len(values) != len(self.variables):
+            raise TypeError(f"expected {len(self.variables)} argument(s)")
+        namespace = {"__builtins__": {}, **FUNCTIONS, **CONSTANTS, **self._constants}
+        arrays = [np.asarray(value, dtype=float) for value in values]
+        namespace.update(zip(self.variables, arrays))
+        with np.errstate(all="ignore"):
+            result = eval(self._code, namespace)
+        # Konstante Terme ("5") auf die Form der Eingabe bringen
+        shape = np.broadcast_shapes(*(array.shape for array in arrays))
+        return np.broadcast_to(np.asarray(result, dtype=float), shape)
+
+    def __repr__(self):
+        return f"CompiledExpression({self.python_source!r})"
+
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def _compile(source: str, variables: tuple) -> CompiledExpression:
+    python_source = to_python_syntax(source, variables)
+    try:
+        tree = ast.parse(python_source, mode="eval")
+    except SyntaxError as e:
+        raise ExpressionError(f"Syntaxfehler: {e.msg}") from None
+    validator = _Validator(variables)
+    tree = ast.fix_missing_locations(validator.visit(tree))
+    code = compile(tree, "<plot-expression>", "eval")
+    return CompiledExpression(source, python_source, code, variables, validator.constants)
+
+
+def compile_expression(source: str, variables: tuple = ("x",)) -> CompiledExpression:
+    """
+    Parse, validate and compile ``source`` (cached). Raises ExpressionError
+    (UnknownNameError for free parameters like a, b, c).
+    """
+    if not isinstance(source, str) or not source.strip():
+        raise ExpressionError("Leerer Ausdruck")
+    if len(source) > EXPRESSION_MAX_CHARS:
+        raise ExpressionError("Ausdruck zu lang")
+    return _compile(source.strip(), tuple(variables))
+
+
+def cache_info() -> dict:
+    info = _compile.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxSize": info.maxsize}
+
+
+# ------------------------------
+# Adaptive Abtastung
+# ------------------------------
+SAMPLE_INITIAL_POINTS = 49
+SAMPLE_MAX_DEPTH = 10         # kleinstes Intervall = Startabstand / 2**10
+SAMPLE_MAX_EVALUATIONS = 1500
+SAMPLE_TOLERANCE = 0.002      # Abweichung vom Sehnenmittelpunkt, Anteil der y-Spanne (~1 px)
+SAMPLE_BREAK_JUMP = 0.02      # Sprung im kleinsten Intervall -> Kurve unterbrechen
+SAMPLE_BREAK_RATIO = 4.0      # ... wenn er so viel größer ist als die Nachbarsprünge
+SAMPLE_SIMPLIFY_TOLERANCE = 0.001
+SAMPLE_CLIP_MARGIN = 0.5      # Werte außerhalb der Ansicht auf +-halbe Spanne kappen
+
+
+def _simplify(xs, ys, tolerance: float):
+    """Ramer-Douglas-Peucker on normalized coordinates; returns the kept indices"""
+    keep = np.zeros(len(xs), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(xs) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dx, dy = xs[last] - xs[first], ys[last] - ys[first]
+        inner_x = xs[first + 1:last] - xs[first]
+        inner_y = ys[first + 1:last] - ys[first]
+        norm = np.hypot(dx, dy)
+        if norm == 0:
+            distances = np.hypot(inner_x, inner_y)
+        else:
+            distances = np.abs(dx * inner_y - dy * inner_x) / norm
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            split = first + 1 + index
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return np.nonzero(keep)[0]
+
+
+def sample_function(fn, x_min: float, x_max: float, y_min: float, y_max: float) -> dict:
+    """
+    Adaptive samples of ``fn`` (a CompiledExpression) on [x_min, x_max] for
+    a view of [y_min, y_max].
+
+    Starts with SAMPLE_INITIAL_POINTS and bisects every interval whose
+    midpoint is off the chord by more than SAMPLE_TOLERANCE of the view
+    height (or where finiteness changes), within SAMPLE_MAX_EVALUATIONS.
+    The curve is broken at non-finite values and where a jump survives
+    down to the smallest interval (poles, steps). Each piece is then
+    thinned with Ramer-Douglas-Peucker, so straight parts keep only their
+    end points. Values far outside the view are capped.
+
+    Returns ``{"segments": [(xs, ys), ...], "evaluations": n}``.
+    """
+    x_min, x_max = float(x_min), float(x_max)
+    y_min, y_max = float(y_min), float(y_max)
+    if not x_max > x_min:
+        raise ValueError("x_max must be greater than x_min")
+    if not y_max > y_min:
+        y_min, y_max = y_min - 1.0, y_max + 1.0
+    x_span, y_span = x_max - x_min, y_max - y_min
+    clip_low, clip_high = y_min - SAMPLE_CLIP_MARGIN * y_span, y_max + SAMPLE_CLIP_MARGIN * y_span
+
+    def evaluate(values):
+        return np.array(fn(values), dtype=float)
+
+    xs = np.linspace(x_min, x_max, SAMPLE_INITIAL_POINTS)
+    ys = evaluate(xs)
+    evaluations = len(xs)
+    min_width = x_span / ((SAMPLE_INITIAL_POINTS - 1) * 2 ** SAMPLE_MAX_DEPTH)
+    active = np.ones(len(xs) - 1, dtype=bool)
+
+    while evaluations < SAMPLE_MAX_EVALUATIONS:
+        candidates = np.nonzero(active & (np.diff(xs) > 1.5 * min_width))[0]
+        if not len(candidates):
+            break
+        # Bei knappem Budget zuerst die Intervalle mit den größten Sprüngen
+        budget = SAMPLE_MAX_EVALUATIONS - evaluations
+        if len(candidates) > budget:
+            y_left = np.clip(ys[candidates], clip_low, clip_high)
+            y_right = np.clip(ys[candidates + 1], clip_low, clip_high)
+            jump = np.nan_to_num(np.abs(y_right - y_left), nan=y_span)
+            candidates = np.sort(candidates[np.argsort(-jump)[:budget]])
+
+        mid_x = (xs[candidates] + xs[candidates + 1]) / 2
+        mid_y = evaluate(mid_x)
+        evaluations += len(mid_x)
+
+        left, right = ys[candidates], ys[candidates + 1]
+        finite = np.isfinite(left) & np.isfinite(mid_y) & np.isfinite(right)
+        mixed = ~finite & (np.isfinite(left) | np.isfinite(mid_y) | np.isfinite(right))
+        chord = (np.clip(left, clip_low, clip_high) + np.clip(right, clip_low, clip_high)) / 2
+        deviation = np.abs(np.clip(mid_y, clip_low, clip_high) - chord)
+        refine = mixed | (finite & (deviation > SAMPLE_TOLERANCE * y_span))
+
+        active[:] = False
+        active[candidates[refine]] = True
+        split = candidates[refine] + 1
+        xs = np.insert(xs, split, mid_x[refine])
+        ys = np.insert(ys, split, mid_y[refine])
+        active = np.insert(active, split, True)
+
+    # Unterbrechungen: nicht-endliche Werte und Sprünge im kleinsten Intervall,
+    # die deutlich größer sind als in den Nachbarintervallen (steile, aber
+    # stetige Stellen wie ln(x) nahe 0 ändern sich dort ähnlich stark)
+    finite = np.isfinite(ys)
+    capped = np.clip(ys, clip_low, clip_high)
+    step = np.nan_to_num(np.abs(np.diff(capped)))
+    neighbors = np.maximum(np.r_[0.0, step[:-1]], np.r_[step[1:], 0.0])
+    jumps = (
+        (np.diff(xs) <= 1.5 * min_width)
+        & (step > SAMPLE_BREAK_JUMP * y_span)
+        & (step > SAMPLE_BREAK_RATIO * neighbors)
+    )
+    breaks = ~(finite[:-1] & finite[1:]) | jumps
+
+    segments = []
+    start = 0
+    for stop in list(np.nonzero(breaks)[0] + 1) + [len(xs)]:
+        piece = np.arange(start, stop)
+        piece = piece[finite[piece]]
+        start = stop
+        if not len(piece):
+            continue
+        if len(piece) > 2:
+            kept = _simplify(
+                (xs[piece] - x_min) / x_span,
+                (capped[piece] - y_min) / y_span,
+                SAMPLE_SIMPLIFY_TOLERANCE,
+            )
+            piece = piece[kept]
+        segments.append((xs[piece], capped[piece]))
+    return {"segments": segments, "evaluations": evaluations}
+
+
+def segments_to_points(segments: list) -> list:
+    """
+    Chart.js point list for sample_function() segments: ``{"x", "y"}``
+    dicts with a ``{"x", "y": None}`` gap between segments (spanGaps off).
+    """
+    points = []
+    for index, (xs, ys) in enumerate(segments):
+        if index:
+            points.append({"x": float((points[-1]["x"] + xs[0]) / 2), "y": None})
+        points.extend({"x": float(x), "y": float(y)} for x, y in zip(xs, ys))
+    return points
+
+
+# ------------------------------
+# Besondere Punkte und Ausschnitt
+# ------------------------------
+SPECIAL_GRID_POINTS = 4001
+SPECIAL_BISECT_STEPS = 60
+CONTINUITY_HALVINGS = 30      # Sprungsuche: 2 * delta / 2^30 ~ 1e-13 der Spannweite
+SPECIAL_MAX_PER_KIND = 8
+SPECIAL_SEARCH_WIDEN = 0.5    # Suchfenster = Modell-Ausschnitt + 50 % je Seite
+FIT_MAX_POINTS = 10           # mehr Punkte (periodisch) -> x-Ausschnitt nicht anpassen
+SPECIAL_COLORS = {
+    "root": "#ef4444",
+    "maximum": "#f59e0b",
+    "minimum": "#f59e0b",
+    "inflection": "#8b5cf6",
+}
+SPECIAL_LABELS = {
+    "root": "Nullstelle",
+    "maximum": "Hochpunkt",
+    "minimum": "Tiefpunkt",
+    "inflection": "Wendepunkt",
+}
+
+
+def _sign_change_brackets(xs, values, threshold: float):
+    """
+    ``(left, right, rising)`` arrays for every sign change of ``values``.
+    Values within ``threshold`` of zero are skipped, so a zero exactly on a
+    grid point (or flat noise) still yields one bracket around it.
+    """
+    significant = np.nonzero(np.isfinite(values) & (np.abs(values) > threshold))[0]
+    if len(significant) < 2:
+        return np.array([]), np.array([]), np.array([], dtype=bool)
+    signs = np.sign(values[significant])
+    change = np.nonzero(signs[:-1] != signs[1:])[0]
+    left, right = significant[change], significant[change + 1]
+    # Nur über endliche Abschnitte klammern (keine Definitionslücken dazwischen)
+    gaps = np.r_[0, np.cumsum(~np.isfinite(values))]
+    connected = gaps[right + 1] - gaps[left] == 0
+    left, right = left[connected], right[connected]
+    return xs[left], xs[right], signs[change][connected] < 0
+
+
+def _bisect(g, lo, hi):
+    """
+    Vectorized bisection of g on brackets [lo, hi]. Brackets where g itself
+    (not just its grid approximation) has no sign change are dropped.
+    """
+    if not len(lo):
+        return np.array([])
+    g_lo, g_hi = g(lo), g(hi)
+    valid = np.isfinite(g_lo) & np.isfinite(g_hi) & (np.sign(g_lo) != np.sign(g_hi))
+    lo, hi, g_lo = lo[valid], hi[valid], g_lo[valid]
+    for _ in range(SPECIAL_BISECT_STEPS):
+        mid = (lo + hi) / 2
+        g_mid = g(mid)
+        right_half = np.sign(g_mid) == np.sign(g_lo)
+        lo = np.where(right_half, mid, lo)
+        g_lo = np.where(right_half, g_mid, g_lo)
+        hi = np.where(right_half, hi, mid)
+    return (lo + hi) / 2
+
+
+def _clean(value: float) -> float:
+    """Round away bisection noise (2.9999999997 -> 3.0, -0.0 -> 0.0)"""
+    value = float(value)
+    rounded = round(value, 6)
+    if abs(rounded - round(rounded)) < 1e-9:
+        rounded = float(round(rounded))
+    return rounded + 0.0
+
+
+def search_window(x_min: float, x_max: float) -> tuple:
+    """x-range for find_special_points(): the model's range widened on both sides"""
+    pad = SPECIAL_SEARCH_WIDEN * (x_max - x_min)
+    return x_min - pad, x_max + pad
+
+
+def find_special_points(fn, x_min: float, x_max: float) -> list:
+    """
+    Roots, extrema and inflection points of ``fn`` on [x_min, x_max].
+
+    Sign changes of f, f' and f'' on a grid of SPECIAL_GRID_POINTS are
+    bracketed and refined by bisection (derivatives as central
+    differences). Brackets that converge to a pole are dropped; a double
+    root (extremum on the x-axis) is reported as root and extremum. At most
+    SPECIAL_MAX_PER_KIND points per kind, the ones closest to the middle.
+
+    Returns ``[{"x", "y", "kind", "label", "color"}, ...]`` sorted by x.
+    """
+    x_min, x_max = float(x_min), float(x_max)
+    x_span = x_max - x_min
+    xs = np.linspace(x_min, x_max, SPECIAL_GRID_POINTS)
+    ys = np.array(fn(xs), dtype=float)
+    finite = ys[np.isfinite(ys)]
+    if len(finite) < 3:
+        return []
+    y_scale = float(np.percentile(np.abs(finite), 90)) + 1e-12
+    low, high = np.percentile(finite, [2, 98])
+    y_spread = float(high - low) + 1e-12
+    delta = x_span * 1e-4
+    h1, h2 = x_span * 1e-7, x_span * 1e-5
+
+    def f(x):
+        return np.array(fn(x), dtype=float)
+
+    def d1(x):
+        return (f(x + h1) - f(x - h1)) / (2 * h1)
+
+    def d2(x):
+        return (f(x + h2) - 2 * f(x) + f(x - h2)) / (h2 * h2)
+
+    with np.errstate(all="ignore"):
+        grid_d1 = np.gradient(ys, xs)
+        grid_d2 = np.gradient(grid_d1, xs)
+
+    found = []
+
+    def continuous_at(x_values) -> np.ndarray:
+        """
+        False next to poles and jumps (where bisection also converges). The
+        window x ± delta covers the difference stencils, so a jump that only
+        the stencil straddled (floor(x) at x = 4.9998) is inside it too.
+        """
+        lo, hi = x_values - delta, x_values + delta
+        f_lo, f_hi = f(lo), f(hi)
+        jump = np.abs(f_hi - f_lo)
+        # Rand des Definitionsbereichs (z.B. sqrt bei 0) oder kaum Änderung -> stetig
+        edge = ~(np.isfinite(f_lo) & np.isfinite(f_hi))
+        flat = jump <= 1e-3 * y_spread
+        # Der Hälfte mit der größeren Änderung folgen: stetig -> die Änderung
+        # schrumpft mit dem Intervall, Sprung/Pol -> sie bleibt
+        pole = np.zeros(len(x_values), dtype=bool)
+        for _ in range(CONTINUITY_HALVINGS):
+            mid = (lo + hi) / 2
+            f_mid = f(mid)
+            pole |= ~np.isfinite(f_mid)
+            left = np.abs(f_mid - f_lo) >= np.abs(f_hi - f_mid)
+            hi, f_hi = np.where(left, mid, hi), np.where(left, f_mid, f_hi)
+            lo, f_lo = np.where(left, lo, mid), np.where(left, f_lo, f_mid)
+        return edge | flat | (~pole & (np.abs(f_hi - f_lo) < 0.5 * jump))
+
+    def add(kind: str, x_values):
+        x_values = np.asarray(x_values, dtype=float)
+        if not len(x_values):
+            return
+        y_values = f(x_values)
+        keep = np.isfinite(y_values) & continuous_at(x_values)
+        for x, y in zip(x_values[keep], y_values[keep]):
+            found.append((kind, float(x), float(y)))
+
+    # Nullstellen: Vorzeichenwechsel von f und exakte Nullen auf dem Gitter
+    lo, hi, _ = _sign_change_brackets(xs, ys, 0.0)
+    roots = [x for x in _bisect(f, lo, hi) if abs(f(np.array([x]))[0]) <= 1e-6 * y_scale]
+    # exakte Nullen nur einzeln (nicht auf konstanten Abschnitten wie floor(x))
+    zero = ys == 0
+    isolated = zero & ~np.r_[False, zero[:-1]] & ~np.r_[zero[1:], False]
+    add("root", roots + list(xs[isolated]))
+
+    # Extrema: Vorzeichenwechsel von f' (Minimum, wenn f' von - nach + wechselt)
+    lo, hi, _ = _sign_change_brackets(xs, grid_d1, 1e-9 * y_scale / x_span)
+    extrema = _bisect(d1, lo, hi)
+    if len(extrema):
+        rising = d1(extrema + x_span * 1e-4) > 0
+        add("minimum", extrema[rising])
+        add("maximum", extrema[~rising])
+        # Extremum auf der x-Achse = doppelte Nullstelle
+        add("root", [x for x in extrema if abs(f(np.array([x]))[0]) <= 1e-9 * y_scale])
+
+    # Wendepunkte: Vorzeichenwechsel von f''
+    lo, hi, _ = _sign_change_brackets(xs, grid_d2, 1e-6 * y_scale / x_span ** 2)
+    add("inflection", _bisect(d2, lo, hi))
+
+    points = []
+    center = (x_min + x_max) / 2
+    for kind in SPECIAL_LABELS:
+        same = sorted({_clean(x): y for k, x, y in found if k == kind}.items())
+        # Doppelt gefundene Punkte zusammenfassen
+        unique = []
+        for x, y in same:
+            if not unique or x - unique[-1][0] > 1e-6 * x_span:
+                unique.append((x, y))
+        unique = sorted(unique, key=lambda point: abs(point[0] - center))[:SPECIAL_MAX_PER_KIND]
+        for x, y in unique:
+            y = _clean(y)
+            label = SPECIAL_LABELS[kind]
+            label += f" x={x:.4g}" if kind == "root" else f" ({x:.4g}|{y:.4g})"
+            points.append({"x": x, "y": y, "kind": kind, "label": label, "color": SPECIAL_COLORS[kind]})
+    return sorted(points, key=lambda point: point["x"])
+
+
+def _nice_floor(value: float, step: float) -> float:
+    return float(np.floor(value / step) * step)
+
+
+def _nice_ceil(value: float, step: float) -> float:
+    return float(np.ceil(value / step) * step)
+
+
+def _nice_step(span: float) -> float:
+    """1, 2 or 5 times a power of ten, about a tenth of ``span``"""
+    raw = max(span, 1e-9) / 10
+    power = 10 ** np.floor(np.log10(raw))
+    for factor in (1, 2, 5, 10):
+        if raw <= factor * power:
+            return float(factor * power)
+    return float(10 * power)
+
+
+def fit_domain(fn, points: list, x_min: float, x_max: float) -> dict:
+    """
+    View fitted to the interesting region: x covers all special/given
+    points (``[(x, y), ...]``) with padding and the y-axis if it is near;
+    without points, or with more than FIT_MAX_POINTS (periodic curves),
+    the given x-range stays. y covers the 2nd-98th percentile of the curve
+    there (of all curves if ``fn`` is a list) plus the points inside.
+    Bounds are rounded to a 1/2/5 grid.
+    """
+    x_min, x_max = float(x_min), float(x_max)
+    if points and len(points) <= FIT_MAX_POINTS:
+        lo = min(x for x, _ in points)
+        hi = max(x for x, _ in points)
+        pad = max(2.0, 0.5 * (hi - lo))
+        lo, hi = lo - pad, hi + pad
+        # y-Achse mit ins Bild, wenn sie nicht weit weg ist
+        if 0 < lo <= hi - lo:
+            lo = -0.1 * (hi - lo)
+        elif -(hi - lo) <= hi < 0:
+            hi = 0.1 * (hi - lo)
+        x_min, x_max = lo, hi
+    step = _nice_step(x_max - x_min)
+    x_min, x_max = _nice_floor(x_min, step), _nice_ceil(x_max, step)
+
+    xs = np.linspace(x_min, x_max, 401)
+    functions = fn if isinstance(fn, (list, tuple)) else [fn]
+    ys = np.concatenate([np.array(f(xs), dtype=float) for f in functions])
+    values = list(ys[np.isfinite(ys)])
+    if values:
+        low, high = np.percentile(values, [2, 98])
+    else:
+        low, high = -10.0, 10.0
+    extra = [y for x, y in points if x_min <= x <= x_max and np.isfinite(y)]
+    low, high = min([low, *extra]), max([high, *extra])
+    # x-Achse mit ins Bild, wenn sie nicht weit weg ist
+    if 0 < low <= high - low:
+        low = 0.0
+    elif -(high - low) <= high < 0:
+        high = 0.0
+    pad = max(0.1 * (high - low), 1.0 if high == low else 0.0)
+    low, high = low - pad, high + pad
+    step = _nice_step(high - low)
+    return {
+        "xMin": x_min, "xMax": x_max,
+        "yMin": _nice_floor(low, step), "yMax": _nice_ceil(high, step),
+    }
+
+
+# ------------------------------
+# Implizite Kurven F(x, y) = 0
+# ------------------------------
+IMPLICIT_COARSE_CELLS = 48         # Zellen je Achse im Startgitter
+IMPLICIT_MAX_RESOLUTION = 4096     # feinste Zellen je Achse
+IMPLICIT_MAX_EVALUATIONS = 60000   # Auswertungen insgesamt (Gitter + Kanten)
+IMPLICIT_EDGE_STEPS = 6            # Bisektionsschritte je Kante mit Vorzeichenwechsel
+IMPLICIT_MAX_POINTS = 2000         # Punkte der ausgedünnten Polylinien insgesamt
+IMPLICIT_SIMPLIFY_TOLERANCE = 0.001
+
+
+def _straddles(corners):
+    """Cells (rows of 4 corner values) with both signs among their finite corners"""
+    finite = np.isfinite(corners)
+    return (finite & (corners > 0)).any(axis=1) & (finite & (corners <= 0)).any(axis=1)
+
+
+def _edge_roots(fn, x0, y0, x1, y1, a, b):
+    """
+    Zero on each edge ``(x0, y0)-(x1, y1)`` with values ``a``/``b`` of
+    opposite sign: IMPLICIT_EDGE_STEPS bisection steps, then linear
+    interpolation. Edges where |F| grows instead of shrinking (a pole, not
+    a root) are marked invalid. Returns ``(x, y, valid)``.
+    """
+    lo, hi = np.zeros(len(a)), np.ones(len(a))
+    f_lo, f_hi = a.copy(), b.copy()
+    for _ in range(IMPLICIT_EDGE_STEPS):
+        mid = (lo + hi) / 2
+        f_mid = np.array(fn(x0 + mid * (x1 - x0), y0 + mid * (y1 - y0)), dtype=float)
+        left = (f_mid > 0) == (f_lo > 0)
+        lo, f_lo = np.where(left, mid, lo), np.where(left, f_mid, f_lo)
+        hi, f_hi = np.where(left, hi, mid), np.where(left, f_hi, f_mid)
+    with np.errstate(all="ignore"):
+        t = lo + (hi - lo) * f_lo / (f_lo - f_hi)
+    t = np.where(np.isfinite(t), t, (lo + hi) / 2)
+    x, y = x0 + t * (x1 - x0), y0 + t * (y1 - y0)
+    at = np.array(fn(x, y), dtype=float)
+    valid = np.isfinite(at) & (np.abs(at) <= 0.5 * np.maximum(np.abs(a), np.abs(b)))
+    return x, y, valid
+
+
+def _cell_segments(J, I, corners, cells: int, to_x, to_y, fn):
+    """
+    Marching squares on the cells ``(J, I)`` of a ``cells`` x ``cells`` grid
+    (corners bottom-left, bottom-right, top-right, top-left). Returns the
+    segments as edge-id pairs and the crossing point of every edge id.
+    Saddles are resolved with the mean of the corners.
+    """
+    c0, c1, c2, c3 = corners.T
+    # Kanten unten, rechts, oben, links: (Wert a, Wert b, id, Zeile, Spalte, horizontal)
+    edges = (
+        (c0, c1, (J * (cells + 1) + I) * 2, J, I, True),
+        (c1, c2, (J * (cells + 1) + I + 1) * 2 + 1, J, I + 1, False),
+        (c3, c2, ((J + 1) * (cells + 1) + I) * 2, J + 1, I, True),
+        (c0, c3, (J * (cells + 1) + I) * 2 + 1, J, I, False),
+    )
+    mask = np.stack([np.isfinite(a) & np.isfinite(b) & ((a > 0) != (b > 0)) for a, b, *_ in edges])
+    ids = np.stack([edge_ids for _, _, edge_ids, *_ in edges])
+
+    # Jede Kante einmal auswerten (Nachbarzellen teilen sie)
+    rows = np.concatenate([row[m] for (_, _, _, row, _, _), m in zip(edges, mask)])
+    cols = np.concatenate([col[m] for (_, _, _, _, col, _), m in zip(edges, mask)])
+    horizontal = np.concatenate([np.full(m.sum(), h) for (*_, h), m in zip(edges, mask)])
+    a = np.concatenate([edge[0][m] for edge, m in zip(edges, mask)])
+    b = np.concatenate([edge[1][m] for edge, m in zip(edges, mask)])
+    edge_ids, first = np.unique(ids[mask], return_index=True)
+    rows, cols, horizontal, a, b = rows[first], cols[first], horizontal[first], a[first], b[first]
+    x, y, valid = _edge_roots(
+        fn, to_x(cols), to_y(rows), to_x(cols + horizontal), to_y(rows + ~horizontal), a, b,
+    )
+    points = dict(zip(edge_ids[valid].tolist(), zip(x[valid].tolist(), y[valid].tolist())))
+    # Pol-Kanten zählen nicht als Schnitt
+    mask &= np.isin(ids, edge_ids[valid])
+    count = mask.sum(axis=0)
+
+    pairs = []
+    two = count == 2
+    if two.any():
+        pairs.append(ids[:, two].T[mask[:, two].T].reshape(-1, 2))
+    four = np.nonzero(count == 4)[0]
+    if len(four):
+        bottom, right, top, left = ids[:, four]
+        # Mitte wie unten links: die beiden anderen Ecken abschneiden
+        same = (corners[four].mean(axis=1) > 0) == (c0[four] > 0)
+        pairs.append(np.stack([np.where(same, bottom, left), np.where(same, right, bottom)], axis=1))
+        pairs.append(np.stack([np.where(same, left, right), top], axis=1))
+    segments = np.concatenate(pairs) if pairs else np.zeros((0, 2), dtype=np.int64)
+    return segments, points
+
+
+def _chain(segments) -> list:
+    """Join ``(a, b)`` edge pairs into polylines (lists of edge ids)"""
+    neighbors = {}
+    for a, b in segments.tolist():
+        neighbors.setdefault(a, []).append(b)
+        neighbors.setdefault(b, []).append(a)
+
+    lines = []
+    visited = set()
+    # Zuerst offene Enden (ein Nachbar), dann geschlossene Schleifen
+    starts = [edge for edge, near in neighbors.items() if len(near) == 1] + list(neighbors)
+    for start in starts:
+        if start in visited:
+            continue
+        line = [start]
+        visited.add(start)
+        current = start
+        while True:
+            following = [edge for edge in neighbors[current] if edge not in visited]
+            if not following:
+                if len(line) > 2 and start in neighbors[current]:
+                    line.append(start)  # geschlossen
+                break
+            current = following[0]
+            visited.add(current)
+            line.append(current)
+        if len(line) > 1:
+            lines.append(line)
+    return lines
+
+
+def implicit_curve(fn, x_min: float, x_max: float, y_min: float, y_max: float) -> dict:
+    """
+    Polylines of the implicit curve ``fn(x, y) = 0`` (a CompiledExpression
+    over ("x", "y")) in the given view.
+
+    F is evaluated on a grid of IMPLICIT_COARSE_CELLS per axis. Cells
+    with a sign change are split into four, level by level, as long as
+    the next level fits into IMPLICIT_MAX_EVALUATIONS (and up to
+    IMPLICIT_MAX_RESOLUTION cells per axis); cells away from the curve
+    are never refined, so the cost depends on the curve length, not the
+    domain. Marching squares on the finest cells gives the contour, which
+    is joined into polylines and thinned with Ramer-Douglas-Peucker (more
+    coarsely if it exceeds IMPLICIT_MAX_POINTS). Closed loops smaller
+    than a start cell can be missed.
+
+    Returns ``{"segments": [(xs, ys), ...], "evaluations": n, "resolution": cells}``
+    (closed curves end with their first point).
+    """
+    x_min, x_max, y_min, y_max = float(x_min), float(x_max), float(y_min), float(y_max)
+    if not (x_max > x_min and y_max > y_min):
+        raise ValueError("empty view")
+    x_span, y_span = x_max - x_min, y_max - y_min
+
+    def evaluate(xs, ys):
+        return np.array(fn(xs, ys), dtype=float)
+
+    cells = IMPLICIT_COARSE_CELLS
+    grid = evaluate(np.linspace(x_min, x_max, cells + 1)[None, :], np.linspace(y_min, y_max, cells + 1)[:, None])
+    evaluations = grid.size
+    J, I = (index.ravel() for index in np.mgrid[0:cells, 0:cells])
+    corners = np.stack([grid[J, I], grid[J, I + 1], grid[J + 1, I + 1], grid[J + 1, I]], axis=1)
+    keep = _straddles(corners)
+    J, I, corners = J[keep], I[keep], corners[keep]
+
+    # Quadtree: alle aktiven Zellen einer Ebene gemeinsam teilen (5 neue Punkte je Zelle)
+    # (Kosten der nächsten Ebene: 5 Punkte je Zelle + Kantenbisektion für ~2 Kinder je Zelle)
+    edge_cost = 2 * (IMPLICIT_EDGE_STEPS + 1)
+    while (
+        len(J) and cells * 2 <= IMPLICIT_MAX_RESOLUTION
+        and evaluations + (5 + edge_cost) * len(J) <= IMPLICIT_MAX_EVALUATIONS
+    ):
+        cells *= 2
+        J, I = 2 * J, 2 * I
+        rows = np.concatenate([J, J + 1, J + 2, J + 1, J + 1])
+        cols = np.concatenate([I + 1, I + 2, I + 1, I, I + 1])
+        values = evaluate(x_min + cols * (x_span / cells), y_min + rows * (y_span / cells))
+        evaluations += len(values)
+        bottom, right, top, left, center = values.reshape(5, -1)
+        c0, c1, c2, c3 = corners.T
+        J = np.concatenate([J, J, J + 1, J + 1])
+        I = np.concatenate([I, I + 1, I + 1, I])
+        corners = np.concatenate([
+            np.stack([c0, bottom, center, left], axis=1),
+            np.stack([bottom, c1, right, center], axis=1),
+            np.stack([center, right, c2, top], axis=1),
+            np.stack([left, center, top, c3], axis=1),
+        ])
+        keep = _straddles(corners)
+        J, I, corners = J[keep], I[keep], corners[keep]
+
+    calls = [0]
+
+    def counted(xs, ys):
+        calls[0] += np.size(xs)
+        return evaluate(xs, ys)
+
+    pairs, points = _cell_segments(
+        J.astype(np.int64), I.astype(np.int64), corners, cells,
+        lambda col: x_min + col * (x_span / cells),
+        lambda row: y_min + row * (y_span / cells),
+        counted,
+    )
+    evaluations += calls[0]
+    lines = [np.array([points[edge] for edge in line]) for line in _chain(pairs)]
+
+    tolerance = IMPLICIT_SIMPLIFY_TOLERANCE
+    while True:
+        segments = []
+        for line in lines:
+            xs, ys = line[:, 0], line[:, 1]
+            if len(line) > 2:
+                kept = _simplify((xs - x_min) / x_span, (ys - y_min) / y_span, tolerance)
+                xs, ys = xs[kept], ys[kept]
+            segments.append((xs, ys))
+        if sum(len(xs) for xs, _ in segments) <= IMPLICIT_MAX_POINTS or tolerance > 0.05:
+            break
+        tolerance *= 2
+    return {"segments": segments, "evaluations": evaluations, "resolution": cells}
+
+
+def curve_view(segments: list, x_min: float, x_max: float, y_min: float, y_max: float) -> dict:
+    """
+    View around implicit-curve polylines (padded, rounded to a 1/2/5 grid,
+    axes included when near); the given view if there are no points.
+    """
+    xs = np.concatenate([seg_x for seg_x, _ in segments]) if segments else np.array([])
+    ys = np.concatenate([seg_y for _, seg_y in segments]) if segments else np.array([])
+    if not len(xs):
+        return {"xMin": x_min, "xMax": x_max, "yMin": y_min, "yMax": y_max}
+    view = {}
+    for axis, values in (("x", xs), ("y", ys)):
+        low, high = float(values.min()), float(values.max())
+        if 0 < low <= high - low:
+            low = 0.0
+        elif -(high - low) <= high < 0:
+            high = 0.0
+        pad = max(0.15 * (high - low), 1.0 if high == low else 0.0)
+        step = _nice_step(high - low + 2 * pad)
+        view[f"{axis}Min"] = _nice_floor(low - pad, step)
+        view[f"{axis}Max"] = _nice_ceil(high + pad, step)
+    return view
+
+
+IMPLICIT_ZOOM_ROUNDS = 3
+IMPLICIT_ZOOM_RATIO = 0.125        # Kurve kleiner als 1/8 der Ansicht -> heranzoomen
+
+
+IMPLICIT_EDGE_RATIO = 0.01         # Kurve bis an den Fensterrand -> unbeschränkt
+
+
+def _unbounded_axes(segments: list, view: dict) -> list:
+    """Axes along which the traced curve runs into the edge of ``view``"""
+    axes = []
+    for index, (low, high) in enumerate((("xMin", "xMax"), ("yMin", "yMax"))):
+        values = np.concatenate([segment[index] for segment in segments])
+        margin = IMPLICIT_EDGE_RATIO * (view[high] - view[low])
+        if values.min() <= view[low] + margin or values.max() >= view[high] - margin:
+            axes.append((low, high))
+    return axes
+
+
+def fit_implicit(fn, x_min: float, x_max: float, y_min: float, y_max: float,
+                 bounds: dict = None) -> tuple:
+    """
+    ``(view, implicit_curve() result)`` with the view fitted to the curve.
+    A curve much smaller than the search window (a circle of radius 3 in
+    a +-1000 window) is resolved coarsely, so it is traced again around
+    its rough extent, up to IMPLICIT_ZOOM_ROUNDS times. Along axes where
+    the curve leaves the search window (a parabola, y² = x³ - x) the view
+    keeps the range of ``bounds`` instead of the whole window.
+    """
+    view = {"xMin": x_min, "xMax": x_max, "yMin": y_min, "yMax": y_max}
+    result = implicit_curve(fn, x_min, x_max, y_min, y_max)
+    for _ in range(IMPLICIT_ZOOM_ROUNDS + 1):
+        fitted = curve_view(result["segments"], view["xMin"], view["xMax"], view["yMin"], view["yMax"])
+        if not result["segments"]:
+            return fitted, result
+        unbounded = _unbounded_axes(result["segments"], view)
+        small = all(
+            fitted[high] - fitted[low] < IMPLICIT_ZOOM_RATIO * (view[high] - view[low])
+            for low, high in (("xMin", "xMax"), ("yMin", "yMax"))
+        )
+        if unbounded and bounds:
+            # Nur den Teil der Kurve innerhalb von bounds (auf den unbeschränkten Achsen) einpassen
+            xs = np.concatenate([seg_x for seg_x, _ in result["segments"]])
+            ys = np.concatenate([seg_y for _, seg_y in result["segments"]])
+            inside = np.ones(len(xs), dtype=bool)
+            for values, (low, high) in ((xs, ("xMin", "xMax")), (ys, ("yMin", "yMax"))):
+                if (low, high) in unbounded:
+                    inside &= (values >= bounds[low]) & (values <= bounds[high])
+            if inside.any():
+                fitted = curve_view([(xs[inside], ys[inside])], x_min, x_max, y_min, y_max)
+            for low, high in unbounded:
+                fitted[low], fitted[high] = float(bounds[low]), float(bounds[high])
+            return fitted, result
+        if unbounded or not small or _ == IMPLICIT_ZOOM_ROUNDS:
+            return fitted, result
+        # Grob gefundene Kurve: Fenster um sie herum (achtfache Größe) neu abtasten
+        view = {}
+        for low, high in (("xMin", "xMax"), ("yMin", "yMax")):
+            center, half = (fitted[low] + fitted[high]) / 2, 4 * (fitted[high] - fitted[low])
+            view[low], view[high] = center - half, center + half
+        evaluations = result["evaluations"]
+        result = implicit_curve(fn, view["xMin"], view["xMax"], view["yMin"], view["yMax"])
+        result["evaluations"] += evaluations
+
+
+# ------------------------------
+# Schnittpunkte mehrerer Funktionen
+# ------------------------------
+INTERSECTION_COLOR = "#0ea5e9"
+
+
+def find_intersections(fns: list, names: list, x_min: float, x_max: float) -> list:
+    """
+    Intersections of every pair of explicit functions on [x_min, x_max]
+    (roots of the difference, touching points included), in the format of
+    find_special_points() with kind "intersection".
+    """
+    points = []
+    for a in range(len(fns)):
+        for b in range(a + 1, len(fns)):
+            f, g = fns[a], fns[b]
+
+            def difference(xs, f=f, g=g):
+                return np.array(f(xs), dtype=float) - np.array(g(xs), dtype=float)
+
+            for point in find_special_points(difference, x_min, x_max):
+                if point["kind"] != "root":
+                    continue
+                x = point["x"]
+                y = _clean(np.array(f(np.array([x])), dtype=float)[0])
+                if not np.isfinite(y):
+                    continue
+                points.append({
+                    "x": x, "y": y, "kind": "intersection",
+                    "label": f"Schnittpunkt {names[a]}/{names[b]} ({x:.4g}|{y:.4g})",
+                    "color": INTERSECTION_COLOR,
+                })
+    return sorted(points, key=lambda point: point["x"])
@@ -0,0 +1,270 @@
+# Datei: plot_payload.py
+"""
+Response formats for /plot.
+
+generate_plot() builds a format-neutral plot description (series as
+columnar x/y lists, view, labels, special points) that is cached as is.
+The response is derived from it per request:
+
+- legacy (default): ``plotData`` = the complete Chart.js config as a JSON
+  string, as older clients expect
+- compact: a JSON object with the columnar series (``encoding`` "json" or
+  "float32" = little-endian Float32 arrays in base64) that the client
+  merges into the Chart.js template from GET /plot-template
+
+Both formats produce the same chart (see chart_config()).
+"""
+import base64
+import copy
+import json
+
+import numpy as np
+
+TEMPLATE_VERSION = "1"
+PAYLOAD_FORMATS = ("legacy", "compact")
+PAYLOAD_ENCODINGS = ("json", "float32")
+
+_GRID = {"color": "rgba(0, 0, 0, 0.1)"}
+# Weitere Kurven in einem Diagramm (die erste hat die Template-Farbe)
+CURVE_COLORS = ["#2c5f8d", "#db2777", "#16a34a", "#ea580c"]
+
+
+def _axis() -> dict:
+    return {
+        "type": "linear",
+        "position": "center",
+        "title": {"display": True, "text": None},
+        "min": None,
+        "max": None,
+        "grid": dict(_GRID),
+    }
+
+
+# Chart.js-Gerüste; None-Felder füllt fill_template() aus dem Plot
+CHART_TEMPLATES = {
+    "function": {
+        "type": "scatter",
+        "options": {
+            "responsive": True,
+            "maintainAspectRatio": False,
+            "plugins": {
+                "title": {"display": True, "text": None, "font": {"size": 16, "weight": "bold"}},
+                "legend": {"display": True, "position": "top"},
+                "tooltip": {"enabled": True, "mode": "nearest", "intersect": False},
+            },
+            "scales": {"x": _axis(), "y": _axis()},
+            "interaction": {"mode": "nearest", "axis": "x", "intersect": False},
+        },
+        "datasets": {
+            "curve": {
+                "borderColor": "#2c5f8d",
+                "backgroundColor": "rgba(44, 95, 141, 0.1)",
+                "borderWidth": 2,
+                "pointRadius": 0,
+                "showLine": True,
+                "spanGaps": False,
+                "tension": 0,
+                "fill": False,
+            },
+            "special": {"pointRadius": 8, "pointHoverRadius": 10, "showLine": False},
+            "given": {
+                "borderColor": "#10b981",
+                "backgroundColor": "#10b981",
+                "pointRadius": 8,
+                "pointHoverRadius": 10,
+                "showLine": False,
+            },
+        },
+    },
+    "points": {
+        "type": "scatter",
+        "options": {
+            "responsive": True,
+            "maintainAspectRatio": False,
+            "plugins": {
+                "title": {"display": True, "text": None, "font": {"size": 16, "weight": "bold"}},
+                "tooltip": {"enabled": True, "callbacks": {}},
+            },
+            "scales": {"x": _axis(), "y": _axis()},
+        },
+        "datasets": {
+            "points": {
+                "borderColor": "#2c5f8d",
+                "backgroundColor": "#2c5f8d",
+                "pointRadius": 8,
+                "pointHoverRadius": 10,
+                "showLine": False,
+            },
+        },
+    },
+}
+
+
+def _number(value):
+    """float, or None for gaps (None/NaN) and anything that is not a number"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if value != value else value
+
+
+def _column(values) -> list:
+    return [_number(value) for value in values]
+
+
+def _curve_columns(segments: list) -> tuple:
+    """x/y columns of sampled pieces with a gap (x midway, y None) between them"""
+    xs, ys = [], []
+    for index, (seg_x, seg_y) in enumerate(segments):
+        if index:
+            xs.append((xs[-1] + float(seg_x[0])) / 2)
+            ys.append(None)
+        xs.extend(_column(seg_x))
+        ys.extend(_column(seg_y))
+    return xs, ys
+
+
+def function_plot(title: str, x_label: str, y_label: str, view: dict,
+                  curves: list, special_points: list, given_points: list) -> dict:
+    """
+    Format-neutral description of a function graph.
+
+    ``curves`` are ``[(label, segments), ...]`` with segments from
+    plot_engine.sample_function() or implicit_curve(); the first curve
+    uses the template color, further ones get a ``color`` from
+    CURVE_COLORS.
+    """
+    series = []
+    for index, (label, segments) in enumerate(curves):
+        xs, ys = _curve_columns(segments)
+        entry = {"role": "curve", "label": label, "x": xs, "y": ys}
+        if index:
+            entry["color"] = CURVE_COLORS[index % len(CURVE_COLORS)]
+        series.append(entry)
+    if special_points:
+        series.append({
+            "role": "special",
+            "label": "Besondere Punkte",
+            "x": [p["x"] for p in special_points],
+            "y": [p["y"] for p in special_points],
+            "colors": [p["color"] for p in special_points],
+        })
+    if given_points:
+        series.append({
+            "role": "given",
+            "label": "Gegebene Punkte",
+            "x": [p["x"] for p in given_points],
+            "y": [p["y"] for p in given_points],
+        })
+    return {
+        "template": "function",
+        "title": title,
+        "xLabel": x_label,
+        "yLabel": y_label,
+        "view": view,
+        "series": series,
+        "specialPoints": special_points,
+        "givenPoints": given_points,
+    }
+
+
+def points_plot(title: str, x_label: str, y_label: str, view: dict, points: list) -> dict:
+    """Format-neutral description of a plain point plot"""
+    return {
+        "template": "points",
+        "title": title,
+        "xLabel": x_label,
+        "yLabel": y_label,
+        "view": view,
+        "series": [{
+            "role": "points",
+            "label": title,
+            "x": [p.get("x") for p in points],
+            "y": [p.get("y") for p in points],
+        }],
+        "pointLabels": [p.get("label", f"P{i+1}") for i, p in enumerate(points)],
+    }
+
+
+def fill_template(template: dict, plot: dict) -> dict:
+    """Chart.js options of ``template`` with title, axis labels and view of ``plot``"""
+    options = copy.deepcopy(template["options"])
+    view = plot["view"]
+    options["plugins"]["title"]["text"] = plot["title"]
+    for axis, label, low, high in (("x", "xLabel", "xMin", "xMax"), ("y", "yLabel", "yMin", "yMax")):
+        scale = options["scales"][axis]
+        scale["title"]["text"] = plot[label]
+        scale["min"] = view[low]
+        scale["max"] = view[high]
+    return options
+
+
+def chart_config(plot: dict) -> dict:
+    """Complete Chart.js config (the legacy ``plotData``) for a plot description"""
+    template = CHART_TEMPLATES[plot["template"]]
+    datasets = []
+    for series in plot["series"]:
+        dataset = {
+            "label": series["label"],
+            "data": [{"x": x, "y": y} for x, y in zip(series["x"], series["y"])],
+            **template["datasets"][series["role"]],
+        }
+        if "colors" in series:
+            # Farbe je Punkt (Nullstelle, Extremum, Wendepunkt)
+            dataset["borderColor"] = series["colors"]
+            dataset["backgroundColor"] = series["colors"]
+        elif "color" in series:
+            dataset["borderColor"] = series["color"]
+            dataset["backgroundColor"] = series["color"]
+        datasets.append(dataset)
+
+    config = {"type": template["type"], "data": {"datasets": datasets}, "options": fill_template(template, plot)}
+    for key in ("specialPoints", "givenPoints", "pointLabels"):
+        if key in plot:
+            config[key] = plot[key]
+    return config
+
+
+def _round_column(values: list, span: float) -> list:
+    """Round to ~1e-6 of the view span (JSON digits the chart cannot show)"""
+    array = np.array([np.nan if value is None else value for value in _column(values)], dtype=float)
+    decimals = max(0, 6 - int(np.floor(np.log10(span)))) if span > 0 else 6
+    return _column(np.round(array, decimals))
+
+
+def _float32_column(values: list) -> str:
+    array = np.array([np.nan if value is None else value for value in _column(values)], dtype="<f4")
+    return base64.b64encode(array.tobytes()).decode("ascii")
+
+
+def compact_plot(plot: dict, encoding: str = "json") -> dict:
+    """Columnar ``plot`` for the compact format (gaps: null in JSON, NaN in float32)"""
+    view = plot["view"]
+    x_span = float(view["xMax"]) - float(view["xMin"])
+    y_span = float(view["yMax"]) - float(view["yMin"])
+    series = []
+    for entry in plot["series"]:
+        entry = dict(entry)
+        if encoding == "float32":
+            entry["x"], entry["y"] = _float32_column(entry["x"]), _float32_column(entry["y"])
+        else:
+            entry["x"], entry["y"] = _round_column(entry["x"], x_span), _round_column(entry["y"], y_span)
+        series.append(entry)
+    return {**plot, "series": series, "encoding": encoding, "templateVersion": TEMPLATE_VERSION}
+
+
+def plot_response(result: dict, payload_format: str = "legacy", encoding: str = "json") -> dict:
+    """
+    /plot response for a cached generate_plot() result. Results without a
+    plot (plottable: false) are returned unchanged.
+    """
+    if "plot" not in result:
+        return result
+    response = {key: value for key, value in result.items() if key != "plot"}
+    if payload_format == "compact":
+        response["format"] = "compact"
+        response["plot"] = compact_plot(result["plot"], encoding)
+    else:
+        response["plotData"] = json.dumps(chart_config(result["plot"]))
+    return response
@@ -0,0 +1,144 @@
+# Datei: raster_pool.py
+"""
+Process pool for CPU-bound PDF work (PyMuPDF rendering, JPEG encoding).
+
+Rendering a scanned page takes tens of milliseconds of pure CPU. Inline in
+an async handler that blocks the event loop, so a long scan would stall
+every /hint request on the same worker. RasterPool runs such functions in
+worker processes and keeps the number of submitted jobs bounded. If a worker
+dies (segfault in MuPDF, OOM kill) the pool is rebuilt and only the jobs
+that were in it are retried once.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class RasterPool:
+    """
+    Bounded ProcessPoolExecutor for module-level functions (see pdf_pages).
+
+    - ``workers``: worker processes (default: all cores)
+    - ``max_pending``: jobs handed to the executor at once; further callers
+      wait in ``run()`` so a 200-page upload cannot pile up results in memory
+
+        jpeg_bytes, info = await raster_pool.run(render_page, path, page_num)
+    """
+
+    def __init__(self, workers: int = None, max_pending: int = None):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.max_pending = max(self.workers, max_pending or self.workers * 4)
+        self._executor = None
+        self._semaphore = None
+        self._restart_lock = None
+
+        self.waiting = 0     # warten auf einen freien Platz
+        self.submitted = 0   # im Executor (laufend oder in dessen Queue)
+        self.completed = 0
+        self.failed = 0
+        self.restarts = 0
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # "spawn": Worker importieren nur pdf_pages, nicht main.py
+        # (gleiches Verhalten unter Linux und Windows)
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    def _ensure_started(self):
+        if self._executor is None:
+            self._executor = self._new_executor()
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+            self._restart_lock = asyncio.Lock()
+            print(f"[POOL] Started {self.workers} raster worker(s)")
+
+    async def run(self, fn, *args):
+        """Run ``fn(*args)`` in a worker process and await its result"""
+        self._ensure_started()
+        try:
+            try:
+                result = await self._attempt(fn, args)
+            except BrokenProcessPool as e:
+                print(f"[POOL] Worker died ({e}), retrying {getattr(fn, '__name__', fn)} once")
+                result = await self._attempt(fn, args)
+        except Exception:
+            self.failed += 1
+            raise
+        self.completed += 1
+        return result
+
+    async def _attempt(self, fn, args):
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        executor = self._executor
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException as e:
+            self._semaphore.release()
+            if isinstance(e, BrokenProcessPool):
+                await self._restart(executor)
+            raise
+
+        # Platz erst freigeben, wenn der Prozess-Job wirklich fertig ist -
+        # ein abgebrochener Request beendet den laufenden Job nicht
+        self.submitted += 1
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(lambda _: self._call_in_loop(loop, self._job_finished))
+        try:
+            return await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            await self._restart(executor)
+            raise
+
+    @staticmethod
+    def _call_in_loop(loop, callback):
+        try:
+            loop.call_soon_threadsafe(callback)
+        except RuntimeError:
+            # Event-Loop ist schon geschlossen (Shutdown)
+            pass
+
+    def _job_finished(self):
+        self.submitted -= 1
+        self._semaphore.release()
+
+    async def _restart(self, broken: ProcessPoolExecutor):
+        """Replace a broken executor once, however many jobs notice it"""
+        async with self._restart_lock:
+            if self._executor is not broken:
+                return
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._new_executor()
+            self.restarts += 1
+            print(f"[POOL] Restarted {self.workers} raster worker(s) after a crash")
+
+    def worker_pids(self) -> list:
+        """PIDs of the running worker processes (for memory sampling)"""
+        if self._executor is None:
+            return []
+        return list(getattr(self._executor, "_processes", None) or {})
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        running = min(self.submitted, self.workers)
+        return {
+            "workers": self.workers,
+            "maxPending": self.max_pending,
+            "running": running,
+            # Queue-Tiefe: Jobs, die auf einen Worker warten
+            "queueDepth": self.waiting + self.submitted - running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "restarts": self.restarts,
+        }
@@ -0,0 +1,389 @@
+# Datei: result_cache.py
+"""
+Bounded result caches for expensive LLM work.
+
+A cache keeps its hottest entries in memory (LRU) and can optionally mirror
+every entry as a small JSON file on disk, so results survive a restart.
+SingleFlight covers the gap before the first result exists: concurrent
+identical requests share one upstream call. StreamFlight does the same for
+streamed (SSE) responses.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+def content_hash(*parts) -> str:
+    """SHA-256 over bytes/str parts (separated, so ("ab", "c") != ("a", "bc"))"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def normalize_text(text: str) -> str:
+    """
+    Canonical form of a task text for cache keys.
+
+    NFC (not NFKC: "x²" and "x2" must stay different), unified line endings,
+    exotic spaces mapped to " ", runs of blanks collapsed, trailing blanks and
+    repeated empty lines removed.
+    """
+    text = unicodedata.normalize("NFC", text or "")
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    lines = []
+    for line in text.split("\n"):
+        line = "".join(" " if unicodedata.category(ch) == "Zs" or ch == "\t" else ch for ch in line)
+        line = " ".join(line.split())
+        if line or (lines and lines[-1]):
+            lines.append(line)
+    return "\n".join(lines).strip()
+
+
+class ResultCache:
+    """
+    LRU cache with an optional on-disk tier.
+
+    - ``max_entries``: memory tier size, least recently used entries are evicted
+    - ``disk_dir``: directory for the JSON tier (None = memory only)
+    - ``max_disk_entries``: disk tier size, oldest files are removed first
+    - ``ttl_seconds``: entries older than this count as misses (None = forever)
+
+    Async handlers use aget()/aset()/acontains(): the memory tier is answered
+    directly, file access (JSON load/dump, eviction) runs in a worker thread.
+    """
+
+    def __init__(self, name: str, max_entries: int = 256, disk_dir: str = None,
+                 max_disk_entries: int = 2048, ttl_seconds: float = None):
+        self.name = name
+        self.ttl_seconds = ttl_seconds if ttl_seconds and ttl_seconds > 0 else None
+        self.max_entries = max(1, max_entries)
+        self.max_disk_entries = max(1, max_disk_entries)
+        self.disk_dir = os.path.join(disk_dir, name) if disk_dir else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Schreibende Threads (aset) sollen nicht gleichzeitig aufräumen
+        self._evict_lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+        self._disk_count = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_count = sum(1 for f in os.listdir(self.disk_dir) if f.endswith(".json"))
+
+    # ------------------------------
+    # Lesen / Schreiben
+    # ------------------------------
+    def get(self, key: str, default=None):
+        value = self._get_memory(key)
+        if value is not _MISSING:
+            return value
+        return self._get_disk(key, default)
+
+    async def aget(self, key: str, default=None):
+        """get() without blocking the event loop on the disk tier"""
+        value = self._get_memory(key)
+        if value is not _MISSING:
+            return value
+        if not self.disk_dir:
+            return self._get_disk(key, default)
+        return await asyncio.to_thread(self._get_disk, key, default)
+
+    def _get_memory(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                return _MISSING
+            stored_at, value = entry
+            if not self._is_expired(stored_at):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+            self.expired += 1
+            return _MISSING
+
+    def _get_disk(self, key: str, default):
+        entry = self._read_disk(key)
+        if entry is not _MISSING:
+            stored_at, value = entry
+            if not self._is_expired(stored_at):
+                with self._lock:
+                    self.disk_hits += 1
+                    self._remember(key, value, stored_at)
+                return value
+            with self._lock:
+                self.expired += 1
+
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def __contains__(self, key: str) -> bool:
+        """Cheap presence check (no stats, no LRU update, disk entry not read)"""
+        if self._in_memory(key):
+            return True
+        return bool(self.disk_dir) and os.path.exists(self._path(key))
+
+    async def acontains(self, key: str) -> bool:
+        """``key in cache`` with the disk check in a worker thread"""
+        if self._in_memory(key):
+            return True
+        return bool(self.disk_dir) and await asyncio.to_thread(os.path.exists, self._path(key))
+
+    def _in_memory(self, key: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            return entry is not _MISSING and not self._is_expired(entry[0])
+
+    def set(self, key: str, value):
+        stored_at = time.time()
+        with self._lock:
+            self._remember(key, value, stored_at)
+        self._write_disk(key, value, stored_at)
+
+    async def aset(self, key: str, value):
+        """set() with the file write (and any disk eviction) in a worker thread"""
+        stored_at = time.time()
+        with self._lock:
+            self._remember(key, value, stored_at)
+        if self.disk_dir:
+            await asyncio.to_thread(self._write_disk, key, value, stored_at)
+
+    def _is_expired(self, stored_at: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - stored_at > self.ttl_seconds
+
+    def _remember(self, key: str, value, stored_at: float):
+        self._entries[key] = (stored_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    # ------------------------------
+    # Disk-Tier
+    # ------------------------------
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key: str):
+        if not self.disk_dir:
+            return _MISSING
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            os.utime(path)  # mtime = letzte Nutzung (für LRU auf Disk)
+            return float(data["storedAt"]), data["value"]
+        except FileNotFoundError:
+            return _MISSING
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"[CACHE] {self.name}: unreadable disk entry {key[:12]}: {e}")
+            return _MISSING
+
+    def _write_disk(self, key: str, value, stored_at: float):
+        if not self.disk_dir:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            existed = os.path.exists(path)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"storedAt": stored_at, "value": value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"[CACHE] {self.name}: could not write disk entry: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            if not existed:
+                self._disk_count += 1
+            over_limit = self._disk_count > self.max_disk_entries
+        if over_limit:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """Drop the least recently used files until the disk tier is 90% full"""
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            files = [
+                os.path.join(self.disk_dir, f)
+                for f in os.listdir(self.disk_dir) if f.endswith(".json")
+            ]
+            files.sort(key=lambda p: os.path.getmtime(p))
+            target = int(self.max_disk_entries * 0.9)
+            removed = 0
+            for path in files[:max(0, len(files) - target)]:
+                os.remove(path)
+                removed += 1
+            with self._lock:
+                self._disk_count = len(files) - removed
+                self.evictions += removed
+        except OSError as e:
+            print(f"[CACHE] {self.name}: disk eviction failed: {e}")
+        finally:
+            self._evict_lock.release()
+
+    # ------------------------------
+    # Statistik
+    # ------------------------------
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "maxEntries": self.max_entries,
+                "diskEntries": self._disk_count if self.disk_dir else None,
+                "hits": self.hits,
+                "diskHits": self.disk_hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "ttlSeconds": self.ttl_seconds,
+                "hitRate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            }
+
+
+class SingleFlight:
+    """
+    In-flight deduplication for async calls.
+
+    The first caller for a key starts ``factory()`` as a task; callers that
+    arrive while it runs await the same task instead of starting their own.
+    The task is shielded, so one disconnecting client does not cancel the
+    work for everybody else.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self._counters = {}
+
+    async def do(self, kind: str, key: str, factory):
+        counters = self._counters.setdefault(kind, {"calls": 0, "coalesced": 0})
+        flight_key = (kind, key)
+        task = self._inflight.get(flight_key)
+        if task is not None:
+            counters["coalesced"] += 1
+        else:
+            counters["calls"] += 1
+            task = asyncio.ensure_future(factory())
+            self._inflight[flight_key] = task
+            task.add_done_callback(lambda t: self._finished(flight_key, t))
+        return await asyncio.shield(task)
+
+    def _finished(self, flight_key, task):
+        if self._inflight.get(flight_key) is task:
+            del self._inflight[flight_key]
+        # Exception abholen, falls alle Wartenden abgebrochen haben
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        by_kind = {}
+        for kind, counters in self._counters.items():
+            by_kind[kind] = {
+                **counters,
+                "inFlight": sum(1 for k, _ in self._inflight if k == kind),
+            }
+        return {
+            "inFlight": len(self._inflight),
+            "coalesced": sum(c["coalesced"] for c in self._counters.values()),
+            "byKind": by_kind,
+        }
+
+
+class StreamFlight:
+    """
+    In-flight deduplication for streamed responses (SSE).
+
+    The first caller for a key starts ``produce()`` (an async iterator of
+    events) as a task; every caller - including ones that arrive while it
+    runs - gets all events produced so far replayed and then the live ones.
+    Like SingleFlight, the producer does not depend on any one client: a
+    disconnect only ends that client's iteration.
+    """
+
+    class _Flight:
+        def __init__(self):
+            self.events = []
+            self.done = False
+            self.error = None
+            self.changed = asyncio.Event()
+            self.task = None
+
+        def publish(self):
+            changed, self.changed = self.changed, asyncio.Event()
+            changed.set()
+
+    def __init__(self):
+        self._inflight = {}
+        self._counters = {}
+
+    async def stream(self, kind: str, key: str, produce):
+        counters = self._counters.setdefault(kind, {"calls": 0, "coalesced": 0})
+        flight_key = (kind, key)
+        flight = self._inflight.get(flight_key)
+        if flight is not None:
+            counters["coalesced"] += 1
+        else:
+            counters["calls"] += 1
+            flight = self._Flight()
+            self._inflight[flight_key] = flight
+            flight.task = asyncio.ensure_future(self._run(flight_key, flight, produce))
+
+        index = 0
+        while True:
+            while index < len(flight.events):
+                yield flight.events[index]
+                index += 1
+            if flight.done:
+                break
+            await flight.changed.wait()
+        if flight.error is not None:
+            raise flight.error
+
+    async def _run(self, flight_key, flight, produce):
+        try:
+            async for event in produce():
+                flight.events.append(event)
+                flight.publish()
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            if self._inflight.get(flight_key) is flight:
+                del self._inflight[flight_key]
+            flight.publish()
+
+    def stats(self) -> dict:
+        by_kind = {}
+        for kind, counters in self._counters.items():
+            by_kind[kind] = {
+                **counters,
+                "inFlight": sum(1 for k, _ in self._inflight if k == kind),
+            }
+        return {
+            "inFlight": len(self._inflight),
+            "coalesced": sum(c["coalesced"] for c in self._counters.values()),
+            "byKind": by_kind,
+        }
@@ -0,0 +1,436 @@
+# Datei: session_store.py
+"""
+Session and assessment log in an embedded SQLite database.
+
+/log-session and /log-assessment used to load the whole Excel workbook,
+append one row and save it again - seconds per call once a school year of
+sessions has been logged. The database (WAL mode) is now the system of
+record: an insert is one short transaction, session and assessment
+lookups by Session-ID go through an index. The Excel files are generated
+from it on demand (export_excel), with the same sheets, headers and column
+order as before.
+
+Existing workbooks are imported with
+
+    python session_store.py migrate --excel Clarity_Coach_Session_Log.xlsx --db sessions.db
+
+(main.py does the same on startup when the database is still empty).
+Columns are matched by header, so files with the old underscore headers
+("Hints_Genutzt", "Sitzungsdauer_Minuten") are read as well.
+"""
+import argparse
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+
+SCHEMA_VERSION = 1
+
+# (Spalte, Excel-Überschrift, SQLite-Typ, Spaltenbreite) - Reihenfolge = Excel-Spalten
+SESSION_COLUMNS = [
+    ("session_id", "Session-ID", "TEXT", 12),
+    ("datum", "Datum", "TEXT", 12),
+    ("uhrzeit", "Uhrzeit", "TEXT", 10),
+    ("benutzer_name", "Benutzer Name", "TEXT", 18),
+    ("klasse", "Klasse", "TEXT", 10),
+    ("schule", "Schule", "TEXT", 20),
+    ("fach", "Fach", "TEXT", 15),
+    ("thema", "Thema", "TEXT", 25),
+    ("aufgabentyp", "Aufgabentyp", "TEXT", 18),
+    ("schwierigkeitsgrad", "Schwierigkeitsgrad", "TEXT", 16),
+    ("datei_name", "Datei Name", "TEXT", 20),
+    ("datei_typ", "Datei Typ", "TEXT", 12),
+    ("anzahl_aufgaben", "Anzahl Aufgaben", "INTEGER", 15),
+    ("anzahl_teilaufgaben", "Anzahl Teilaufgaben", "INTEGER", 18),
+    ("visualisierungen_genutzt", "Visualisierungen Genutzt", "INTEGER", 20),
+    ("animationen_genutzt", "Animationen Genutzt", "INTEGER", 20),
+    ("grafiken_genutzt", "Grafiken Genutzt", "INTEGER", 18),
+    ("hints_genutzt", "Hilfestellungen Genutzt", "INTEGER", 20),
+    ("ansatzpruefungen_genutzt", "Ansatzprüfungen Genutzt", "INTEGER", 22),
+    ("selbststaendigkeits_score", "Selbstständigkeits Score", "INTEGER", 22),
+    ("feedback", "Feedback", "TEXT", 15),
+    ("sitzungsdauer_minuten", "Sitzungsdauer (Minuten)", "REAL", 22),
+    ("notizen", "Notizen", "TEXT", 30),
+]
+
+ASSESSMENT_COLUMNS = [
+    ("session_id", "Session-ID", "TEXT", 15),
+    ("datum", "Date (DD.MM.YYYY)", "TEXT", 16),
+    ("student_id", "Student-ID", "TEXT", 18),
+    ("grade", "Grade", "TEXT", 18),
+    ("topic_area", "Topic Area", "TEXT", 25),
+    ("topic_detail", "Topic Detail", "TEXT", 25),
+    ("topic_complexity", "Topic Complexity (1-5)", "INTEGER", 18),
+    ("ai_question_quality", "AI Question Quality (1-5)", "INTEGER", 18),
+    ("prompt_strategy", "Prompt Strategy", "TEXT", 40),
+    ("tutor_interventions", "Tutor Interventions", "INTEGER", 18),
+    ("student_override", "Student Override (Yes/No)", "TEXT", 18),
+    ("learner_type_indicator", "Learner Type Indicator", "TEXT", 25),
+    ("understanding_progress", "Understanding Progress (1-5)", "INTEGER", 18),
+    ("linguistic_neutrality_check", "Linguistic Neutrality Check (Yes/No)", "TEXT", 18),
+    ("engagement_level", "Engagement Level (1-5)", "INTEGER", 18),
+    ("evaluative_language_check", "Evaluative Language Check (Yes/No)", "TEXT", 18),
+    ("student_feedback_safety", "Student Feedback Safety (Yes/No/Unclear)", "TEXT", 18),
+    ("question_loops", "Question Loops", "INTEGER", 18),
+    ("efficiency_score", "Efficiency Score (1-5)", "INTEGER", 18),
+    ("remarks", "Remarks", "TEXT", 40),
+    ("further_considerations", "Further Considerations", "TEXT", 40),
+]
+
+SESSION_SHEET = "Session_Log"
+ASSESSMENT_SHEET = "Assessment_Log"
+
+# Überschriften älterer Vorlagen, die sich nicht schon durch _header_key angleichen
+_HEADER_ALIASES = {"hintsgenutzt": "hints_genutzt"}
+
+
+def _schema(table: str, columns: list) -> str:
+    fields = ",\n    ".join(f"{name} {sql_type}" for name, _, sql_type, _ in columns)
+    return f"""CREATE TABLE IF NOT EXISTS {table} (
+    id INTEGER PRIMARY KEY,
+    created_at TEXT,
+    {fields}
+)"""
+
+
+_INDEXES = [
+    # Session-ID: Zuordnung Bewertung -> Sitzung, Doppelte Bewertungen
+    "CREATE INDEX IF NOT EXISTS idx_sessions_session_id ON sessions (session_id)",
+    "CREATE INDEX IF NOT EXISTS idx_sessions_benutzer ON sessions (benutzer_name, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_sessions_klasse ON sessions (klasse, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_sessions_created_at ON sessions (created_at)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_assessments_session_id ON assessments (session_id)",
+    "CREATE INDEX IF NOT EXISTS idx_assessments_student ON assessments (student_id)",
+]
+
+
+def _header_key(header) -> str:
+    """"Ansatzprüfungen Genutzt" and "Ansatzpruefungen_Genutzt" -> "ansatzpruefungengenutzt" """
+    text = str(header or "").lower()
+    for umlaut, plain in (("ä", "ae"), ("ö", "oe"), ("ü", "ue"), ("ß", "ss")):
+        text = text.replace(umlaut, plain)
+    return re.sub(r"[^a-z0-9]", "", text)
+
+
+def _created_at(datum, uhrzeit) -> str:
+    """ISO timestamp from the Excel date/time cells (str or datetime), or None"""
+    if isinstance(datum, datetime):
+        datum = datum.strftime("%d.%m.%Y")
+    text = f"{datum or ''} {uhrzeit or '00:00:00'}".strip()
+    for pattern in ("%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M"):
+        try:
+            return datetime.strptime(text, pattern).isoformat(timespec="seconds")
+        except ValueError:
+            continue
+    return None
+
+
+class SessionStore:
+    """
+    Session_Log and Assessment_Log as SQLite tables (one row per session /
+    assessment, columns as in SESSION_COLUMNS / ASSESSMENT_COLUMNS).
+
+    One connection in WAL mode with ``synchronous=NORMAL``: a commit is an
+    append to the WAL file, readers never block the writer. Calls are
+    serialized by a lock; they are short, so callers may run them in a
+    worker thread (asyncio.to_thread).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(_schema("sessions", SESSION_COLUMNS))
+            self._db.execute(_schema("assessments", ASSESSMENT_COLUMNS))
+            for statement in _INDEXES:
+                self._db.execute(statement)
+            self._db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # ------------------------------
+    # Sitzungen
+    # ------------------------------
+    def add_session(self, values: dict, now: datetime = None) -> tuple:
+        """
+        Insert a session; ``values`` are the SESSION_COLUMNS without
+        session_id/datum/uhrzeit. Returns ``(session_id, row)`` with the
+        Session-ID "YYYYMMDD-###" (### = running number of the session) and
+        the row the session has in the Excel export.
+        """
+        now = now or datetime.now()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                number = self._db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM sessions").fetchone()[0]
+                session_id = f"{now.strftime('%Y%m%d')}-{number:03d}"
+                row = {
+                    **values,
+                    "session_id": session_id,
+                    "datum": now.strftime("%d.%m.%Y"),
+                    "uhrzeit": now.strftime("%H:%M:%S"),
+                }
+                self._insert("sessions", SESSION_COLUMNS, row, now.isoformat(timespec="seconds"), number)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return session_id, number + 1
+
+    def session(self, session_id: str) -> dict:
+        """Session with this Session-ID (the first one if an import had duplicates), or None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT * FROM sessions WHERE session_id = ? ORDER BY id LIMIT 1", (session_id,)
+            ).fetchone()
+        return self._public(row, SESSION_COLUMNS) if row else None
+
+    def sessions(self, benutzer_name: str = None, klasse: str = None, since: str = None,
+                 limit: int = None) -> list:
+        """Sessions in log order, optionally by user, class and ISO date (``since``)"""
+        conditions, params = [], []
+        for column, value in (("benutzer_name", benutzer_name), ("klasse", klasse)):
+            if value:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if since:
+            conditions.append("created_at >= ?")
+            params.append(since)
+        query = "SELECT * FROM sessions"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY id"
+        if limit:
+            query += " LIMIT ?"
+            params.append(int(limit))
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return [self._public(row, SESSION_COLUMNS) for row in rows]
+
+    # ------------------------------
+    # Bewertungen
+    # ------------------------------
+    def add_assessment(self, values: dict, now: datetime = None) -> int:
+        """
+        Insert an assessment (ASSESSMENT_COLUMNS). Returns its row in the
+        Excel export, or None if the session already has an assessment.
+        """
+        now = now or datetime.now()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if self._db.execute(
+                    "SELECT 1 FROM assessments WHERE session_id = ?", (values["session_id"],)
+                ).fetchone():
+                    self._db.execute("ROLLBACK")
+                    return None
+                number = self._db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM assessments").fetchone()[0]
+                self._insert("assessments", ASSESSMENT_COLUMNS, values, now.isoformat(timespec="seconds"), number)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return number + 1
+
+    def has_assessment(self, session_id: str) -> bool:
+        with self._lock:
+            return self._db.execute(
+                "SELECT 1 FROM assessments WHERE session_id = ?", (session_id,)
+            ).fetchone() is not None
+
+    def assessments(self) -> list:
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM assessments ORDER BY id").fetchall()
+        return [self._public(row, ASSESSMENT_COLUMNS) for row in rows]
+
+    def counts(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0],
+                "assessments": self._db.execute("SELECT COUNT(*) FROM assessments").fetchone()[0],
+            }
+
+    def import_rows(self, sessions: list, assessments: list) -> dict:
+        """
+        Append imported rows (dicts by column name) in one transaction.
+        Assessments for a Session-ID that already has one are skipped (the
+        former /log-assessment rejected them as well).
+        """
+        report = {"sessions": 0, "assessments": 0, "skippedAssessments": 0}
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for row in sessions:
+                    self._insert("sessions", SESSION_COLUMNS, row, _created_at(row.get("datum"), row.get("uhrzeit")))
+                    report["sessions"] += 1
+                for row in assessments:
+                    if self._db.execute(
+                        "SELECT 1 FROM assessments WHERE session_id = ?", (row.get("session_id"),)
+                    ).fetchone():
+                        report["skippedAssessments"] += 1
+                        continue
+                    self._insert("assessments", ASSESSMENT_COLUMNS, row, _created_at(row.get("datum"), None))
+                    report["assessments"] += 1
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return report
+
+    # ------------------------------
+    # Intern
+    # ------------------------------
+    def _insert(self, table: str, columns: list, values: dict, created_at: str, row_id: int = None):
+        names = ["id", "created_at"] + [name for name, _, _, _ in columns]
+        params = [row_id, created_at] + [values.get(name) for name, _, _, _ in columns]
+        self._db.execute(
+            f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})", params
+        )
+
+    @staticmethod
+    def _public(row, columns: list) -> dict:
+        return {name: row[name] for name, _, _, _ in columns}
+
+
+# ------------------------------
+# Excel-Export
+# ------------------------------
+def _write_sheet(ws, columns: list, rows: list, header_color: str):
+    from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+    from openpyxl.utils import get_column_letter
+
+    border = Border(left=Side(style="thin"), right=Side(style="thin"),
+                    top=Side(style="thin"), bottom=Side(style="thin"))
+    header_font = Font(bold=True, color="FFFFFF", size=11)
+    header_fill = PatternFill(start_color=header_color, end_color=header_color, fill_type="solid")
+
+    ws.append([header for _, header, _, _ in columns])
+    for col_num, (_, _, _, width) in enumerate(columns, 1):
+        cell = ws.cell(row=1, column=col_num)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
+        cell.border = border
+        ws.column_dimensions[get_column_letter(col_num)].width = width
+
+    alignment = Alignment(horizontal="left", vertical="center", wrap_text=True)
+    for row in rows:
+        ws.append([row[name] for name, _, _, _ in columns])
+        for cell in ws[ws.max_row]:
+            cell.border = border
+            cell.alignment = alignment
+
+    ws.row_dimensions[1].height = 30
+    ws.freeze_panes = "A2"
+
+
+def export_excel(store: SessionStore, path: str, sheets=(SESSION_SHEET, ASSESSMENT_SHEET)) -> dict:
+    """
+    Write the log as an .xlsx file (same sheets, headers and column order
+    as the former Excel log). Returns the row count per sheet.
+    """
+    from openpyxl import Workbook
+
+    tables = {
+        SESSION_SHEET: (SESSION_COLUMNS, store.sessions, "1E3A5F"),
+        ASSESSMENT_SHEET: (ASSESSMENT_COLUMNS, store.assessments, "2C5F8D"),
+    }
+    wb = Workbook()
+    wb.remove(wb.active)
+    counts = {}
+    for sheet in sheets:
+        columns, read_rows, header_color = tables[sheet]
+        rows = read_rows()
+        _write_sheet(wb.create_sheet(sheet), columns, rows, header_color)
+        counts[sheet] = len(rows)
+    wb.save(path)
+    wb.close()
+    return counts
+
+
+# ------------------------------
+# Migration aus dem Excel-Log
+# ------------------------------
+def _sheet_rows(ws, columns: list) -> list:
+    """Data rows of a sheet as dicts, columns matched by header (fallback: position)"""
+    by_key = {_header_key(header): name for name, header, _, _ in columns}
+    by_key.update({_header_key(name): name for name, _, _, _ in columns})
+    by_key.update(_HEADER_ALIASES)
+    rows = ws.iter_rows(values_only=True)
+    headers = next(rows, ())
+    names = []
+    for index, header in enumerate(headers):
+        name = by_key.get(_header_key(header))
+        if name is None and header is None and index < len(columns):
+            name = columns[index][0]
+        names.append(name)
+
+    # Leere Zellen liest openpyxl als None; Textspalten bekommen "" wie beim Loggen
+    text_columns = [name for name, _, sqlite_type, _ in columns if sqlite_type == "TEXT"]
+    result = []
+    for values in rows:
+        if all(value is None or str(value).strip() == "" for value in values):
+            continue
+        row = {name: value for name, value in zip(names, values) if name}
+        for name in text_columns:
+            if row.get(name) is None:
+                row[name] = ""
+        result.append(row)
+    return result
+
+
+def import_excel(store: SessionStore, path: str) -> dict:
+    """Import the Session_Log and Assessment_Log sheets of an Excel log in row order"""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        sessions = _sheet_rows(wb[SESSION_SHEET], SESSION_COLUMNS) if SESSION_SHEET in wb.sheetnames else []
+        assessments = (
+            _sheet_rows(wb[ASSESSMENT_SHEET], ASSESSMENT_COLUMNS) if ASSESSMENT_SHEET in wb.sheetnames else []
+        )
+    finally:
+        wb.close()
+    return store.import_rows(sessions, assessments)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clarity Coach session log (SQLite)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    migrate = sub.add_parser("migrate", help="Import Session_Log/Assessment_Log from an Excel log")
+    migrate.add_argument("--excel", required=True)
+    migrate.add_argument("--db", default=os.getenv("SESSION_DB_PATH"), required=not os.getenv("SESSION_DB_PATH"))
+    migrate.add_argument("--force", action="store_true", help="Import even if the database is not empty")
+
+    export = sub.add_parser("export", help="Write the log as an Excel file")
+    export.add_argument("--db", default=os.getenv("SESSION_DB_PATH"), required=not os.getenv("SESSION_DB_PATH"))
+    export.add_argument("--excel", required=True)
+
+    args = parser.parse_args()
+    store = SessionStore(args.db)
+    try:
+        if args.command == "migrate":
+            counts = store.counts()
+            if (counts["sessions"] or counts["assessments"]) and not args.force:
+                parser.error(f"{args.db} already contains {counts} - use --force to import anyway")
+            report = import_excel(store, args.excel)
+            print(f"[MIGRATE] {args.excel} -> {args.db}: {report}")
+        elif args.command == "export":
+            counts = export_excel(store, args.excel)
+            print(f"[EXPORT] {args.db} -> {args.excel}: {counts}")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
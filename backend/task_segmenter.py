@@ -0,0 +1,218 @@
+# Datei: task_segmenter.py
+"""
+Locates task boundaries ("1.", "2)", "Aufgabe 3") and subtasks ("a)", "b)")
+in OCR text.
+
+Used to split long worksheets into chunks that can be analyzed in parallel,
+and to pre-split a text into tasks/subtasks so the model only has to add
+topic, difficulty and questions (segment_tasks). Only a consecutively
+numbered line start counts as a new task. A numbered list inside a task
+("1. Schritt", "2. Schritt", restarting at 1) is skipped up to where the
+numbering breaks; if the list could also be the next tasks, segment_tasks
+leaves the structure to the model. Subtasks likewise have to run a), b),
+c), ... without gaps. Letters in formulas ("(x - a)(x - b)")
+are not markers: mid-line markers need a sentence end before them, and a
+marker after an operator or inside an open parenthesis is ignored.
+"""
+import re
+
+# "1.", "2)", "3 .", "Aufgabe 4", "Aufgabe 5:", "Nr. 6" am Zeilenanfang
+TASK_START_RE = re.compile(
+    r"^[ \t]*(?:(?:Aufgabe|Aufg\.|Nr\.)[ \t]*(\d{1,2})\b[.:)]?|(\d{1,2})[ \t]*[.)](?=[ \t]|$))",
+    re.MULTILINE | re.IGNORECASE,
+)
+
+# "a)", "(b)" am Zeilenanfang oder nach einem Satzende ("... = 0. b) ..."),
+# "c." nur am Zeilenanfang
+SUBTASK_START_RE = re.compile(
+    r"(?:^[ \t]*|(?<=[.!?:;])[ \t]+)\(?([a-z])\)|^[ \t]*([a-z])\.(?=[ \t])",
+    re.MULTILINE,
+)
+
+# Vor einem echten Marker steht kein Rechenzeichen ("x -\na)" ist eine Formel)
+FORMULA_OPERATORS = set("+-*/=<>^·×÷−(,")
+
+
+def _task_matches(text: str) -> tuple:
+    """
+    ``([(start, end, number), ...], ambiguous)`` of the accepted task markers.
+
+    ``ambiguous`` is True if an inner list restarting at 1 runs into the
+    expected task number without a break, e.g. "1. ... 1. Schritt 2. ..."
+    (step 2 or task 2?).
+    """
+    candidates = [
+        (match.start(), match.end(), int(match.group(1) or match.group(2)))
+        for match in TASK_START_RE.finditer(text or "")
+    ]
+    matches = []
+    expected = None
+    ambiguous = False
+    index = 0
+    while index < len(candidates):
+        start, end, number = candidates[index]
+        if expected is None or number == expected:
+            matches.append((start, end, number))
+            expected = number + 1
+        elif number == 1 and matches:
+            # Innere Aufzählung: durchgehende Folge 1, 2, 3, ... überspringen
+            run_end = index + 1
+            while run_end < len(candidates) and candidates[run_end][2] == candidates[run_end - 1][2] + 1:
+                run_end += 1
+            # Enthält die Folge die nächste Aufgabennummer, entscheidet erst
+            # ein Bruch genau bei dieser Nummer ("1. 2. | 2.")
+            if candidates[run_end - 1][2] >= expected and not (
+                run_end < len(candidates) and candidates[run_end][2] == expected
+            ):
+                ambiguous = True
+            index = run_end
+            continue
+        index += 1
+    return matches, ambiguous
+
+
+def find_task_starts(text: str) -> list:
+    """
+    ``[(offset, number), ...]`` for every line that starts the next task.
+
+    The first task may have any number (worksheets continuing at 5); after
+    that only ``previous + 1`` is accepted.
+    """
+    return [(start, number) for start, _, number in _task_matches(text)[0]]
+
+
+def split_task_chunks(text: str, target_chars: int, max_chunks: int) -> list:
+    """
+    Split ``text`` at task boundaries into chunks of roughly ``target_chars``.
+
+    Returns ``[(chunk_text, [task numbers as str]), ...]`` in document order.
+    Text before the first task stays with the first chunk. A single task is
+    never split. Returns one chunk (the whole text) when no boundaries are
+    found.
+    """
+    starts = find_task_starts(text)
+    if len(starts) < 2:
+        return [(text, [str(number) for _, number in starts])]
+
+    # Abschnitte je Aufgabe (Vorspann gehört zur ersten)
+    sections = []
+    for index, (offset, number) in enumerate(starts):
+        begin = 0 if index == 0 else offset
+        end = starts[index + 1][0] if index + 1 < len(starts) else len(text)
+        sections.append((text[begin:end], str(number)))
+
+    # Bei zu vielen Abschnitten das Ziel vergrößern statt mehr Chunks zu bilden
+    target_chars = max(target_chars, len(text) // max(1, max_chunks) + 1)
+
+    chunks = []
+    current_text, current_numbers = "", []
+    for section_text, number in sections:
+        if current_numbers and len(current_text) + len(section_text) > target_chars:
+            chunks.append((current_text, current_numbers))
+            current_text, current_numbers = "", []
+        current_text += section_text
+        current_numbers.append(number)
+    if current_numbers:
+        chunks.append((current_text, current_numbers))
+
+    # Grenzfall: Rundung kann einen Chunk zu viel ergeben -> letzte zusammenlegen
+    while len(chunks) > max(1, max_chunks):
+        last_text, last_numbers = chunks.pop()
+        prev_text, prev_numbers = chunks.pop()
+        chunks.append((prev_text + last_text, prev_numbers + last_numbers))
+    return chunks
+
+
+def _paren_depth(text: str) -> int:
+    """Open "(" minus ")", or -1 as soon as a ")" has no opening partner"""
+    depth = 0
+    for char in text:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth < 0:
+                return -1
+    return depth
+
+
+def _in_formula(text: str, start: int, since: int) -> bool:
+    """True if a marker at ``start`` follows an operator or an unclosed "(" """
+    before = text[since:start].rstrip()
+    if before and before[-1] in FORMULA_OPERATORS:
+        return True
+    return _paren_depth(before) > 0
+
+
+def _subtask_matches(text: str) -> list:
+    """``[(start, end, label), ...]`` for a), b), c), ... in order"""
+    matches = []
+    expected = "a"
+    since = 0
+    for match in SUBTASK_START_RE.finditer(text):
+        label = match.group(1) or match.group(2)
+        if label == expected and not _in_formula(text, match.start(), since):
+            matches.append((match.start(), match.end(), label))
+            expected = chr(ord(label) + 1)
+            since = match.end()
+    return matches
+
+
+def _balanced(segments: dict) -> bool:
+    """All task and subtask texts close their parentheses"""
+    texts = [segments["preamble"]]
+    for task in segments["tasks"]:
+        texts.append(task["task"])
+        texts.extend(subtask["task"] for subtask in task["subtasks"])
+    return all(_paren_depth(text) == 0 for text in texts)
+
+
+def _split_subtasks(body: str) -> dict:
+    """Task text and subtasks of one task body (marker already removed)"""
+    matches = _subtask_matches(body)
+    if not matches:
+        # Ohne Teilaufgaben: die Aufgabe selbst ist die einzige Teilaufgabe "a"
+        text = body.strip()
+        return {"task": text, "subtasks": [{"label": "a", "task": text}]}
+
+    subtasks = []
+    for index, (_, end, label) in enumerate(matches):
+        stop = matches[index + 1][0] if index + 1 < len(matches) else len(body)
+        subtasks.append({"label": label, "task": body[end:stop].strip()})
+    return {"task": body[:matches[0][0]].strip(), "subtasks": subtasks}
+
+
+def segment_tasks(text: str):
+    """
+    Deterministic task/subtask structure of ``text``, or None if it has no
+    recognizable markers (then the model has to find the structure).
+
+        {
+          "preamble": "Text vor der ersten Aufgabe",
+          "tasks": [
+            {"number": "1", "task": "Löse die Gleichungen.",
+             "subtasks": [{"label": "a", "task": "x^3 - 27 = 0"}, ...]},
+            ...
+          ]
+        }
+
+    Text without task numbers but with a), b), ... becomes task "1". If a
+    piece ends up with unbalanced parentheses the split probably cut through
+    a formula, and an inner numbered list may hide where the next task
+    starts; in both cases None is returned and the model gets the whole text.
+    """
+    text = text or ""
+    matches, ambiguous = _task_matches(text)
+    if ambiguous:
+        return None
+    if not matches:
+        if not _subtask_matches(text):
+            return None
+        segments = {"preamble": "", "tasks": [{"number": "1", **_split_subtasks(text)}]}
+    else:
+        tasks = []
+        for index, (_, end, number) in enumerate(matches):
+            stop = matches[index + 1][0] if index + 1 < len(matches) else len(text)
+            tasks.append({"number": str(number), **_split_subtasks(text[end:stop])})
+        segments = {"preamble": text[:matches[0][0]].strip(), "tasks": tasks}
+    return segments if _balanced(segments) else None
@@ -0,0 +1,120 @@
+/**
+ * Plot Payload Service
+ *
+ * Turns /plot responses into Chart.js configs:
+ * - compact (format: 'compact'): columnar series + the Chart.js template
+ *   from GET /plot-template (fetched once per page load)
+ * - legacy: plotData = complete Chart.js config as JSON string
+ *
+ * @file plotPayload.js
+ * @created 2026-10-18
+ */
+
+const API_BASE = 'http://127.0.0.1:8000';
+
+let templatePromise = null;
+
+/**
+ * Chart.js templates from the backend (memoized; retried after errors)
+ * @returns {Promise<object>} { version, templates }
+ */
+function loadTemplates() {
+  if (!templatePromise) {
+    templatePromise = fetch(`${API_BASE}/plot-template`)
+      .then(res => {
+        if (!res.ok) throw new Error('Plot-Template konnte nicht geladen werden.');
+        return res.json();
+      })
+      .catch(err => {
+        templatePromise = null;
+        throw err;
+      });
+  }
+  return templatePromise;
+}
+
+/**
+ * Decode one column: JSON array (null = gap) or base64 Float32 (NaN = gap)
+ * @param {Array|string} column
+ * @param {string} encoding - 'json' | 'float32'
+ * @returns {Array<number|null>}
+ */
+function decodeColumn(column, encoding) {
+  if (encoding !== 'float32') return column;
+  const bytes = Uint8Array.from(atob(column), c => c.charCodeAt(0));
+  const values = new Float32Array(bytes.buffer);
+  return Array.from(values, v => (Number.isNaN(v) ? null : v));
+}
+
+/**
+ * Fill a template with title, axis labels and view (mirrors plot_payload.fill_template)
+ */
+function fillOptions(template, plot) {
+  const options = structuredClone(template.options);
+  options.plugins.title.text = plot.title;
+  const axes = [['x', 'xLabel', 'xMin', 'xMax'], ['y', 'yLabel', 'yMin', 'yMax']];
+  for (const [axis, label, low, high] of axes) {
+    const scale = options.scales[axis];
+    scale.title.text = plot[label];
+    scale.min = plot.view[low];
+    scale.max = plot.view[high];
+  }
+  return options;
+}
+
+/**
+ * Chart.js config for a compact plot
+ * @param {object} plot - response.plot
+ * @param {boolean} retried - template already reloaded once
+ * @returns {Promise<object>} { type, data, options, ... }
+ */
+async function expandCompact(plot, retried = false) {
+  const { version, templates } = await loadTemplates();
+  if (version !== plot.templateVersion && !retried) {
+    // Backend wurde aktualisiert: Template einmal neu laden
+    templatePromise = null;
+    return expandCompact(plot, true);
+  }
+  const template = templates[plot.template];
+
+  const datasets = plot.series.map(series => {
+    const xs = decodeColumn(series.x, plot.encoding);
+    const ys = decodeColumn(series.y, plot.encoding);
+    const dataset = {
+      label: series.label,
+      data: xs.map((x, i) => ({ x, y: ys[i] })),
+      ...template.datasets[series.role]
+    };
+    if (series.colors) {
+      dataset.borderColor = series.colors;
+      dataset.backgroundColor = series.colors;
+    } else if (series.color) {
+      dataset.borderColor = series.color;
+      dataset.backgroundColor = series.color;
+    }
+    return dataset;
+  });
+
+  const config = { type: template.type, data: { datasets }, options: fillOptions(template, plot) };
+  for (const key of ['specialPoints', 'givenPoints', 'pointLabels']) {
+    if (key in plot) config[key] = plot[key];
+  }
+  return config;
+}
+
+/**
+ * Chart.js config from a /plot response (compact or legacy), or null
+ * @param {object} data - parsed /plot response
+ * @returns {Promise<object|null>}
+ */
+export async function toChartConfig(data) {
+  if (data.format === 'compact' && data.plot) {
+    return expandCompact(data.plot);
+  }
+  if (data.plotData) {
+    return JSON.parse(data.plotData);
+  }
+  return null;
+}
+
+export default { toChartConfig };